@@ -1,58 +1,148 @@
 import os
 import time
-import base64
-import threading
 
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, send_file
 from flask_socketio import SocketIO
 from datetime import datetime
 
-from camera import create_camera, list_available_cameras
-from config import MAX_FPS, SNAP_DIR, UPLOAD_URL, UPLOAD_API_KEY
+from camera_inventory import CameraInventory
+from camera_manager import CameraManager
+from motion import MotionCapture, parse_zones
+from recorder import Recorder
+from metrics import REGISTRY, STAGE_SECONDS, STREAM_BYTES, STREAM_SKIPPED
+from scheduler import Scheduler
+from config import CAMERA_ID, CAMERAS, WARM_CAMERAS, JPEG_QUALITY, MAX_FPS, STREAM_MAX_PENDING, MOTION_ENABLED, MOTION_UPLOAD
+from config import MOTION_CLIP_SEC, RECORD_UPLOAD, PREVIEW_ADAPTIVE, PREVIEW_LADDER, METRICS_ENABLED
+from streaming import MJPEG_BOUNDARY, FrameDelivery, frame_payload, mjpeg_part, parse_ladder, wants_binary
+from snapshot_store import UPLOAD_PENDING, UPLOAD_QUEUED, SnapshotStore, StoreAcks
+from burst import PICK_MODES, BurstWriter
+from thumbnails import ThumbnailCache
+from uploader import BulkSync, UploadQueue
 
 app = Flask(__name__)
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading")
-camera_lock = threading.Lock()
-camera = create_camera()
-camera.start()
-active_camera_id = getattr(camera, "camera_id", "default")
-last_emit = 0.0
+cameras = CameraManager()
+# 帯域の細いクライアントには縮小・低品質の段を送る。同じ段のクライアントは同じ JPEG を共有する
+delivery = FrameDelivery(MAX_FPS, parse_ladder(PREVIEW_LADDER, JPEG_QUALITY), adaptive=PREVIEW_ADAPTIVE)
 
 
-def _current_camera():
-    with camera_lock:
-        return camera
+def _open_startup_cameras():
+    # CAMERAS に並べたカメラを全部起動する（先頭が既定カメラ）。1台も開けなければ起動失敗
+    startup_ids = CAMERAS or [CAMERA_ID or None]
+    for cam_id in startup_ids:
+        try:
+            cameras.open(cam_id, pin=True)
+        except Exception as e:
+            if len(startup_ids) == 1:
+                raise
+            print(f"[WARN] camera {cam_id} failed to open:", e)
+    if not cameras.ids():
+        raise RuntimeError("no camera could be opened")
+    # WARM_CAMERAS は開いて収束させた状態で待機プールに置いておく（切替が速くなる）
+    for cam_id in WARM_CAMERAS:
+        try:
+            cameras.prewarm(cam_id)
+        except Exception as e:
+            print(f"[WARN] camera {cam_id} failed to prewarm:", e)
+
+
+_open_startup_cameras()
+
+# カメラ一覧はバックグラウンドで作ってキャッシュする。開いているデバイスはスキャンで開き直さない
+inventory = CameraInventory(busy=lambda: cameras.ids() + cameras.standby_ids())
+inventory.start()
+
+# アップロードはスプールに積んでバックグラウンドで送る（再起動しても未送信分は再開する）
+# スナップショットは日付ごとのディレクトリに保存し、SQLite の索引で管理する（保存期間・容量上限もここ）
+snapshots = SnapshotStore()
+# 一覧用サムネイルはバックグラウンドで1回だけ作り、ディスクにキャッシュする
+thumbs = ThumbnailCache()
+thumbs.start()
+# 連写はフレームをメモリに取り込んだ時点で応答し、JPEG 化と保存はこのワーカーで後から行う
+bursts = BurstWriter(snapshots, thumbs)
+
+# 送信済みの記録は索引の upload_state に持ち、キューとまとめ送信で共有して同じ画像を二度送らない
+acked = StoreAcks(snapshots)
+
+
+def _upload_finished(job):
+    # 送信をあきらめたジョブは未送信に戻す（まとめ送信の対象になり、保存期間の削除も止めない）
+    if job["state"] == "failed":
+        snapshots.mark_upload(job["file"], UPLOAD_PENDING)
+
+
+uploads = UploadQueue(acked=acked, on_finish=_upload_finished)
+uploads.start()
+bulk_sync = BulkSync(acked=acked, exclude=uploads.pending_files, store=snapshots)
+
+
+def _motion_captured(records):
+    # 動体検知で撮った画像（直前のフレーム + 検知後の連写）をアップロードキューへ
+    if not MOTION_UPLOAD or not uploads.url:
+        return
+    for record in records:
+        ts = datetime.fromtimestamp(record["taken_at"]).strftime("%Y%m%d_%H%M%S")
+        _queue_upload(record["path"], {"timestamp": ts, "filename": record["name"], "trigger": "motion"})
+
+
+def _recording_finished(path):
+    # 録画セグメントが閉じるたびに呼ばれる。RECORD_UPLOAD=1 ならアップロードキューへ
+    if RECORD_UPLOAD and uploads.url:
+        uploads.enqueue(path, {"filename": os.path.basename(path), "kind": "video"})
+
+
+# 録画（H.264 のセグメント動画・タイムラプス）。保存先は RECORD_DIR、合計が RECORD_MAX_MB を超えたら古い順に消す
+recorder = Recorder(on_segment=_recording_finished, exclude=uploads.pending_files)
+
+
+def _cameras_in_use():
+    # push 購読中と録画中のカメラは、しばらくフレームを読んでいなくても解放しない
+    ids = {cam_id for cam_id in delivery.camera_totals() if cam_id}
+    ids.update(s["camera"] for s in recorder.sessions() if s["state"] == "recording")
+    return ids
+
+
+cameras.in_use = _cameras_in_use
+
+
+def _motion_triggered(cam, event):
+    # MOTION_CLIP_SEC > 0 なら検知時に動画クリップも録る（録画中のカメラでは録らない）
+    if MOTION_CLIP_SEC <= 0:
+        return
+    try:
+        recorder.start(cam, camera_id=event["camera"], mode="clip", duration=MOTION_CLIP_SEC)
+    except RuntimeError as e:
+        print("[INFO] motion clip skipped:", e)
+
+
+# 動体検知はキャプチャループに差し込み、縮小した輝度画像だけを見る（MOTION_ENABLED=1 で起動時から有効）
+motion = MotionCapture(snapshots, bursts, thumbs, on_capture=_motion_captured, on_trigger=_motion_triggered)
+
+
+def _current_camera(camera_id=None):
+    # camera_id 省略時は既定カメラ。待機プールのカメラはその場で再開し、開いていない ID なら None
+    return cameras.get(camera_id, wake=True)
 
 
 def _active_camera_id():
-    with camera_lock:
-        return active_camera_id
+    return cameras.default_id
 
 
 def _switch_camera(target_id):
-    global camera, active_camera_id
-    new_cam = None
-    try:
-        new_cam = create_camera(target_id)
-        new_cam.start()
-    except Exception:
-        if new_cam:
-            try:
-                new_cam.stop()
-            except Exception:
-                pass
-        raise
-    old_cam = None
-    with camera_lock:
-        old_cam = camera
-        camera = new_cam
-        active_camera_id = getattr(new_cam, "camera_id", target_id or "default")
-    if old_cam:
-        try:
-            old_cam.stop()
-        except Exception:
-            pass
-    return active_camera_id
+    # 既定カメラを切り替える。他のカメラは止めずに動かし続ける
+    return cameras.activate(target_id)
+
+
+def _requested_camera_id():
+    # ?camera=ID または JSON の "camera" で対象カメラを指定（省略時は既定カメラ）
+    cam_id = request.args.get("camera")
+    if not cam_id and request.is_json:
+        cam_id = (request.get_json(silent=True) or {}).get("camera")
+    return cam_id or None
+
+
+if MOTION_ENABLED and _current_camera() is not None:
+    motion.attach(_current_camera(), _active_camera_id())
 
 @app.route("/")
 def index():
@@ -62,56 +152,408 @@ def index():
 def healthz():
     return "ok", 200
 
-# WebSocket: クライアントからの要求でフレームをPush
-@socketio.on("request_frame")
-def handle_request_frame(_msg):
-    global last_emit
-    now = time.time()
-    if (now - last_emit) < (1.0 / MAX_FPS):
-        return
-    cam = _current_camera()
-    if cam is None:
-        return
-    frame = cam.get_jpeg()
-    if frame:
-        b64 = base64.b64encode(frame).decode("ascii")
-        socketio.emit("frame", {"data": f"data:image/jpeg;base64,{b64}"})
-        last_emit = now
+@socketio.on("connect")
+def handle_connect():
+    delivery.connect(request.sid)
+
+
+@socketio.on("disconnect")
+def handle_disconnect(*_args):
+    delivery.disconnect(request.sid)
+
+# WebSocket: クライアントからの要求でフレームをPush（要求元のセッションにだけ送る）
+# {"binary": true} を送るクライアントには JPEG をバイナリ添付で返す（旧クライアントは base64）
+@socketio.on("request_frame")
+def handle_request_frame(msg):
+    msg = msg if isinstance(msg, dict) else {}
+    cam = _current_camera(msg.get("camera"))
+    if cam is None:
+        return
+    fps = msg.get("fps")
+    frame = delivery.next_frame(request.sid, cam.get_frame(), fps=fps)
+    if frame:
+        data = cam.encode_frame(frame, "preview")
+        if data:
+            started = time.perf_counter()
+            socketio.emit("frame", frame_payload(data, binary=wants_binary(msg)), to=request.sid)
+            STAGE_SECONDS.observe(time.perf_counter() - started, cam.camera_id, "emit")
+            STREAM_BYTES.inc(len(data), cam.camera_id, "socketio")
+            delivery.mark_sent(request.sid, len(data))
+
+
+def _pending_packets(sid):
+    # Engine.IO の送信キューに残っているパケット数（バイナリ1フレーム = 2パケット）
+    try:
+        eio_sid = socketio.server.manager.eio_sid_from_sid(sid, "/")
+        sock = socketio.server.eio.sockets.get(eio_sid)
+        return sock.queue.qsize() if sock is not None else 0
+    except Exception:
+        return 0
+
+
+def _hold_preview(held, cam):
+    # 視聴中のカメラにプレビューを要求しておくと、エンコード段が配信前に JPEG 化を済ませる（カメラ切替に追従）
+    if cam is not held:
+        if held is not None:
+            held.release_profile("preview")
+        if cam is not None:
+            cam.acquire_profile("preview")
+    return cam
+
+
+def _push_frames(sid):
+    state = delivery.client(sid)
+    held = None
+    stopped = False
+    try:
+        while state is not None:
+            if not state.subscribed:
+                # 抜ける判断と pushing の解除は subscribe と同じロックの中で: 間に来た subscribe を取りこぼさない
+                if delivery.stop_pushing(state):
+                    stopped = True
+                    break
+                continue
+            delay = state.next_due - time.monotonic()
+            if delay > 0:
+                socketio.sleep(delay)
+            cam = _current_camera(state.camera_id)
+            quality, scale = state.encoding()
+            # 画質や解像度を下げたクライアントは既定品質のプレビューを使わないので先回りさせない
+            uses_preview = scale >= 1.0 and (not quality or quality >= JPEG_QUALITY)
+            held = _hold_preview(held, cam if uses_preview else None)
+            if cam is None:
+                socketio.sleep(0.2)
+                continue
+            frame = cam.wait_for_frame(state.last_seq, timeout=1.0)
+            if frame is None or not state.subscribed:
+                continue
+            if _pending_packets(sid) > STREAM_MAX_PENDING:
+                # 前のフレームがまだ送り切れていない: 溜めずに捨てる
+                delivery.skip(sid, frame)
+                STREAM_SKIPPED.inc(1, cam.camera_id, "backpressure")
+                continue
+            frame = delivery.next_frame(sid, frame)
+            if frame is None:
+                STREAM_SKIPPED.inc(1, cam.camera_id, "rate")
+                continue
+            data = cam.get_jpeg_variant(frame, quality, scale)
+            if not data:
+                continue
+            # ack を返すクライアントは、届くまでの時間で段を上下する
+            started = time.perf_counter()
+            socketio.emit("frame", frame_payload(data, binary=state.binary, quality=quality or JPEG_QUALITY),
+                          to=sid, callback=delivery.ack_callback(sid))
+            STAGE_SECONDS.observe(time.perf_counter() - started, cam.camera_id, "emit")
+            STREAM_BYTES.inc(len(data), cam.camera_id, "socketio")
+            delivery.mark_sent(sid, len(data))
+    finally:
+        _hold_preview(held, None)
+        if state is not None and not stopped:
+            delivery.stop_pushing(state, force=True)
+
+
+# WebSocket: push モード。一度 subscribe すると新しいフレームをサーバから送り続ける
+@socketio.on("subscribe")
+def handle_subscribe(msg):
+    msg = msg if isinstance(msg, dict) else {}
+    sid = request.sid
+    previous = delivery.client(sid)
+    left = previous.camera_id if previous is not None and previous.subscribed else None
+    _state, started = delivery.subscribe(
+        sid,
+        fps=msg.get("fps"),
+        quality=msg.get("quality"),
+        binary=wants_binary(msg),
+        camera_id=msg.get("camera"),
+        adaptive=msg.get("adaptive"),
+        acks=msg.get("ack"),
+    )
+    if started:
+        socketio.start_background_task(_push_frames, sid)
+    if left and left != (msg.get("camera") or None):
+        socketio.start_background_task(_park_left_camera)
+
+
+def _park_left_camera():
+    # 視聴者が離れたカメラは、他に読む人がいなければ少し待ってから待機プールへ（プールが無ければ解放）
+    socketio.sleep(cameras.UNWATCHED_GRACE + 0.5)
+    cameras.park_idle()
+
+
+@socketio.on("unsubscribe")
+def handle_unsubscribe(*_args):
+    state = delivery.client(request.sid)
+    delivery.unsubscribe(request.sid)
+    if state is not None and state.camera_id:
+        socketio.start_background_task(_park_left_camera)
+
+def _mjpeg_frames(fps, camera_id=None):
+    # 接続ごとのジェネレータ。エンコード済みフレームを全視聴者で共有し、送る間隔だけ個別に制御する
+    interval = 1.0 / fps
+    next_due = 0.0
+    last_seq = 0
+    held = None
+    try:
+        while True:
+            delay = next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            cam = _current_camera(camera_id)
+            held = _hold_preview(held, cam)
+            if cam is None:
+                time.sleep(0.2)
+                continue
+            frame = cam.wait_for_frame(last_seq, timeout=1.0)
+            if frame is None:
+                continue
+            last_seq = frame.seq
+            data = cam.encode_frame(frame, "preview")
+            if not data:
+                continue
+            now = time.monotonic()
+            next_due = max(next_due, now - interval) + interval
+            # yield から戻るまで = サーバがこのパートを書き終えるまで
+            started = time.perf_counter()
+            yield mjpeg_part(data)
+            STAGE_SECONDS.observe(time.perf_counter() - started, cam.camera_id, "emit")
+            STREAM_BYTES.inc(len(data), cam.camera_id, "mjpeg")
+    finally:
+        # クライアント切断でジェネレータが閉じられたら要求を取り下げる
+        _hold_preview(held, None)
+
+
+# HTTP MJPEG: NVR / ffmpeg / VLC / <img> から Socket.IO なしで視聴できる（?camera=ID でカメラ指定）
+@app.route("/stream.mjpg")
+def stream_mjpg():
+    fps = request.args.get("fps", type=float) or MAX_FPS
+    fps = max(0.1, min(MAX_FPS, fps))
+    camera_id = _requested_camera_id()
+    if camera_id and _current_camera(camera_id) is None:
+        return jsonify({"ok": False, "error": "unknown_camera"}), 404
+    return Response(
+        _mjpeg_frames(fps, camera_id),
+        mimetype=f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}",
+        headers={"Cache-Control": "no-cache, no-store", "Pragma": "no-cache"},
+    )
+
+# push 配信中のクライアントごとの段（品質・縮小率）、送信量、転送時間
+@app.route("/api/stream/clients")
+def api_stream_clients():
+    return jsonify({"ok": True, "ladder": delivery.ladder, "adaptive": delivery.adaptive, "clients": delivery.stats()})
+
+def _take_snapshot(camera_id=None):
+    # 静止画を撮って索引付きで保存する。返り値は (結果の dict, HTTP ステータス)
+    cam = _current_camera(camera_id)
+    if cam is None:
+        return {"ok": False, "error": "no_camera"}, 503
+    data = cam.capture_jpeg("still")
+    if not data:
+        return {"ok": False, "error": "no_frame"}, 503
+    record = snapshots.save(data, camera_id=camera_id or _active_camera_id(), settings=cam.get_adjustments())
+    thumbs.submit(record)  # 一覧で開かれる前に作っておく
+    # ファイル名: YYYY/MM/DD/capture_YYYYMMDD_HHMMSS_mmm.jpg（同じミリ秒なら -1, -2 ... を付ける）
+    ts = datetime.fromtimestamp(record["taken_at"]).strftime("%Y%m%d_%H%M%S")
+    return {"ok": True, "id": record["id"], "path": record["path"], "filename": record["name"], "timestamp": ts}, 200
 
 @app.route("/api/capture", methods=["POST", "GET"])
-def api_capture():
-    # ファイル名: capture_YYYYMMDD_HHMMSS.jpg
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"capture_{ts}.jpg"
-    path = os.path.join(SNAP_DIR, filename)
-    cam = _current_camera()
-    if cam is None:
-        return jsonify({"ok": False, "error": "no_camera"}), 503
-    saved = cam.save_snapshot(path)
-    if not saved:
-        return jsonify({"ok": False, "error": "no_frame"}), 503
-    return jsonify({"ok": True, "path": saved, "filename": filename, "timestamp": ts})
+def api_capture():
+    result, status = _take_snapshot(_requested_camera_id())
+    return jsonify(result), status
 
 @app.route("/api/upload_latest", methods=["POST"])
 def api_upload_latest():
-    latest = sorted([f for f in os.listdir(SNAP_DIR) if f.endswith(".jpg")])[-1:]
-    if not latest:
+    # 最新の1枚は索引から引く（ディレクトリ走査なし）
+    latest = snapshots.latest(_requested_camera_id())
+    if latest is None:
         return jsonify({"ok": False, "error": "no_snapshot"}), 404
-    return _upload_file(os.path.join(SNAP_DIR, latest[0]))
+    return _enqueue_upload(latest["path"])
 
 @app.route("/api/capture_and_upload", methods=["POST"])
-def api_capture_and_upload():
-    # 撮影 → 直ちにアップロード
-    c = api_capture()
-    if c.status_code and c.status_code != 200:  # Flask Response 互換
-        return c
-    js = c.get_json()
-    path = js.get("path")
-    return _upload_file(path, extra=js)
+def api_capture_and_upload():
+    # 撮影 → アップロードキューに積んで即座にジョブ ID を返す（送信結果は /api/uploads/<id>）
+    result, status = _take_snapshot(_requested_camera_id())
+    if status != 200:
+        return jsonify(result), status
+    return _enqueue_upload(result["path"], extra=result)
+
+# 連写: {"count": N} でN枚、{"duration": 秒} でその間の全フレームをセンサーの最大レートで撮る
+# "pick": "sharpest" なら一番ピントの合った1枚だけを保存する。保存の進み具合は status_url で見る
+@app.route("/api/capture/burst", methods=["POST"])
+def api_capture_burst():
+    payload = request.get_json(silent=True) or {}
+    pick = payload.get("pick", "all")
+    if pick not in PICK_MODES:
+        return jsonify({"ok": False, "error": f"pick must be one of {', '.join(PICK_MODES)}"}), 400
+    try:
+        count = int(payload["count"]) if payload.get("count") is not None else None
+        duration = float(payload["duration"]) if payload.get("duration") is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "count/duration must be numbers"}), 400
+    if count is None and duration is None:
+        return jsonify({"ok": False, "error": "count or duration required"}), 400
+    camera_id = _requested_camera_id()
+    cam = _current_camera(camera_id)
+    if cam is None:
+        return jsonify({"ok": False, "error": "no_camera"}), 503
+    try:
+        burst = cam.burst(count=count, duration=duration)
+    except RuntimeError as e:
+        return jsonify({"ok": False, "error": str(e)}), 409
+    if not len(burst):
+        return jsonify({"ok": False, "error": "no_frame"}), 503
+    job_id = bursts.submit(cam, burst, camera_id=camera_id or _active_camera_id(), pick=pick)
+    fps = burst.fps()
+    return jsonify({
+        "ok": True,
+        "burst": job_id,
+        "captured": len(burst),
+        "fps": round(fps, 2) if fps else None,
+        "status_url": f"/api/capture/burst/{job_id}",
+    }), 202
+
+@app.route("/api/capture/burst/<job_id>")
+def api_capture_burst_status(job_id):
+    job = bursts.status(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "unknown_burst"}), 404
+    job["records"] = [_snapshot_info(r) for r in job["records"]]
+    return jsonify({"ok": True, "burst": job})
+
+def _snapshot_info(record):
+    return {
+        "id": record["id"],
+        "name": record["name"],
+        "taken_at": record["taken_at"],
+        "camera": record["camera_id"],
+        "size": record["size"],
+        "upload_state": record["upload_state"],
+        "thumb": f"/api/snapshots/{record['id']}/thumb",
+        "image": f"/api/snapshots/{record['id']}/image",
+    }
+
+# スナップショット一覧（新しい順）。次のページは返ってきた next を ?before= に渡す
+@app.route("/api/snapshots")
+def api_snapshots():
+    records, next_cursor = snapshots.query(
+        limit=request.args.get("limit", 50, type=int),
+        before=request.args.get("before", type=int),
+        camera_id=request.args.get("camera"),
+        since=request.args.get("since", type=float),
+        until=request.args.get("until", type=float),
+        upload_state=request.args.get("upload_state"),
+    )
+    return jsonify({"ok": True, "items": [_snapshot_info(r) for r in records], "next": next_cursor})
+
+def _immutable_jpeg(path, etag):
+    # スナップショットは保存後に変わらないので、ETag が一致すれば本体を送らない（304）
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = send_file(path, mimetype="image/jpeg", conditional=False, etag=False)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, max-age=86400, immutable"
+    return resp
+
+@app.route("/api/snapshots/<int:snapshot_id>/thumb")
+def api_snapshot_thumb(snapshot_id):
+    record = snapshots.get(snapshot_id)
+    if record is None:
+        return jsonify({"ok": False, "error": "unknown_snapshot"}), 404
+    etag = thumbs.etag(record)
+    if request.if_none_match.contains(etag):
+        return _immutable_jpeg(None, etag)
+    path = thumbs.get(record)
+    if path is None:
+        return jsonify({"ok": False, "error": "thumbnail_failed"}), 503
+    return _immutable_jpeg(path, etag)
+
+@app.route("/api/snapshots/<int:snapshot_id>/image")
+def api_snapshot_image(snapshot_id):
+    record = snapshots.get(snapshot_id)
+    if record is None or not os.path.exists(record["path"]):
+        return jsonify({"ok": False, "error": "unknown_snapshot"}), 404
+    return _immutable_jpeg(record["path"], f"{record['id']}-{record['size']}")
+
+# 動体検知の状態と設定。{"enabled": true/false} で開始・停止、zones/threshold などは実行中に変更できる
+@app.route("/api/motion", methods=["GET", "POST"])
+def api_motion():
+    if request.method == "GET":
+        return jsonify({"ok": True, "motion": motion.stats()})
+    payload = request.get_json(silent=True) or {}
+    zones = payload.get("zones")
+    try:
+        if isinstance(zones, list):
+            zones = parse_zones(";".join(
+                f"{z['x']},{z['y']},{z['w']},{z['h']}" + (f":{z['min_area']}" if z.get("min_area") is not None else "")
+                for z in zones
+            ))
+        elif zones is not None:
+            zones = parse_zones(str(zones))
+        motion.configure(
+            zones=zones,
+            threshold=payload.get("threshold"),
+            alpha=payload.get("alpha"),
+            cooldown=payload.get("cooldown"),
+            post_frames=payload.get("post_frames"),
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"ok": False, "error": f"invalid motion settings: {e}"}), 400
+    if payload.get("enabled") is True:
+        camera_id = _requested_camera_id()
+        cam = _current_camera(camera_id)
+        if cam is None:
+            return jsonify({"ok": False, "error": "no_camera"}), 503
+        motion.attach(cam, camera_id or _active_camera_id())
+    elif payload.get("enabled") is False:
+        motion.detach()
+    return jsonify({"ok": True, "motion": motion.stats()})
+
+# 録画の一覧（セッション・ファイル・ディスク使用量）と開始
+# {"mode": "video" | "clip" | "timelapse", "duration", "interval", "fps", "segment_sec", "segment_mb", "camera"}
+@app.route("/api/recordings", methods=["GET", "POST"])
+def api_recordings():
+    if request.method == "GET":
+        return jsonify({"ok": True, "sessions": recorder.sessions(), "files": recorder.files(), "stats": recorder.stats()})
+    payload = request.get_json(silent=True) or {}
+    camera_id = _requested_camera_id()
+    cam = _current_camera(camera_id)
+    if cam is None:
+        return jsonify({"ok": False, "error": "no_camera"}), 503
+    try:
+        numbers = {k: float(payload[k]) for k in ("duration", "interval", "fps", "segment_sec", "segment_mb")
+                   if payload.get(k) is not None}
+        session = recorder.start(cam, camera_id=camera_id or _active_camera_id(),
+                                 mode=payload.get("mode", "video"), **numbers)
+    except (TypeError, ValueError) as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"ok": False, "error": str(e)}), 409
+    return jsonify({"ok": True, "recording": session, "status_url": f"/api/recordings/{session['id']}"}), 201
+
+@app.route("/api/recordings/<session_id>")
+def api_recording(session_id):
+    session = recorder.get(session_id)
+    if session is None:
+        return jsonify({"ok": False, "error": "unknown_recording"}), 404
+    return jsonify({"ok": True, "recording": session})
+
+@app.route("/api/recordings/<session_id>/stop", methods=["POST"])
+def api_recording_stop(session_id):
+    if not recorder.stop(session_id):
+        return jsonify({"ok": False, "error": "unknown_recording"}), 404
+    return jsonify({"ok": True, "recording": recorder.get(session_id)})
+
+# 録画ファイルのダウンロード（書き込み中のセグメントは返さない）
+@app.route("/api/recordings/files/<name>")
+def api_recording_file(name):
+    path = recorder.path(name)
+    if path is None:
+        return jsonify({"ok": False, "error": "unknown_file"}), 404
+    return send_file(path, as_attachment=request.args.get("download") == "1")
 
 @app.route("/api/settings", methods=["GET", "POST"])
 def api_settings():
-    cam = _current_camera()
+    cam = _current_camera(_requested_camera_id())
     if cam is None:
         return jsonify({"ok": False, "error": "no_camera"}), 503
     if request.method == "GET":
@@ -133,41 +575,219 @@ def api_settings():
     return jsonify({"ok": True, "settings": cam.get_adjustments()})
 
 
+def _open_camera_stats():
+    # 動作中カメラごとの予算・キャプチャ/エンコード統計に、配信先の数と送信量を足す
+    totals = delivery.camera_totals()
+    result = []
+    for entry in cameras.stats():
+        streaming = {"clients": 0, "frames_sent": 0, "bytes_sent": 0, "bytes_per_s": 0}
+        # カメラ未指定のクライアントは既定カメラを見ている
+        keys = [entry["id"], None] if entry["default"] else [entry["id"]]
+        for cam_id in keys:
+            for key, value in totals.get(cam_id, {}).items():
+                streaming[key] += value
+        entry["streaming"] = streaming
+        result.append(entry)
+    return result
+
+
 @app.route("/api/cameras", methods=["GET", "POST"])
 def api_cameras():
     if request.method == "GET":
+        # ?refresh=1 で再スキャンを要求（結果は次回以降の GET に反映）
+        if request.args.get("refresh"):
+            inventory.refresh()
+        cam = _current_camera()
         return jsonify(
             {
                 "ok": True,
-                "cameras": list_available_cameras(),
+                "cameras": inventory.cameras(),
+                "inventory": inventory.stats(),
                 "active": _active_camera_id(),
+                "stats": cam.stats() if cam is not None else None,
+                "open": _open_camera_stats(),
+                "switch": cameras.switch_stats(),
             }
         )
+    # {"id": ...} で既定カメラを切替、"action": "open" / "close" で追加起動・停止
+    # close は待機プールへ退避（"release": true ならデバイスも解放）
     payload = request.get_json(silent=True) or {}
     target = payload.get("id") or payload.get("camera_id")
     if not target:
         return jsonify({"ok": False, "error": "missing_id"}), 400
+    action = payload.get("action", "activate")
     try:
-        active = _switch_camera(target)
+        if action == "open":
+            cameras.switch(target, make_default=False)
+        elif action == "close":
+            if not cameras.close(target, keep_warm=not payload.get("release")):
+                return jsonify({"ok": False, "error": "unknown_camera"}), 404
+        else:
+            _switch_camera(target)
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 400
-    return jsonify({"ok": True, "active": active})
+    return jsonify(
+        {
+            "ok": True,
+            "active": _active_camera_id(),
+            "open": cameras.ids(),
+            "standby": cameras.standby_ids(),
+            "last_switch": cameras.last_switch(),
+        }
+    )
+
+@app.route("/api/uploads")
+def api_uploads():
+    return jsonify({"ok": True, "stats": uploads.stats(), "sync": bulk_sync.stats()})
+
+# 回線断の間に溜まった未送信スナップショットをまとめて送る（{"action": "stop"} で中断）
+@app.route("/api/uploads/sync", methods=["GET", "POST"])
+def api_uploads_sync():
+    if request.method == "GET":
+        return jsonify({"ok": True, "sync": bulk_sync.stats(), "backlog": len(bulk_sync.backlog())})
+    if not bulk_sync.url:
+        return jsonify({"ok": False, "error": "UPLOAD_URL not set"}), 400
+    payload = request.get_json(silent=True) or {}
+    if payload.get("action") == "stop":
+        bulk_sync.stop(timeout=0)
+        return jsonify({"ok": True, "sync": bulk_sync.stats()})
+    started = bulk_sync.start()
+    return jsonify({"ok": True, "started": started, "sync": bulk_sync.stats()}), 202
+
+@app.route("/api/uploads/<job_id>")
+def api_upload_status(job_id):
+    job = uploads.status(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "unknown_job"}), 404
+    return jsonify({"ok": True, "job": job})
+
+def _queue_upload(path, fields=None):
+    # アップロードキューに積み、索引を送信待ちにする。返り値はジョブ ID
+    # 送信待ちは積む前に書く: すぐ失敗したジョブの「未送信」を後から上書きしない
+    name = os.path.basename(path)
+    snapshots.mark_upload(name, UPLOAD_QUEUED)
+    try:
+        job_id = uploads.enqueue(path, fields or {})
+    except Exception:
+        snapshots.mark_upload(name, UPLOAD_PENDING)
+        raise
+    snapshots.set_upload_job(name, job_id)
+    return job_id
+
+def _upload_fields(result):
+    return {"timestamp": result["timestamp"], "filename": result["filename"]} if "timestamp" in result else {}
 
-def _upload_file(path, extra=None):
-    if not UPLOAD_URL:
+def _enqueue_upload(path, extra=None):
+    if not uploads.url:
         return jsonify({"ok": False, "error": "UPLOAD_URL not set"}), 400
-    import requests
-    headers = {}
-    if UPLOAD_API_KEY:
-        headers["Authorization"] = f"Bearer {UPLOAD_API_KEY}"  # 必要に応じて調整
-    with open(path, "rb") as f:
-        files = {"file": (os.path.basename(path), f, "image/jpeg")}
-        data = {}
-        if extra and "timestamp" in extra:
-            data["timestamp"] = extra["timestamp"]
-            data["filename"]  = extra["filename"]
-        r = requests.post(UPLOAD_URL, headers=headers, files=files, data=data, timeout=20)
-    return jsonify({"ok": r.ok, "status": r.status_code, "text": r.text[:200], "sent": os.path.basename(path)}), (200 if r.ok else 502)
+    job_id = _queue_upload(path, _upload_fields(extra or {}))
+    return jsonify({"ok": True, "job": job_id, "queued": os.path.basename(path), "status_url": f"/api/uploads/{job_id}"}), 202
+
+
+def _run_schedule(entry):
+    # 定時撮影: 動いているカメラから撮るので、カメラの起動やウォームアップを待たず、デバイスの取り合いも起きない
+    result, status = _take_snapshot(entry["camera"])
+    if status != 200:
+        raise RuntimeError(result["error"])
+    if entry["task"] == "capture_and_upload" and uploads.url:
+        result["job"] = _queue_upload(result["path"], _upload_fields(result))
+    return result
+
+
+# cron 形式の定時撮影（cron + capture_and_send.py の代わり）。スケジュールは SCHEDULE_FILE に保存される
+scheduler = Scheduler(_run_schedule)
+scheduler.start()
+
+@app.route("/api/schedules", methods=["GET", "POST"])
+def api_schedules():
+    if request.method == "GET":
+        return jsonify({"ok": True, "schedules": scheduler.list()})
+    # {"cron": "0 7,17 * * *", "task": "capture_and_upload" | "capture", "camera", "jitter", "catch_up", "enabled"}
+    payload = request.get_json(silent=True) or {}
+    if not payload.get("cron"):
+        return jsonify({"ok": False, "error": "cron required"}), 400
+    try:
+        entry = scheduler.add(
+            payload["cron"],
+            task=payload.get("task", "capture_and_upload"),
+            camera=payload.get("camera"),
+            jitter=payload.get("jitter"),
+            catch_up=payload.get("catch_up"),
+            enabled=payload.get("enabled", True),
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify({"ok": True, "schedule": entry}), 201
+
+@app.route("/api/schedules/<schedule_id>", methods=["GET", "POST", "DELETE"])
+def api_schedule(schedule_id):
+    if request.method == "DELETE":
+        if not scheduler.remove(schedule_id):
+            return jsonify({"ok": False, "error": "unknown_schedule"}), 404
+        return jsonify({"ok": True})
+    if request.method == "GET":
+        entry = scheduler.get(schedule_id)
+    else:
+        # 送ったフィールドだけ変更する（"camera": null で既定カメラに戻す）
+        payload = request.get_json(silent=True) or {}
+        fields = {k: payload[k] for k in ("cron", "task", "camera", "jitter", "catch_up", "enabled") if k in payload}
+        try:
+            entry = scheduler.update(schedule_id, **fields)
+        except (TypeError, ValueError) as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+    if entry is None:
+        return jsonify({"ok": False, "error": "unknown_schedule"}), 404
+    return jsonify({"ok": True, "schedule": entry})
+
+# スケジュールを今すぐ1回実行する（結果は GET /api/schedules/<id> の last_result）
+@app.route("/api/schedules/<schedule_id>/run", methods=["POST"])
+def api_schedule_run(schedule_id):
+    if scheduler.get(schedule_id) is None:
+        return jsonify({"ok": False, "error": "unknown_schedule"}), 404
+    if not scheduler.run_now(schedule_id):
+        return jsonify({"ok": False, "error": "already_running"}), 409
+    return jsonify({"ok": True, "status_url": f"/api/schedules/{schedule_id}"}), 202
+
+def _camera_metric(read):
+    # 動作中のカメラごとに stats から値を取り出す（スクレイプ時だけ呼ばれる）
+    return [((entry["id"],), read(entry["stats"])) for entry in cameras.stats()]
+
+
+def _upload_metric(key):
+    return lambda: [((), uploads.stats()[key])]
+
+
+REGISTRY.callback("raspicam_camera_fps", "Achieved capture FPS.", ("camera",),
+                  lambda: _camera_metric(lambda s: s["capture"]["fps"]))
+REGISTRY.callback("raspicam_frames_captured_total", "Frames captured.", ("camera",),
+                  lambda: _camera_metric(lambda s: s["frames_captured"]), type="counter")
+REGISTRY.callback("raspicam_frames_dropped_total", "Frames dropped by the capture pacer or the encode queue.",
+                  ("camera", "stage"), lambda: [
+                      ((entry["id"], stage), value) for entry in cameras.stats() for stage, value in (
+                          ("capture", entry["stats"]["capture"]["dropped"]),
+                          ("encode", (entry["stats"]["encode_stage"] or {}).get("dropped", 0)),
+                      )
+                  ], type="counter")
+REGISTRY.callback("raspicam_stream_clients", "Subscribed preview clients.", ("camera",),
+                  lambda: [((entry["id"],), entry["streaming"]["clients"]) for entry in _open_camera_stats()])
+REGISTRY.callback("raspicam_upload_queue_depth", "Uploads waiting to be sent.", (), _upload_metric("queued"))
+REGISTRY.callback("raspicam_uploads_in_flight", "Uploads being sent.", (), _upload_metric("in_flight"))
+REGISTRY.callback("raspicam_uploads_total", "Uploads sent and failed, and retries scheduled.", ("result",), lambda: [
+    ((result,), uploads.stats()[key]) for result, key in (("sent", "sent"), ("failed", "failed"), ("retry", "retries"))
+], type="counter")
+REGISTRY.callback("raspicam_upload_bytes_total", "Bytes uploaded.", (), _upload_metric("bytes_sent"), type="counter")
+REGISTRY.callback("raspicam_motion_triggers_total", "Motion detections.", (),
+                  lambda: [((), motion.triggers)], type="counter")
+REGISTRY.callback("raspicam_recordings_active", "Recording sessions running.", (),
+                  lambda: [((), recorder.stats()["recording"])])
+
+
+# Prometheus 形式のメトリクス（各段の時間のヒストグラム、FPS、ドロップ、クライアント数、送信量、アップロード）
+@app.route("/metrics")
+def metrics():
+    if not METRICS_ENABLED:
+        return jsonify({"ok": False, "error": "METRICS_ENABLED=0"}), 404
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     socketio.run(app, host="0.0.0.0", port=5000)
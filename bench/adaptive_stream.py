@@ -0,0 +1,132 @@
+"""Adaptive preview: rung each simulated link settles on, and encodes per frame.
+
+Runs the synthetic camera at --fps and serves every frame to a set of
+simulated viewers through the same pieces the push loop uses: a
+ClientState with a RateAdapter picks the rung, CameraBase.get_jpeg_variant
+encodes it (cached on the frame, shared by viewers on the same rung), and
+frames the link is still busy with are skipped as backpressure.
+
+Each link is a FIFO with a bandwidth and a round-trip time: a frame's ack
+arrives when its last byte has gone through plus the RTT. The clients:
+
+  lan      50 MB/s,   2 ms     wifi   1.5 MB/s, 10 ms
+  lan2     50 MB/s,   2 ms     weak   300 KB/s, 20 ms
+  lte     150 KB/s,  80 ms
+
+Reported over the last --measure seconds: rung, quality/scale, delivered
+fps and bytes/s, median delivery time, and how many encodes each frame
+cost compared with the number of viewers. Fails when a client's median
+delivery time exceeds two frame intervals or a frame costs more encodes
+than there are distinct rungs in use.
+
+    python bench/adaptive_stream.py --seconds 15 --measure 5 --fps 15
+"""
+import argparse
+import heapq
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from camera import SyntheticCamera
+from config import JPEG_QUALITY, PREVIEW_LADDER
+from streaming import ClientState, parse_ladder
+
+LINKS = (
+    ("lan", 50e6, 0.002),
+    ("lan2", 50e6, 0.002),
+    ("wifi", 1.5e6, 0.010),
+    ("weak", 300e3, 0.020),
+    ("lte", 150e3, 0.080),
+)
+
+
+class Link:
+    def __init__(self, name, bandwidth, rtt, fps, ladder):
+        self.name = name
+        self.bandwidth = bandwidth
+        self.rtt = rtt
+        self.state = ClientState(name, fps, ladder)
+        self.state.set_fps(fps)
+        self.state.set_adaptive(True)
+        self.state.acks = True
+        self.busy_until = 0.0
+        self.acks = []  # heap of (ack time, sent time)
+        self.log = []  # (sent time, bytes, delay, skipped)
+
+    def deliver_acks(self, now):
+        while self.acks and self.acks[0][0] <= now:
+            acked_at, sent_at = heapq.heappop(self.acks)
+            self.state.adapter.delivered(acked_at - sent_at, self.state.interval, now=acked_at)
+
+    def send(self, cam, frame, now):
+        self.deliver_acks(now)
+        # Backpressure, like STREAM_MAX_PENDING: the link still holds more than two frames' worth
+        if self.busy_until - now > 2 * self.state.interval:
+            self.state.adapter.congested(now)
+            self.log.append((now, 0, None, True))
+            return
+        quality, scale = self.state.encoding()
+        data = cam.get_jpeg_variant(frame, quality, scale)
+        start = max(now, self.busy_until)
+        self.busy_until = start + len(data) / self.bandwidth
+        acked_at = self.busy_until + self.rtt
+        heapq.heappush(self.acks, (acked_at, now))
+        self.log.append((now, len(data), acked_at - now, False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=15.0)
+    parser.add_argument("--measure", type=float, default=5.0)
+    parser.add_argument("--fps", type=float, default=15.0)
+    args = parser.parse_args()
+
+    ladder = parse_ladder(PREVIEW_LADDER, JPEG_QUALITY)
+    cam = SyntheticCamera(fps=args.fps)
+    cam.start()
+    cam.wait_ready(5.0)
+    links = [Link(name, bw, rtt, args.fps, ladder) for name, bw, rtt in LINKS]
+
+    start = time.monotonic()
+    last_seq = 0
+    per_frame = []  # (time, encodes for that frame, distinct rungs)
+    while time.monotonic() - start < args.seconds:
+        frame = cam.wait_for_frame(last_seq, timeout=1.0)
+        if frame is None:
+            continue
+        last_seq = frame.seq
+        now = time.monotonic()
+        before = sum(v for k, v in cam.encode_counts.items() if k.startswith("preview"))
+        for link in links:
+            link.send(cam, frame, now)
+        encodes = sum(v for k, v in cam.encode_counts.items() if k.startswith("preview")) - before
+        rungs = {link.state.encoding() for link in links if link.log[-1][3] is False}
+        per_frame.append((now, encodes, len(rungs)))
+    cam.stop()
+
+    since = time.monotonic() - args.measure
+    failed = False
+    print(f"ladder: {', '.join(f'{s:g}:{q}' for s, q in ladder)}; {args.fps:g} fps, last {args.measure:g} s")
+    print(f"{'client':>6} {'rung':>4} {'q':>3} {'scale':>5} {'fps':>5} {'KB/s':>7} {'delay p50':>10} {'down':>4} {'up':>3}")
+    for link in links:
+        recent = [entry for entry in link.log if entry[0] >= since]
+        sent = [entry for entry in recent if not entry[3]]
+        delays = sorted(entry[2] for entry in sent)
+        p50 = delays[len(delays) // 2] if delays else float("inf")
+        quality, scale = link.state.encoding()
+        print(f"{link.name:>6} {link.state.adapter.rung:>4} {quality:>3} {scale:>5g} {len(sent) / args.measure:5.1f} "
+              f"{sum(e[1] for e in sent) / args.measure / 1024:7.0f} {p50 * 1000:7.0f} ms "
+              f"{link.state.adapter.steps_down:>4} {link.state.adapter.steps_up:>3}")
+        failed |= p50 > 2.0 / args.fps
+    recent = [entry for entry in per_frame if entry[0] >= since]
+    encodes = sum(e for _, e, _ in recent) / max(1, len(recent))
+    rungs = sum(r for _, _, r in recent) / max(1, len(recent))
+    print(f"encodes per frame: {encodes:.2f} for {len(links)} viewers on {rungs:.2f} rungs")
+    failed |= any(e > r for _, e, r in recent)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Software adjustments: fused LUT engine vs. the chained ImageEnhance passes.
+
+Checks that AdjustmentEngine stays pixel-equivalent (within a tolerance) to
+the former Pillow chain and reports the per-frame speedup on synthetic frames.
+
+    python bench/adjustments.py --size 1280x720
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from camera import AdjustmentEngine, _synthetic_rgb
+
+CASES = [
+    {"contrast": 1.4},
+    {"iso": 200.0},
+    {"ev": -1.0},
+    {"saturation": 1.8},
+    {"contrast": 1.3, "iso": 150.0, "ev": 0.5, "saturation": 1.5},
+    {"contrast": 0.7, "iso": 80.0, "ev": -0.5, "saturation": 0.6, "sharpness": 1.5},
+]
+
+
+def pillow_chain(img, adj):
+    """The ImageEnhance chain CameraBase used before AdjustmentEngine."""
+    contrast = adj.get("contrast", 1.0)
+    if abs(contrast - 1.0) > 0.01:
+        img = ImageEnhance.Contrast(img).enhance(contrast)
+    iso_factor = adj.get("iso", 100.0) / 100.0
+    if abs(iso_factor - 1.0) > 0.01:
+        img = ImageEnhance.Brightness(img).enhance(iso_factor)
+    ev = adj.get("ev", 0.0)
+    if abs(ev) > 0.01:
+        img = ImageEnhance.Brightness(img).enhance(pow(2.0, ev))
+    saturation = adj.get("saturation", 1.0)
+    if abs(saturation - 1.0) > 0.01:
+        img = ImageEnhance.Color(img).enhance(saturation)
+    sharpness = adj.get("sharpness", 1.0)
+    if abs(sharpness - 1.0) > 0.01:
+        img = ImageEnhance.Sharpness(img).enhance(sharpness)
+    return img
+
+
+def timed(fn, runs):
+    fn()
+    started = time.perf_counter()
+    for _ in range(runs):
+        out = fn()
+    return (time.perf_counter() - started) / runs * 1000.0, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--tolerance", type=int, default=3, help="max allowed |diff| per channel")
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.lower().split("x"))
+    arr = _synthetic_rgb(width, height)
+    failed = False
+    print(f"{'settings':<58} {'chain':>9} {'fused':>9} {'speedup':>8} {'max diff':>9}")
+    for adj in CASES:
+        engine = AdjustmentEngine(adj)
+        chain_ms, ref = timed(lambda: np.asarray(pillow_chain(Image.fromarray(arr, mode="RGB"), adj)), args.runs)
+        fused_ms, out = timed(lambda: engine.apply(arr), args.runs)
+        diff = int(np.abs(ref.astype(np.int16) - out.astype(np.int16)).max())
+        failed |= diff > args.tolerance
+        label = ", ".join(f"{k}={v}" for k, v in adj.items())
+        print(f"{label:<58} {chain_ms:7.2f}ms {fused_ms:7.2f}ms {chain_ms / fused_ms:7.1f}x {diff:9d}")
+    if failed:
+        print(f"FAIL: difference above tolerance {args.tolerance}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
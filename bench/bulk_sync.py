@@ -0,0 +1,112 @@
+"""Backlog catch-up: one request per snapshot vs batched multipart / tar.
+
+Fills a temporary SNAP_DIR with --files snapshots and syncs it to the local
+stand-in server from bench/upload_queue.py: first through the upload queue
+(one POST per file), then with BulkSync in multipart and tar mode. A rate
+limited run checks that the achieved rate stays under --rate-kbps, and an
+interrupted sync is resumed to check that the ack index prevents any file
+from being sent twice.
+
+    python bench/bulk_sync.py --files 200 --batch 20 --rate-kbps 2048
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from upload_queue import StandIn, make_files
+from uploader import AckIndex, BulkSync, UploadQueue
+
+
+def backlog_dir(root, count, size):
+    folder = tempfile.mkdtemp(dir=root)
+    paths = make_files(folder, count, size)
+    old = time.time() - 3600
+    for path in paths:
+        os.utime(path, (old, old))
+    return folder, {os.path.basename(p) for p in paths}
+
+
+def bulk(server, folder, fmt, batch, rate_kbps, fail_after=None):
+    sync = BulkSync(snap_dir=folder, url=server.url, api_key="", acked=AckIndex(os.path.join(folder, ".acked")),
+                    fmt=fmt, batch_files=batch, batch_mb=64, rate_kbps=rate_kbps,
+                    max_attempts=0, backoff_base=0.05, backoff_max=0.5)
+    start = time.perf_counter()
+    sync.start()
+    if fail_after is not None:
+        time.sleep(fail_after)
+        sync.stop()
+    else:
+        sync._thread.join()
+    return sync, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--size-kb", type=int, default=150)
+    parser.add_argument("--batch", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--fail-rate", type=float, default=0.05)
+    parser.add_argument("--rate-kbps", type=float, default=2048.0)
+    args = parser.parse_args()
+
+    server = StandIn(args.fail_rate, args.latency_ms / 1000.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    size = args.size_kb * 1024
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{args.files} x {args.size_kb} KiB backlog, batch {args.batch}, "
+              f"fail-rate {args.fail_rate:.0%}, latency {args.latency_ms:g} ms")
+        print(f"{'mode':>12} {'time':>8} {'files/s':>8} {'KiB/s':>8} {'requests':>9} {'delivered':>10} {'dups':>5}")
+
+        server.reset()
+        folder, names = backlog_dir(tmp, args.files, size)
+        queue = UploadQueue(url=server.url, api_key="", spool_dir=os.path.join(folder, ".spool"), workers=1,
+                            max_attempts=0, backoff_base=0.05, backoff_max=0.5)
+        queue.start()
+        start = time.perf_counter()
+        for name in sorted(names):
+            queue.enqueue(os.path.join(folder, name))
+        queue.drain(300)
+        elapsed = time.perf_counter() - start
+        queue.stop()
+        print(f"{'per-file':>12} {elapsed:6.2f} s {args.files / elapsed:8.1f} {args.files * size / 1024 / elapsed:8.0f} "
+              f"{server.requests:>9} {len(server.received & names):>10} {server.duplicates:>5}")
+
+        runs = [("multipart", 0), ("tar", 0), ("multipart", args.rate_kbps)]
+        for fmt, rate in runs:
+            server.reset()
+            folder, names = backlog_dir(tmp, args.files, size)
+            sync, elapsed = bulk(server, folder, fmt, args.batch, rate)
+            label = f"{fmt}@{rate:g}" if rate else fmt
+            kbps = args.files * size / 1024 / elapsed
+            delivered = len(server.received & names)
+            failed |= sync.state != "done" or delivered != len(names) or server.duplicates
+            if rate:
+                failed |= kbps > rate * 1.1
+            print(f"{label:>12} {elapsed:6.2f} s {args.files / elapsed:8.1f} {kbps:8.0f} "
+                  f"{server.requests:>9} {delivered:>10} {server.duplicates:>5}")
+
+        # Interrupt a slow sync, then resume: the ack index must keep every file single
+        server.reset()
+        folder, names = backlog_dir(tmp, args.files, size)
+        first, _ = bulk(server, folder, "multipart", args.batch, args.rate_kbps, fail_after=0.5)
+        sent_before = len(server.received)
+        second, _ = bulk(server, folder, "multipart", args.batch, 0)
+        again, _ = bulk(server, folder, "multipart", args.batch, 0)
+        delivered = len(server.received & names)
+        failed |= second.state != "done" or delivered != len(names) or server.duplicates or again.files_sent
+        print(f"resume: {first.state} after {sent_before} files, {second.files_sent} more after restart, "
+              f"{again.files_sent} on a third run, {server.duplicates} duplicates")
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Burst capture: frames per second, time to respond vs time to write, sharpest-frame pick.
+
+The synthetic camera stands in for a sensor running at --sensor-fps while
+the capture loop is paced at --pace-fps (the preview rate). The same number
+of stills is taken two ways: one new frame encoded and saved after another
+(what repeated /api/capture calls amount to, limited by pacing and
+encoding) and a single burst, which copies raw frames at the sensor rate
+and leaves encoding and saving to BurstWriter. For the burst, the time until burst() returns (what the
+HTTP request waits for) is reported separately from the time until every
+frame is on disk.
+
+The pick check blurs all but one copy of a frame by different amounts,
+shuffles them and verifies that the sharpness score picks the sharp one.
+
+    python bench/burst_capture.py --frames 20 --size 1920x1080 --sensor-fps 60
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from burst import BurstWriter
+from camera import Profile, SyntheticCamera, sharpness
+from snapshot_store import SnapshotStore
+
+
+def wait_done(writer, job_id, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = writer.status(job_id)
+        if job["state"] != "writing":
+            return job
+        time.sleep(0.005)
+    return writer.status(job_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--size", default="1920x1080")
+    parser.add_argument("--sensor-fps", type=float, default=60.0)
+    parser.add_argument("--pace-fps", type=float, default=15.0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--quality", type=int, default=92)
+    args = parser.parse_args()
+    size = tuple(int(v) for v in args.size.lower().split("x"))
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SnapshotStore(root=tmp, db_path=os.path.join(tmp, "snapshots.db"), retention_days=0, retention_mb=0)
+        cam = SyntheticCamera(fps=args.sensor_fps, size=size)
+        cam.profiles["still"] = Profile("still", size, args.quality, "main")
+        cam.pacer.set_fps(args.pace_fps)
+        cam.start()
+        cam.wait_ready(5.0)
+        time.sleep(0.5)
+        print(f"{args.frames} frames at {size[0]}x{size[1]}, sensor {args.sensor_fps:g} fps, "
+              f"loop paced at {args.pace_fps:g} fps, {args.workers} writer(s)")
+        print(f"{'mode':>8} {'fps':>7} {'respond':>10} {'written':>10} {'saved':>6}")
+
+        # One new frame per snapshot, encoded and saved before the next is taken
+        start = time.perf_counter()
+        stamps = []
+        last = cam.frames.latest().seq
+        while len(stamps) < args.frames:
+            frame = cam.wait_for_frame(last, timeout=2.0)
+            if frame is None:
+                continue
+            last = frame.seq
+            data = cam.encode_frame(frame, "still")
+            stamps.append(frame.timestamp)
+            store.save(data, camera_id="synthetic", taken_at=frame.timestamp)
+        elapsed = time.perf_counter() - start
+        fps = (len(stamps) - 1) / (stamps[-1] - stamps[0]) if len(stamps) > 1 else 0.0
+        print(f"{'serial':>8} {fps:7.1f} {elapsed * 1000:7.0f} ms {elapsed * 1000:7.0f} ms {args.frames:>6}")
+
+        writer = BurstWriter(store, workers=args.workers)
+        for run in range(2):  # the second run reuses the first run's buffer
+            start = time.perf_counter()
+            burst = cam.burst(count=args.frames)
+            respond = time.perf_counter() - start
+            job = wait_done(writer, writer.submit(cam, burst, camera_id="synthetic"))
+            written = time.perf_counter() - start
+            saved = len(job["records"])
+            failed |= saved != args.frames or job["state"] != "done"
+            print(f"{f'burst {run + 1}':>8} {burst.fps() or 0.0:7.1f} {respond * 1000:7.0f} ms "
+                  f"{written * 1000:7.0f} ms {saved:>6}")
+        writer.stop()
+        cam.stop()
+
+        # Sharpest pick: one untouched frame among progressively blurred copies
+        arr = np.asarray(Image.fromarray(burst.frame(0)[0]))
+        radii = [0.0] + [0.6 + 0.4 * i for i in range(args.frames - 1)]
+        random.shuffle(radii)
+        frames = [arr if r == 0 else np.asarray(Image.fromarray(arr).filter(ImageFilter.GaussianBlur(r)))
+                  for r in radii]
+        start = time.perf_counter()
+        scores = [sharpness(f) for f in frames]
+        per_frame = (time.perf_counter() - start) * 1000.0 / len(frames)
+        picked = max(range(len(scores)), key=scores.__getitem__)
+        ok = radii[picked] == 0
+        failed |= not ok
+        print(f"sharpness: {per_frame:.2f} ms/frame, picked blur radius {radii[picked]:g} "
+              f"({'sharp frame' if ok else 'WRONG'}), scores {min(scores):.1f}..{max(scores):.1f}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Picamera2 colour conversion: legacy copy path vs zero-copy views, per format.
+
+Runs on synthetic arrays shaped like Picamera2 output (XBGR8888/XRGB8888 are
+4 bytes per pixel, RGB888/BGR888 are 3), so no camera is needed. "legacy" is
+the old `_frame_to_rgb` (fancy index, flip, copy) feeding the encoder in RGB;
+"view" is `frame_view` feeding the encoder with its native order.
+
+    python bench/color_conversion.py --size 1280x720 --runs 30
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from camera import available_encoders, frame_view, select_encoder, _synthetic_rgb
+
+FORMATS = ("XBGR8888", "XRGB8888", "RGB888", "BGR888")
+
+
+def legacy_to_rgb(frame, fmt, assumed="AUTO", native="RGB"):
+    """The conversion this repo used before frame_view (kept here as the baseline)."""
+    if fmt in {"XBGR8888", "XRGB8888"}:
+        frame = frame[..., [1, 2, 3]]
+        order = "BGR" if fmt == "XBGR8888" else "RGB"
+    else:
+        if frame.ndim == 3 and frame.shape[2] > 3:
+            frame = frame[..., :3]
+        order = {"BGR888": "BGR", "RGB888": "RGB"}.get(fmt, native)
+    if assumed == "AUTO":
+        assumed = order
+    if assumed == "BGR":
+        frame = frame[..., ::-1]
+    return frame.copy()
+
+
+def native_frame(width, height, fmt):
+    rgb = _synthetic_rgb(width, height)
+    # Picamera2 names formats by little-endian word order, so memory holds the reverse
+    pixels = rgb if fmt in {"BGR888", "XBGR8888"} else rgb[..., ::-1]
+    if fmt.startswith("X"):
+        pad = np.full((height, width, 1), 255, dtype=np.uint8)
+        pixels = np.concatenate([pad, pixels], axis=2)
+    return np.ascontiguousarray(pixels)
+
+
+def timed(fn, runs):
+    fn()
+    start = time.perf_counter()
+    for _ in range(runs):
+        out = fn()
+    return (time.perf_counter() - start) * 1000.0 / runs, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--encoder", default="auto", help=f"one of: auto, {', '.join(available_encoders())}")
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.lower().split("x"))
+    encoder = select_encoder(args.encoder)
+    print(f"{args.size}, encoder={encoder.name}, quality={args.quality}")
+    print(f"{'format':>9} {'legacy conv':>12} {'view conv':>10} {'copies':>7} "
+          f"{'legacy +enc':>12} {'view +enc':>10} {'same':>5}")
+    failed = False
+    for fmt in FORMATS:
+        frame = native_frame(width, height, fmt)
+        legacy_ms, legacy = timed(lambda: legacy_to_rgb(frame, fmt), args.runs)
+        view_ms, (view, order) = timed(lambda: frame_view(frame, fmt), args.runs)
+        copies = 0 if np.shares_memory(view, frame) else 1
+        legacy_enc, _ = timed(
+            lambda: encoder.encode(legacy_to_rgb(frame, fmt), args.quality, "RGB"), args.runs
+        )
+
+        def view_encode():
+            arr, order = frame_view(frame, fmt)
+            return encoder.encode(arr, args.quality, order)
+
+        view_enc, _ = timed(view_encode, args.runs)
+        as_rgb = view if order == "RGB" else view[..., ::-1]
+        same = np.array_equal(as_rgb, legacy)
+        failed |= not same
+        print(f"{fmt:>9} {legacy_ms:9.3f} ms {view_ms:7.3f} ms {copies:>7} "
+              f"{legacy_enc:9.2f} ms {view_enc:7.2f} ms {'yes' if same else 'NO':>5}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
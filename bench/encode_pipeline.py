@@ -0,0 +1,98 @@
+"""Capture/encode pipeline: sustained FPS with 0..N encode workers on a synthetic source.
+
+The synthetic camera produces frames as fast as the loop asks for them
+(CAPTURE_FPS is lifted for the run) and every frame is encoded eagerly, as
+with ENCODE_ON_DEMAND=0. Workers=0 is the old single-thread capture+encode
+loop; the other rows run the encode stage on a pool behind a drop-oldest
+queue. A consumer thread checks that frames are published in capture order.
+On a multi-core Pi the encoded FPS should scale with the worker count
+until capture becomes the bottleneck.
+
+    python bench/encode_pipeline.py --sizes 1280x720,1920x1080 --workers 0,1,2,4 --seconds 5
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from camera import Profile, SyntheticCamera
+
+
+def cpu_seconds():
+    t = os.times()
+    return t.user + t.system
+
+
+def run(size, workers, seconds, quality, fps):
+    cam = SyntheticCamera(fps=fps or 1000.0, size=size)
+    cam.profiles["preview"] = Profile("preview", size, quality, "lores")
+    cam.encode_on_demand = False
+    cam.encode_workers = workers
+    cam.pacer.set_fps(fps)
+    disorder = [0]
+    done = threading.Event()
+
+    def consume():
+        last, last_ts = 0, 0.0
+        while not done.is_set():
+            frame = cam.wait_for_frame(last, timeout=0.5)
+            if frame is None:
+                continue
+            # seq is assigned at publish; the capture timestamp shows the real order
+            if frame.sensor_ts < last_ts:
+                disorder[0] += 1
+            last, last_ts = frame.seq, frame.sensor_ts
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    cam.start()
+    consumer.start()
+    time.sleep(1.0)  # warm up
+    captured0, encoded0, cpu0 = cam.frames_captured, cam.encode_counts.get("preview", 0), cpu_seconds()
+    start = time.monotonic()
+    time.sleep(seconds)
+    elapsed = time.monotonic() - start
+    captured = cam.frames_captured - captured0
+    encoded = cam.encode_counts.get("preview", 0) - encoded0
+    cpu = cpu_seconds() - cpu0
+    stage = cam.stats()["encode_stage"] or {}
+    done.set()
+    cam.stop()
+    consumer.join(1.0)
+    cam._t.join(1.0)
+    return {
+        "captured": captured / elapsed,
+        "encoded": encoded / elapsed,
+        "dropped": stage.get("dropped", 0),
+        "disorder": disorder[0],
+        "cpu": 100.0 * cpu / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1280x720,1920x1080")
+    parser.add_argument("--workers", default="0,1,2,4")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--fps", type=float, default=0.0, help="capture target; 0 = as fast as possible")
+    args = parser.parse_args()
+
+    print(f"cpus={os.cpu_count()}  quality={args.quality}  fps target={args.fps or 'max'}")
+    print(f"{'size':>10} {'workers':>7} {'capture fps':>12} {'encoded fps':>12} "
+          f"{'dropped':>8} {'out of order':>12} {'cpu %':>7}")
+    failed = False
+    for size in args.sizes.split(","):
+        width, height = map(int, size.lower().split("x"))
+        for workers in (int(w) for w in args.workers.split(",")):
+            r = run((width, height), workers, args.seconds, args.quality, args.fps)
+            failed |= r["disorder"] > 0
+            print(f"{size:>10} {workers:>7} {r['captured']:12.1f} {r['encoded']:12.1f} "
+                  f"{r['dropped']:8d} {r['disorder']:12d} {r['cpu']:7.0f}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare base64 and binary Socket.IO frame payloads.
+
+Runs without a camera: frames are synthetic JPEGs at FRAME_SIZE/JPEG_QUALITY.
+Wire bytes are measured on the encoded Socket.IO packets (plus the Engine.IO
+message prefix), CPU is process time spent building and encoding each packet.
+
+    python bench/frame_transport.py --frames 200
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+from socketio import packet
+
+from config import FRAME_SIZE, JPEG_QUALITY
+from streaming import frame_payload
+
+
+def synthetic_jpeg(width, height, quality, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    noise = rng.normal(0, 12, size=(height, width, 3))
+    arr = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(arr, mode="RGB").save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def wire_size(encoded):
+    # Engine.IO は文字列メッセージに "4" を、バイナリにはフレーム種別のみを付与
+    if isinstance(encoded, list):
+        head, *attachments = encoded
+        return len(head.encode("utf-8")) + 1 + sum(len(a) for a in attachments)
+    return len(encoded.encode("utf-8")) + 1
+
+
+def run(mode, frames, n):
+    binary = mode == "binary"
+    total_bytes = 0
+    start = time.process_time()
+    for i in range(n):
+        jpeg = frames[i % len(frames)]
+        pkt = packet.Packet(packet.EVENT, data=["frame", frame_payload(jpeg, binary=binary)], namespace="/")
+        total_bytes += wire_size(pkt.encode())
+    cpu = time.process_time() - start
+    return total_bytes / n, cpu / n * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--size", default=",".join(map(str, FRAME_SIZE)))
+    parser.add_argument("--quality", type=int, default=JPEG_QUALITY)
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.split(","))
+    frames = [synthetic_jpeg(width, height, args.quality, seed) for seed in range(4)]
+    jpeg_avg = sum(len(f) for f in frames) / len(frames)
+    print(f"frame {width}x{height} q{args.quality}: JPEG {jpeg_avg / 1024:.1f} KiB avg")
+
+    results = {}
+    for mode in ("base64", "binary"):
+        results[mode] = run(mode, frames, args.frames)
+        size, cpu_ms = results[mode]
+        print(f"{mode:>7}: {size / 1024:8.1f} KiB/frame on wire  {cpu_ms:6.3f} ms CPU/frame")
+    b64_size, b64_cpu = results["base64"]
+    bin_size, bin_cpu = results["binary"]
+    print(f"binary saves {100.0 * (1 - bin_size / b64_size):.1f}% bytes, "
+          f"{b64_cpu - bin_cpu:.3f} ms CPU per frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""JPEG encoder backends: ms/frame and bytes/frame on synthetic frames.
+
+Covers every backend available in this environment (Pillow, OpenCV,
+simplejpeg, TurboJPEG) at several FRAME_SIZE / JPEG_QUALITY combinations.
+
+    python bench/jpeg_encoders.py --sizes 640x360,1280x720,1920x1080 --qualities 60,80,92
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from camera import JPEG_ENCODERS, available_encoders, benchmark_encoder, select_encoder, _synthetic_rgb
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="640x360,1280x720,1920x1080")
+    parser.add_argument("--qualities", default="60,80,92")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    names = available_encoders()
+    encoders = [JPEG_ENCODERS[name]() for name in names]
+    print(f"available: {', '.join(names)}  (auto selects: {select_encoder('auto').name})")
+    print(f"{'size':>10} {'q':>3} " + " ".join(f"{n:>22}" for n in names))
+    for size in args.sizes.split(","):
+        width, height = map(int, size.lower().split("x"))
+        frame = _synthetic_rgb(width, height)
+        for quality in (int(q) for q in args.qualities.split(",")):
+            cells = []
+            for encoder in encoders:
+                ms, nbytes = benchmark_encoder(encoder, frame, quality, runs=args.runs)
+                cells.append(f"{ms:7.2f} ms {nbytes / 1024:7.1f} KiB")
+            print(f"{size:>10} {quality:>3} " + " ".join(f"{c:>22}" for c in cells))
+
+
+if __name__ == "__main__":
+    main()
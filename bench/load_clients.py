@@ -0,0 +1,150 @@
+"""Socket.IO load test: per-client FPS and server CPU for 1..N viewers.
+
+Viewers either poll with request_frame (default) or subscribe once and let
+the server push frames (--push).
+
+Pull mode always measures base64 frames. The threaded socketio.Client runs
+every Engine.IO message handler on its own thread, so with polled binary
+frames arriving back to back a frame's header and attachment get
+reassembled out of order (ValueError in socketio/packet.py) and the figures
+are unreliable. Push mode sends binary frames unless --base64 is given.
+
+By default a server is spawned with the synthetic camera (CAMERA_ID=synthetic)
+so no hardware is needed; pass --url/--server-pid to test a running app.py.
+
+    python bench/load_clients.py --clients 1,5,10,25,50 --duration 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import socketio
+
+SERVER_CMD = (
+    "import app; "
+    "app.socketio.run(app.app, host='127.0.0.1', port={port}, allow_unsafe_werkzeug=True)"
+)
+
+
+def process_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    return (int(fields[11]) + int(fields[12])) / ticks
+
+
+class Viewer:
+    """One simulated browser tab, polling or subscribed to push frames."""
+
+    def __init__(self, url, fps, binary, push=False):
+        self.url = url
+        self.fps = fps
+        self.binary = binary
+        self.push = push
+        self.frames = 0
+        self.bytes = 0
+        self.running = False
+        # websocket-client validates text frames as UTF-8 in pure Python, which makes the
+        # load generator, not the server, the bottleneck for base64 frames
+        self.sio = socketio.Client(reconnection=False, websocket_extra_options={"skip_utf8_validation": True})
+        self.sio.on("frame", self._on_frame)
+
+    def _on_frame(self, msg):
+        self.frames += 1
+        self.bytes += len(msg.get("data") or b"")
+
+    def start(self):
+        self.sio.connect(self.url, transports=["websocket"])
+        self.running = True
+        if self.push:
+            self.sio.emit("subscribe", {"binary": self.binary, "fps": self.fps})
+            return
+        self._t = threading.Thread(target=self._loop, daemon=True)
+        self._t.start()
+
+    def _loop(self):
+        interval = 1.0 / self.fps
+        while self.running:
+            try:
+                self.sio.emit("request_frame", {"binary": self.binary, "fps": self.fps})
+            except Exception:
+                break
+            time.sleep(interval)
+
+    def stop(self):
+        self.running = False
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+
+def run_round(url, n, fps, duration, binary, push, server_pid):
+    viewers = [Viewer(url, fps, binary, push) for _ in range(n)]
+    for v in viewers:
+        v.start()
+    time.sleep(1.0)  # 接続直後の揺れを除外
+    start_frames = [v.frames for v in viewers]
+    cpu0 = process_cpu_seconds(server_pid) if server_pid else None
+    t0 = time.monotonic()
+    time.sleep(duration)
+    elapsed = time.monotonic() - t0
+    cpu1 = process_cpu_seconds(server_pid) if server_pid else None
+    per_client = [(v.frames - s) / elapsed for v, s in zip(viewers, start_frames)]
+    for v in viewers:
+        v.stop()
+    cpu = (cpu1 - cpu0) / elapsed * 100.0 if server_pid else None
+    return per_client, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", default="1,5,10,25,50")
+    parser.add_argument("--fps", type=float, default=10.0)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--base64", action="store_true", help="use the legacy base64 payload (always on without --push)")
+    parser.add_argument("--push", action="store_true", help="subscribe instead of polling")
+    parser.add_argument("--url", help="test an already running server instead of spawning one")
+    parser.add_argument("--server-pid", type=int, help="pid of --url server for CPU sampling")
+    parser.add_argument("--port", type=int, default=5055)
+    args = parser.parse_args()
+
+    proc = None
+    url = args.url
+    server_pid = args.server_pid
+    if not url:
+        env = dict(os.environ, CAMERA_ID="synthetic")
+        proc = subprocess.Popen(
+            [sys.executable, "-c", SERVER_CMD.format(port=args.port)],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        url = f"http://127.0.0.1:{args.port}"
+        server_pid = proc.pid
+        time.sleep(3.0)
+
+    # Polled binary frames are not reassembled reliably by the threaded client (see above)
+    binary = args.push and not args.base64
+    try:
+        print(f"target {args.fps:.1f} fps per client, {args.duration:.0f}s per round, "
+              f"{'push' if args.push else 'pull'}, {'binary' if binary else 'base64'} frames")
+        print(f"{'clients':>7} {'mean fps':>9} {'min fps':>8} {'server cpu':>11}")
+        for n in [int(x) for x in args.clients.split(",") if x.strip()]:
+            per_client, cpu = run_round(
+                url, n, args.fps, args.duration, binary, args.push, server_pid
+            )
+            cpu_txt = f"{cpu:10.1f}%" if cpu is not None else "       n/a"
+            print(f"{n:7d} {sum(per_client) / n:9.2f} {min(per_client):8.2f} {cpu_txt}")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Recording: a video segment vs a JPEG per frame, in bytes and CPU.
+
+Renders --frames synthetic captures at --size (a textured scene with sensor
+noise and an object crossing it) and stores them two ways:
+
+  jpeg   every frame encoded with the preview profile, as a snapshot
+         sequence or a time-lapse made of stills would be
+  video  every frame appended to one segment through recorder.open_writer
+         (ffmpeg with the first H.264 encoder that passes a test encode,
+         else cv2.VideoWriter), the way a time-lapse or tap-fed
+         recording streams them
+
+Reported: bytes per frame, CPU ms per frame (ffmpeg's own CPU included) and
+the frame rate that CPU budget allows on one core. Fails when the video path
+cannot keep up with --fps.
+
+    python bench/recording.py --size 1280x720 --frames 150 --fps 15
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from camera import SyntheticCamera, _synthetic_rgb
+from recorder import open_writer
+
+
+def frames(width, height, count, seed=1):
+    rng = np.random.default_rng(seed)
+    base = _synthetic_rgb(width, height, seed).astype(np.int16)
+    noises = [rng.normal(0, 4, size=(height, width, 3)).astype(np.int16) for _ in range(4)]
+    box_w, box_h = width // 6, height // 4
+    out = []
+    for i in range(count):
+        frame = base + noises[i % len(noises)]
+        x = int(i / max(1, count) * (width - box_w))
+        frame[height // 2:height // 2 + box_h, x:x + box_w] = 30
+        out.append(np.clip(frame, 0, 255).astype(np.uint8))
+    return out
+
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--frames", type=int, default=150)
+    parser.add_argument("--fps", type=float, default=15.0)
+    args = parser.parse_args()
+    width, height = map(int, args.size.lower().split("x"))
+
+    cam = SyntheticCamera(size=(width, height))
+    sequence = frames(width, height, args.frames)
+
+    start_cpu, start = cpu_seconds(), time.perf_counter()
+    jpeg_bytes = sum(len(cam.encode_pixels(arr, "RGB", "preview")) for arr in sequence)
+    jpeg = (jpeg_bytes, cpu_seconds() - start_cpu, time.perf_counter() - start, "JPEG")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "segment.mp4")
+        start_cpu, start = cpu_seconds(), time.perf_counter()
+        writer = open_writer(path, (width, height), args.fps, "RGB", sequence[0])
+        for arr in sequence[1:]:
+            writer.write(arr, "RGB")
+        writer.close()
+        video = (os.path.getsize(path), cpu_seconds() - start_cpu, time.perf_counter() - start,
+                 f"{writer.backend}/{writer.codec}")
+
+    print(f"{width}x{height}, {args.frames} frames")
+    print(f"{'path':>6} {'encoder':>14} {'KB/frame':>9} {'CPU ms/frame':>13} {'max fps':>8}")
+    for name, (size, cpu, wall, encoder) in (("jpeg", jpeg), ("video", video)):
+        print(f"{name:>6} {encoder:>14} {size / args.frames / 1024:9.1f} {cpu * 1000.0 / args.frames:13.2f} "
+              f"{args.frames / max(cpu, wall):8.1f}")
+    print(f"video is {jpeg[0] / max(1, video[0]):.1f}x smaller than the JPEG sequence")
+    video_fps = args.frames / max(video[1], video[2])
+    sys.exit(1 if video_fps < args.fps else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Scheduled stills: cold-start capture_and_send.py vs the in-process scheduler.
+
+Three ways a timed still gets taken, all on the synthetic camera:
+
+  cold     capture_and_send.py with no service running: a new interpreter
+           imports camera/numpy/PIL, opens the camera, waits for it to be
+           ready, takes one still and saves it (what cron used to run)
+  service  capture_and_send.py while the service runs: the script only
+           asks the running app over HTTP (cron still starts an interpreter)
+  schedule a schedule inside the service fired with run_now(): the warm
+           camera takes the still, no process start at all
+
+The app is imported in-process and served on a local port with a
+temporary SNAP_DIR, so nothing is written outside it.
+
+    python bench/scheduled_capture.py --runs 3
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def run_script(env):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, os.path.join(ROOT, "capture_and_send.py")], env=env,
+                          capture_output=True, text=True, timeout=60)
+    elapsed = time.perf_counter() - start
+    ok = proc.returncode == 0 and "saved:" in proc.stdout
+    return elapsed * 1000.0, ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, CAMERA_ID="synthetic", SNAP_DIR=tmp, UPLOAD_URL="",
+                   SCHEDULE_FILE=os.path.join(tmp, "schedules.json"), SERVICE_URL="http://127.0.0.1:9")
+        os.environ.update(env)
+        from werkzeug.serving import make_server
+
+        import app  # noqa: E402  (reads the environment set above)
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = make_server("127.0.0.1", 0, app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        service_env = dict(env, SERVICE_URL=f"http://127.0.0.1:{server.server_port}")
+        app._current_camera().wait_ready(5.0)
+
+        rows = []
+        rows.append(("cold", [run_script(env) for _ in range(args.runs)]))
+        rows.append(("service", [run_script(service_env) for _ in range(args.runs)]))
+
+        entry = app.scheduler.add("0 0 1 1 *", task="capture")
+        timings = []
+        for _ in range(args.runs):
+            before = app.scheduler.get(entry["id"])["runs"]
+            start = time.perf_counter()
+            app.scheduler.run_now(entry["id"])
+            while app.scheduler.get(entry["id"])["runs"] == before:
+                time.sleep(0.001)
+            info = app.scheduler.get(entry["id"])
+            timings.append(((time.perf_counter() - start) * 1000.0, info["last_status"] == "ok"))
+        rows.append(("schedule", timings))
+        server.shutdown()
+
+        print(f"{'path':>9} {'min':>9} {'median':>9} {'max':>9} {'ok':>5}")
+        for name, results in rows:
+            ms = sorted(t for t, _ in results)
+            ok = sum(o for _, o in results)
+            failed |= ok != len(results)
+            print(f"{name:>9} {ms[0]:6.0f} ms {ms[len(ms) // 2]:6.0f} ms {ms[-1]:6.0f} ms {ok:>2}/{len(results)}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Latest snapshot / page lookup: listdir + sort vs the SQLite snapshot index.
+
+Creates --count tiny snapshots in a temporary SNAP_DIR through SnapshotStore
+(date-sharded, indexed), plus the same number of flat files the way older
+versions saved them, then times "find the newest" and "fetch one page" both
+ways. The flat listing grows with the number of files; the index does not.
+
+    python bench/snapshot_index.py --count 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from snapshot_store import SnapshotStore
+
+
+def timed(fn, runs):
+    fn()
+    start = time.perf_counter()
+    for _ in range(runs):
+        out = fn()
+    return (time.perf_counter() - start) * 1000.0 / runs, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--page", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        flat = os.path.join(tmp, "flat")
+        os.makedirs(flat)
+        store = SnapshotStore(root=os.path.join(tmp, "store"), db_path=os.path.join(tmp, "store.db"),
+                              retention_days=0, retention_mb=0)
+        start = time.time() - args.count * 43200.0  # two a day
+        t0 = time.perf_counter()
+        for i in range(args.count):
+            store.save(b"\xff\xd8\xff\xd9", camera_id="picam2:0", taken_at=start + i * 43200.0)
+        save_ms = (time.perf_counter() - t0) * 1000.0 / args.count
+        for i in range(args.count):
+            stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(start + i * 43200.0))
+            open(os.path.join(flat, f"capture_{stamp}.jpg"), "wb").close()
+
+        def flat_latest():
+            return sorted(f for f in os.listdir(flat) if f.endswith(".jpg"))[-1]
+
+        def flat_page(offset=0):
+            names = sorted((f for f in os.listdir(flat) if f.endswith(".jpg")), reverse=True)
+            return names[offset:offset + args.page]
+
+        middle = args.count // args.page // 2
+        _, cursor = store.query(limit=args.page)
+        for _ in range(middle - 1):
+            _, cursor = store.query(limit=args.page, before=cursor)
+
+        rows = [
+            ("latest", timed(flat_latest, args.runs)[0], timed(store.latest, args.runs)[0]),
+            ("first page", timed(flat_page, args.runs)[0], timed(lambda: store.query(limit=args.page), args.runs)[0]),
+            ("middle page", timed(lambda: flat_page(middle * args.page), args.runs)[0],
+             timed(lambda: store.query(limit=args.page, before=cursor), args.runs)[0]),
+        ]
+        print(f"{args.count} snapshots, page {args.page}, store.save {save_ms:.2f} ms/snapshot")
+        print(f"{'lookup':>12} {'listdir+sort':>14} {'index':>10}")
+        for name, flat_ms, index_ms in rows:
+            print(f"{name:>12} {flat_ms:11.2f} ms {index_ms:7.3f} ms")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
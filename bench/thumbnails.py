@@ -0,0 +1,71 @@
+"""Snapshot thumbnails: full decode + resize vs Pillow draft() (DCT-domain scaling).
+
+Encodes a synthetic still at --size, then renders --thumb thumbnails from it
+with a full decode and with render_thumbnail(), which decodes at 1/2-1/8
+scale. Also times a ThumbnailCache hit, which is what repeat views cost.
+
+    python bench/thumbnails.py --size 4056x3040 --runs 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from camera import _synthetic_rgb
+from thumbnails import ThumbnailCache, render_thumbnail
+
+
+def full_decode(src, dst, size, quality):
+    with Image.open(src) as im:
+        im = im.convert("RGB")  # decodes every pixel at full size; draft() no longer applies
+        im.thumbnail(size, Image.BILINEAR, reducing_gap=None)
+        im.save(dst, "JPEG", quality=quality)
+
+
+def timed(fn, runs):
+    fn()
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - start) * 1000.0 / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="4056x3040")
+    parser.add_argument("--thumb", default="320x180")
+    parser.add_argument("--quality", type=int, default=70)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.lower().split("x"))
+    thumb = tuple(map(int, args.thumb.lower().split("x")))
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "still.jpg")
+        Image.fromarray(_synthetic_rgb(width, height)).save(src, "JPEG", quality=92)
+        dst = os.path.join(tmp, "thumb.jpg")
+        full_ms = timed(lambda: full_decode(src, dst, thumb, args.quality), args.runs)
+        draft_ms = timed(lambda: render_thumbnail(src, dst, thumb, args.quality), args.runs)
+        with Image.open(dst) as im:
+            out_size = im.size
+
+        cache = ThumbnailCache(os.path.join(tmp, "cache"), max_mb=8, size=thumb, quality=args.quality)
+        cache.start()
+        record = {"id": 1, "size": os.path.getsize(src), "path": src}
+        cache.get(record)
+        hit_ms = timed(lambda: cache.get(record), args.runs * 100)
+        cache.stop()
+
+    print(f"{args.size} still -> {out_size[0]}x{out_size[1]} thumbnail, quality {args.quality}")
+    print(f"{'full decode':>14} {full_ms:8.1f} ms")
+    print(f"{'draft()':>14} {draft_ms:8.1f} ms  ({full_ms / draft_ms:.1f}x)")
+    print(f"{'cache hit':>14} {hit_ms:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Upload queue against a local stand-in server: throughput, retries, restarts.
+
+Starts a threaded HTTP server on 127.0.0.1 that accepts multipart uploads,
+answers a share of them with 503 (--fail-rate) and adds --latency-ms to each
+response. The same number of snapshots is then sent three ways: one
+`requests.post` per file (the old path), the queue with one worker and the
+queue with --workers. The stand-in counts TCP connections, so keep-alive
+reuse shows up directly. A final run stops a queue with jobs still spooled
+and checks that a fresh queue on the same spool delivers all of them.
+
+    python bench/upload_queue.py --files 40 --workers 4 --fail-rate 0.2
+"""
+import argparse
+import io
+import os
+import random
+import re
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from uploader import UploadQueue
+
+
+class StandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fail_rate, latency):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.fail_rate = fail_rate
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.received = set()
+        self.duplicates = 0
+        self.rejected = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/upload"
+
+    def reset(self):
+        with self.lock:
+            self.connections = 0
+            self.requests = 0
+            self.received = set()
+            self.duplicates = 0
+            self.rejected = 0
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.latency)
+        if random.random() < self.server.fail_rate:
+            with self.server.lock:
+                self.server.rejected += 1
+            self._reply(503, b"busy")
+            return
+        if self.headers.get("Content-Type") == "application/x-tar":
+            with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+                names = tar.getnames()
+        else:
+            # filename="..." of every multipart file part
+            names = [n.decode() for n in re.findall(rb'filename="([^"]*)"', body)]
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.duplicates += len(self.server.received.intersection(names))
+            self.server.received.update(names)
+        self._reply(200, b"ok")
+
+    def _reply(self, code, text):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_files(folder, count, size):
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"capture_{i:05d}.jpg")
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        paths.append(path)
+    return paths
+
+
+def run_direct(server, paths):
+    # One requests.post per file: new connection each time, no retry
+    ok = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            r = requests.post(server.url, files={"file": (os.path.basename(path), f, "image/jpeg")}, timeout=20)
+        ok += r.ok
+    return ok
+
+
+def run_queue(server, paths, spool, workers, timeout):
+    queue = UploadQueue(url=server.url, api_key="", spool_dir=spool, workers=workers,
+                        max_attempts=0, backoff_base=0.05, backoff_max=0.5)
+    queue.start()
+    start = time.perf_counter()
+    enqueue_start = time.perf_counter()
+    for path in paths:
+        queue.enqueue(path)
+    enqueue_ms = (time.perf_counter() - enqueue_start) * 1000.0 / len(paths)
+    done = queue.drain(timeout)
+    elapsed = time.perf_counter() - start
+    queue.stop()
+    return queue.stats(), elapsed, enqueue_ms, done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--size-kb", type=int, default=150)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--fail-rate", type=float, default=0.2)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    server = StandIn(args.fail_rate, args.latency_ms / 1000.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_files(tmp, args.files, args.size_kb * 1024)
+        names = {os.path.basename(p) for p in paths}
+        print(f"{args.files} x {args.size_kb} KiB, fail-rate {args.fail_rate:.0%}, latency {args.latency_ms:g} ms")
+        print(f"{'mode':>10} {'time':>8} {'files/s':>8} {'delivered':>10} {'retries':>8} {'conns':>6} {'enqueue':>10}")
+
+        server.reset()
+        start = time.perf_counter()
+        run_direct(server, paths)
+        elapsed = time.perf_counter() - start
+        print(f"{'direct':>10} {elapsed:6.2f} s {args.files / elapsed:8.1f} {len(server.received):>10} "
+              f"{0:>8} {server.connections:>6} {'-':>10}")
+
+        for workers in sorted({1, args.workers}):
+            server.reset()
+            spool = os.path.join(tmp, f"spool{workers}")
+            stats, elapsed, enqueue_ms, done = run_queue(server, paths, spool, workers, args.timeout)
+            delivered = len(server.received & names)
+            failed |= not done or delivered != len(names)
+            print(f"{f'queue x{workers}':>10} {elapsed:6.2f} s {args.files / elapsed:8.1f} {delivered:>10} "
+                  f"{stats['retries']:>8} {server.connections:>6} {enqueue_ms:7.2f} ms")
+
+        # Restart: spool everything with no server reachable, then resume on a new queue
+        server.reset()
+        spool = os.path.join(tmp, "spool_restart")
+        offline = UploadQueue(url="http://127.0.0.1:9/upload", api_key="", spool_dir=spool, workers=1,
+                              max_attempts=0, backoff_base=0.5, backoff_max=0.5)
+        offline.start()
+        for path in paths:
+            offline.enqueue(path)
+        time.sleep(0.2)
+        offline.stop()
+        spooled = len([n for n in os.listdir(spool) if n.endswith(".json")])
+        resumed = UploadQueue(url=server.url, api_key="", spool_dir=spool, workers=args.workers,
+                              max_attempts=0, backoff_base=0.05, backoff_max=0.5)
+        resumed.start()
+        done = resumed.drain(args.timeout)
+        resumed.stop()
+        delivered = len(server.received & names)
+        left = len([n for n in os.listdir(spool) if n.endswith(".json")])
+        failed |= not done or delivered != len(names) or left
+        print(f"restart: {spooled} spooled before stop, {delivered} delivered after restart, {left} left in spool")
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
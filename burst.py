@@ -0,0 +1,146 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from camera import sharpness
+from config import BURST_WORKERS
+
+# Finished bursts remembered for GET /api/capture/burst/<id>
+RECENT_BURSTS_KEPT = 50
+
+PICK_MODES = ("all", "sharpest")
+
+
+class BurstWriter:
+    """Encodes and saves captured bursts on a small worker pool.
+
+    The capture side (CameraBase.burst) only copies raw frames into memory,
+    so the HTTP request can return as soon as the burst is captured; JPEG
+    encoding and the snapshot writes happen here afterwards. With
+    pick="sharpest" every frame is scored first (Laplacian variance) and only
+    the best one is encoded.
+    """
+
+    def __init__(self, store, thumbs=None, workers=BURST_WORKERS):
+        self.store = store
+        self.thumbs = thumbs
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="burst")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # id -> job dict, oldest first
+        self.frames_written = 0
+        self.failed = 0
+
+    def stop(self):
+        self._pool.shutdown(wait=True)
+
+    def submit(self, cam, burst, camera_id=None, pick="all", on_done=None):
+        """Queue `burst` for writing; returns the job id.
+
+        `on_done(job)` is called on the worker once every frame is saved.
+        """
+        if pick not in PICK_MODES:
+            raise ValueError(f"pick must be one of {', '.join(PICK_MODES)}")
+        job = {
+            "id": uuid.uuid4().hex[:16],
+            "state": "writing",
+            "pick": pick,
+            "camera": camera_id,
+            "captured": len(burst),
+            "fps": round(burst.fps(), 2) if burst.fps() else None,
+            "sharpness": None,
+            "picked": None,
+            "records": [None] * len(burst),
+            "error": None,
+            "submitted_at": time.time(),
+            "finished_at": None,
+            "on_done": on_done,
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+            while len(self._jobs) > RECENT_BURSTS_KEPT:
+                oldest = next(iter(self._jobs.values()))
+                if oldest["state"] == "writing":
+                    break
+                self._jobs.popitem(last=False)
+        settings = cam.get_adjustments()
+        if not len(burst):
+            self._finish(job, burst)
+        elif pick == "sharpest":
+            self._pool.submit(self._write_sharpest, job, cam, burst, settings)
+        else:
+            remaining = [len(burst)]
+            for index in range(len(burst)):
+                self._pool.submit(self._write_one, job, cam, burst, index, settings, remaining)
+        return job["id"]
+
+    def _write_sharpest(self, job, cam, burst, settings):
+        try:
+            scores = [sharpness(burst.frame(i)[0]) for i in range(len(burst))]
+            best = max(range(len(scores)), key=scores.__getitem__)
+            with self._lock:
+                job["sharpness"] = [round(s, 2) for s in scores]
+                job["picked"] = best
+            self._save(job, cam, burst, best, settings)
+        except Exception as e:
+            self._fail(job, e)
+        self._finish(job, burst)
+
+    def _write_one(self, job, cam, burst, index, settings, remaining):
+        try:
+            self._save(job, cam, burst, index, settings)
+        except Exception as e:
+            self._fail(job, e)
+        with self._lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            self._finish(job, burst)
+
+    def _save(self, job, cam, burst, index, settings):
+        arr, order, taken_at, _sensor_ts = burst.frame(index)
+        data = cam.encode_pixels(arr, order, "still")
+        record = self.store.save(data, camera_id=job["camera"], settings=settings, taken_at=taken_at)
+        if self.thumbs is not None:
+            self.thumbs.submit(record)
+        with self._lock:
+            job["records"][index] = record
+            self.frames_written += 1
+
+    def _fail(self, job, error):
+        print("[WARN] burst write failed:", error)
+        with self._lock:
+            self.failed += 1
+            job["error"] = str(error)
+
+    def _finish(self, job, burst):
+        # Every frame is encoded (or failed): the raw buffer can be reused
+        burst.release()
+        with self._lock:
+            job["state"] = "failed" if job["error"] and not any(job["records"]) else "done"
+            job["finished_at"] = time.time()
+            on_done = job.pop("on_done")
+            info = self._info(job)
+        if on_done is not None:
+            try:
+                on_done(info)
+            except Exception as e:
+                print("[WARN] burst on_done failed:", e)
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return self._info(job)
+
+    def _info(self, job):
+        info = dict(job, records=[r for r in job["records"] if r is not None])
+        info.pop("on_done", None)
+        return info
+
+    def stats(self):
+        with self._lock:
+            writing = sum(1 for j in self._jobs.values() if j["state"] == "writing")
+            return {"writing": writing, "frames_written": self.frames_written, "failed": self.failed}
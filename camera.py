@@ -5,10 +5,20 @@ os.environ.setdefault("LIBCAMERA_LOG_LEVELS", "*:ERROR")
 import time
 import threading
 import io
+import glob
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, namedtuple
 from datetime import datetime
 from PIL import Image, ImageEnhance
 
-from config import FRAME_SIZE, JPEG_QUALITY, SNAP_DIR, CAMERA_COLOR_ORDER, CAMERA_DEBUG
+from config import (
+    FRAME_SIZE, JPEG_QUALITY, SNAP_DIR, CAMERA_COLOR_ORDER, CAMERA_DEBUG, CAMERA_DEBUG_INTERVAL, FRAME_BUFFER_SIZE,
+    STILL_SIZE, STILL_QUALITY, THUMB_SIZE, THUMB_QUALITY,
+    ENCODE_ON_DEMAND, IDLE_AFTER_SEC, IDLE_FPS, JPEG_ENCODER, CAPTURE_FPS,
+    ENCODE_WORKERS, ENCODE_QUEUE_SIZE, READY_TIMEOUT, BURST_MAX_FRAMES, BURST_MAX_MB,
+)
+from metrics import STAGE_SECONDS
 
 AWB_MODES = {
     "auto",
@@ -21,16 +31,741 @@ AWB_MODES = {
     "custom",
 }
 
-def debug_print(*args, **kwargs):
-    if CAMERA_DEBUG:
-        print(*args, **kwargs)
+_debug_last = {}
+
+
+def debug_print(*args, every=None, key=None, **kwargs):
+    # CAMERA_DEBUG のときだけ出力。every（秒）を付けると key ごとに間隔内 1 回まで（キャプチャループに置いても重くならない）
+    if not CAMERA_DEBUG:
+        return
+    if every is not None:
+        key = key if key is not None else args[:1]
+        now = time.monotonic()
+        if now - _debug_last.get(key, float("-inf")) < every:
+            return
+        _debug_last[key] = now
+    print(*args, **kwargs)
+
+
+# Output profile: JPEG size/quality and the capture stream it is encoded from.
+# "lores" falls back to "main" on sources that only have one stream.
+Profile = namedtuple("Profile", ["name", "size", "quality", "stream"])
+
+# Frames keep raw arrays only this long; older ones keep just their JPEGs
+RAW_FRAMES_KEPT = 2
+
+# Sequence numbers are shared by all buffers so they keep increasing across camera switches
+_frame_seq = itertools.count(1)
+
+
+def _fit_size(src_size, target):
+    # アスペクト比を保ったまま target に収まる最大サイズ（拡大はしない）
+    sw, sh = src_size
+    if not target:
+        return sw, sh
+    tw, th = target
+    scale = min(tw / sw, th / sh, 1.0)
+    return max(1, int(round(sw * scale))), max(1, int(round(sh * scale)))
+
+
+_cv2_module = False
+
+
+def _optional_cv2():
+    # OpenCV が使えれば cv2、無ければ None（一度だけ調べる）
+    global _cv2_module
+    if _cv2_module is False:
+        try:
+            import cv2
+        except Exception:
+            cv2 = None
+        _cv2_module = cv2
+    return _cv2_module
+
+
+def packed(arr, out=None):
+    # HxWx3 配列を C 連続に（コピーは最大 1 回）。4 バイト画素から切り出したビューは cv2.mixChannels で詰め直す
+    # out（同じ形の C 連続配列）を渡すと必ずそこへコピーする（連写バッファ用）
+    import numpy as np
+
+    if arr.flags.c_contiguous:
+        if out is None:
+            return arr
+        np.copyto(out, arr)
+        return out
+    base = arr.base
+    cv2 = _optional_cv2()
+    if (
+        cv2 is not None
+        and isinstance(base, np.ndarray)
+        and base.flags.c_contiguous
+        and base.ndim == 3
+        and base.shape[2] == 4
+        and arr.ndim == 3
+        and arr.shape[2] == 3
+        and base.shape[:2] == arr.shape[:2]
+        and arr.strides == base.strides
+    ):
+        first = arr.__array_interface__["data"][0] - base.__array_interface__["data"][0]
+        if out is None:
+            out = np.empty(arr.shape, dtype=arr.dtype)
+        cv2.mixChannels([base], [out], [first, 0, first + 1, 1, first + 2, 2])
+        return out
+    if out is None:
+        return np.ascontiguousarray(arr)
+    np.copyto(out, arr)
+    return out
+
+
+def sharpness(arr, step=2):
+    # ピントの指標: 緑チャンネルのラプラシアンの分散。step 画素おきに見るので色変換なしで数ミリ秒、大きいほどシャープ
+    import numpy as np
+
+    g = arr[::step, ::step, 1] if arr.ndim == 3 else arr[::step, ::step]
+    cv2 = _optional_cv2()
+    if cv2 is not None:
+        return float(cv2.Laplacian(np.ascontiguousarray(g), cv2.CV_32F).var())
+    g = g.astype(np.float32)
+    lap = 4.0 * g[1:-1, 1:-1] - g[:-2, 1:-1] - g[2:, 1:-1] - g[1:-1, :-2] - g[1:-1, 2:]
+    return float(lap.var())
+
+
+def yuv420_to_rgb(yuv, width, height):
+    # Picamera2 の YUV420 配列（h*3/2 行 x stride）を RGB に変換
+    import numpy as np
+
+    stride = yuv.shape[1]
+    cv2 = _optional_cv2()
+    if cv2 is not None and stride == width:
+        return cv2.cvtColor(yuv[: height * 3 // 2], cv2.COLOR_YUV420p2RGB)
+    y = yuv[:height, :width].astype(np.float32)
+    chroma = yuv[height:height + height // 2].reshape(2, height // 2, stride // 2)
+    u = chroma[0, :, : width // 2].astype(np.float32) - 128.0
+    v = chroma[1, :, : width // 2].astype(np.float32) - 128.0
+    u = u.repeat(2, axis=0).repeat(2, axis=1)[:height, :width]
+    v = v.repeat(2, axis=0).repeat(2, axis=1)[:height, :width]
+    rgb = np.empty((height, width, 3), dtype=np.float32)
+    rgb[..., 0] = y + 1.402 * v
+    rgb[..., 1] = y - 0.344136 * u - 0.714136 * v
+    rgb[..., 2] = y + 1.772 * u
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+class JpegEncoder:
+    # HxWx3 uint8 配列を JPEG にする。orders は変換なしで受け取れるチャンネル順（BGR のまま渡せるかどうか）
+
+    name = "base"
+    orders = ("RGB",)
+
+    @classmethod
+    def available(cls):
+        return False
+
+    def encode(self, arr, quality, order="RGB"):
+        raise NotImplementedError
+
+
+class PillowEncoder(JpegEncoder):
+    name = "pillow"
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def encode(self, arr, quality, order="RGB"):
+        arr = packed(arr)
+        if order != "RGB":
+            cv2 = _optional_cv2()
+            arr = cv2.cvtColor(arr, cv2.COLOR_BGR2RGB) if cv2 is not None else arr[..., ::-1]
+        buf = io.BytesIO()
+        Image.fromarray(arr, mode="RGB").save(buf, format="JPEG", quality=quality)
+        return buf.getvalue()
+
+
+class OpenCVEncoder(JpegEncoder):
+    name = "opencv"
+    orders = ("BGR",)
+
+    def __init__(self):
+        import cv2
+        self.cv2 = cv2
+
+    @classmethod
+    def available(cls):
+        try:
+            import cv2  # noqa: F401
+        except Exception:
+            return False
+        return True
+
+    def encode(self, arr, quality, order="RGB"):
+        arr = packed(arr)
+        if order != "BGR":
+            arr = self.cv2.cvtColor(arr, self.cv2.COLOR_RGB2BGR)
+        ok, buf = self.cv2.imencode(".jpg", arr, [self.cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+        if not ok:
+            raise RuntimeError("cv2.imencode failed")
+        return buf.tobytes()
+
+
+class SimpleJpegEncoder(JpegEncoder):
+    name = "simplejpeg"
+    orders = ("RGB", "BGR")
+
+    def __init__(self):
+        import simplejpeg
+        self.simplejpeg = simplejpeg
+
+    @classmethod
+    def available(cls):
+        try:
+            import simplejpeg  # noqa: F401
+        except Exception:
+            return False
+        return True
+
+    def encode(self, arr, quality, order="RGB"):
+        return self.simplejpeg.encode_jpeg(
+            packed(arr), quality=int(quality), colorspace=order, colorsubsampling="420"
+        )
+
+
+class TurboJpegEncoder(JpegEncoder):
+    name = "turbojpeg"
+    orders = ("RGB", "BGR")
 
-class CameraBase:
     def __init__(self):
-        self.width, self.height = FRAME_SIZE
+        import turbojpeg
+        self.turbojpeg = turbojpeg
+        self.jpeg = turbojpeg.TurboJPEG()
+
+    @classmethod
+    def available(cls):
+        try:
+            import turbojpeg
+            turbojpeg.TurboJPEG()
+        except Exception:
+            return False
+        return True
+
+    def encode(self, arr, quality, order="RGB"):
+        fmt = self.turbojpeg.TJPF_BGR if order == "BGR" else self.turbojpeg.TJPF_RGB
+        return self.jpeg.encode(
+            packed(arr), quality=int(quality), pixel_format=fmt,
+            jpeg_subsample=self.turbojpeg.TJSAMP_420,
+        )
+
+
+JPEG_ENCODERS = {cls.name: cls for cls in (PillowEncoder, OpenCVEncoder, SimpleJpegEncoder, TurboJpegEncoder)}
+
+_encoder_lock = threading.Lock()
+_selected_encoder = None
+
+
+def _synthetic_rgb(width, height, seed=0):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    return np.clip(base + rng.normal(0, 12, size=(height, width, 3)), 0, 255).astype(np.uint8)
+
+
+def benchmark_encoder(encoder, arr, quality, runs=5):
+    # encoder で arr を符号化したときの平均（1 フレームの ms, バイト数）
+    encoder.encode(arr, quality)  # warm up
+    size = 0
+    started = time.perf_counter()
+    for _ in range(runs):
+        size = len(encoder.encode(arr, quality))
+    return (time.perf_counter() - started) / runs * 1000.0, size
+
+
+def available_encoders():
+    return [name for name, cls in JPEG_ENCODERS.items() if cls.available()]
+
+
+def select_encoder(preference=None):
+    # JPEG エンコーダを選ぶ: 設定のものが使えればそれ、無ければ起動時の短い計測で最速のもの（プロセスで一度だけ）
+    global _selected_encoder
+    preference = (preference or JPEG_ENCODER or "auto").strip().lower()
+    with _encoder_lock:
+        if _selected_encoder is not None and preference in {"auto", _selected_encoder.name}:
+            return _selected_encoder
+        if preference != "auto":
+            cls = JPEG_ENCODERS.get(preference)
+            if cls is not None and cls.available():
+                _selected_encoder = cls()
+                return _selected_encoder
+            print(f"[WARN] JPEG encoder '{preference}' unavailable, selecting automatically")
+        candidates = [JPEG_ENCODERS[name]() for name in available_encoders()]
+        if len(candidates) == 1:
+            _selected_encoder = candidates[0]
+            return _selected_encoder
+        sample = _synthetic_rgb(640, 360)
+        timings = []
+        for encoder in candidates:
+            try:
+                ms, _size = benchmark_encoder(encoder, sample, JPEG_QUALITY, runs=3)
+            except Exception as e:
+                debug_print(f"[DEBUG] encoder {encoder.name} failed benchmark:", e)
+                continue
+            timings.append((ms, encoder))
+            debug_print(f"[DEBUG] encoder {encoder.name}: {ms:.2f} ms/frame @640x360")
+        _selected_encoder = min(timings, key=lambda t: t[0])[1] if timings else PillowEncoder()
+        return _selected_encoder
+
+
+def _resize_array(arr, size):
+    arr = packed(arr)
+    cv2 = _optional_cv2()
+    if cv2 is not None:
+        return cv2.resize(arr, size, interpolation=cv2.INTER_AREA)
+    import numpy as np
+
+    return np.asarray(Image.fromarray(arr, mode="RGB").resize(size, Image.BILINEAR))
+
+
+def frame_view(frame, fmt, assumed_order="AUTO", native_order="RGB"):
+    # Picamera2 配列の色チャンネルをコピーせずビューで返す: (HxWx3 配列, "RGB"/"BGR")。CAMERA_COLOR_ORDER の指定が優先
+    fmt = (fmt or "").upper()
+    if fmt in {"XBGR8888", "XRGB8888"}:
+        view = frame[..., 1:4]
+        order = "BGR" if fmt == "XBGR8888" else "RGB"
+    else:
+        view = frame[..., :3] if frame.ndim == 3 and frame.shape[2] > 3 else frame
+        order = {"BGR888": "BGR", "RGB888": "RGB"}.get(fmt, native_order or "RGB")
+    if assumed_order in {"RGB", "BGR"}:
+        order = assumed_order
+    return view, order
+
+
+class Frame:
+    # 1 回のキャプチャ: ストリームごとの元配列・変換済み画素・プロファイル（と配信の段）ごとの JPEG。変換とエンコードは初回利用時
+
+    __slots__ = ("seq", "timestamp", "sensor_ts", "raw", "pixels", "encoded", "lock")
+
+    def __init__(self, raw=None, timestamp=None, seq=0, sensor_ts=None):
+        self.seq = seq
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.sensor_ts = sensor_ts  # seconds on the source's own clock, None if unknown
+        self.raw = raw or {}
+        self.pixels = {}  # stream -> (array, "RGB"/"BGR")
+        self.encoded = {}
         self.lock = threading.Lock()
+
+    def drop_raw(self):
+        # Replaces the dicts rather than clearing them: readers holding the old ones keep working
+        self.raw = {}
+        self.pixels = {}
+
+    @property
+    def data(self):
+        # プレビューの JPEG
+        return self.encoded.get("preview")
+
+
+class FrameBuffer:
+    # 直近フレームのリング。publish のたびに増える seq で新旧を見分け、wait_for_frame で新しいフレームを待てる
+
+    def __init__(self, size=FRAME_BUFFER_SIZE):
+        self._frames = deque(maxlen=max(1, int(size)))
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._closed = False
+
+    @property
+    def seq(self):
+        with self._cond:
+            return self._seq
+
+    def publish(self, frame):
+        with self._cond:
+            self._seq = next(_frame_seq)
+            frame.seq = self._seq
+            self._frames.append(frame)
+            if len(self._frames) > RAW_FRAMES_KEPT:
+                self._frames[-RAW_FRAMES_KEPT - 1].drop_raw()
+            self._cond.notify_all()
+        return frame
+
+    def latest(self):
+        with self._cond:
+            return self._frames[-1] if self._frames else None
+
+    def get(self, seq):
+        with self._cond:
+            for frame in reversed(self._frames):
+                if frame.seq == seq:
+                    return frame
+                if frame.seq < seq:
+                    break
+        return None
+
+    def since(self, after_seq):
+        # after_seq より新しく、まだリングに残っているフレーム
+        with self._cond:
+            return [f for f in self._frames if f.seq > after_seq]
+
+    def wait_for_frame(self, after_seq=0, timeout=None):
+        # after_seq より新しいフレームが来るまで待って最新を返す（途中は飛ばす）。タイムアウトか close 後は None
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: self._closed or (self._frames and self._frames[-1].seq > after_seq),
+                timeout,
+            )
+            if not ready or not self._frames or self._frames[-1].seq <= after_seq:
+                return None
+            return self._frames[-1]
+
+    def open(self):
+        with self._cond:
+            self._closed = False
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class EncodeStage:
+    # キャプチャループと FrameBuffer の間のワーカープール。キューが満杯なら最も古い待ちフレームを捨て（キャプチャは待たない）、
+    # 並列に処理した結果は投入順に publish する（seq が戻らない）
+
+    def __init__(self, work, publish, workers=2, depth=4, name="encode"):
+        self._work = work
+        self._publish = publish
+        self._depth = max(1, int(depth))
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._tickets = itertools.count()
+        self._finished = {}  # ticket -> Frame, or None when dropped
+        self._next_ticket = 0
+        self._order_lock = threading.Lock()
+        self._busy = 0
+        self._running = True
+        self.dropped = 0
+        self.processed = 0
+        self.workers = max(1, int(workers))
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, frame):
+        dropped = None
+        with self._cond:
+            self._queue.append((next(self._tickets), frame))
+            if len(self._queue) > self._depth:
+                dropped = self._queue.popleft()
+                self.dropped += 1
+            self._cond.notify()
+        if dropped is not None:
+            self._finish(dropped[0], None)
+
+    def stop(self, timeout=1.0):
+        with self._cond:
+            self._running = False
+            self._queue.clear()
+            self._cond.notify_all()
+        for t in self._threads:
+            if t is not threading.current_thread():
+                t.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._queue)
+            busy = self._busy
+        return {
+            "workers": self.workers,
+            "queue": queued,
+            "in_flight": busy,
+            "processed": self.processed,
+            "dropped": self.dropped,
+        }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                ticket, frame = self._queue.popleft()
+                self._busy += 1
+            try:
+                self._work(frame)
+            except Exception as e:
+                # The frame is still published; consumers encode it lazily
+                print("[ERROR] encode stage:", e)
+            with self._cond:
+                self._busy -= 1
+                self.processed += 1
+            self._finish(ticket, frame)
+
+    def _finish(self, ticket, frame):
+        with self._order_lock:
+            self._finished[ticket] = frame
+            while self._next_ticket in self._finished:
+                ready = self._finished.pop(self._next_ticket)
+                self._next_ticket += 1
+                if ready is not None and self._running:
+                    self._publish(ready)
+
+
+class FramePacer:
+    # 期限ベースで目標 FPS に刻む（処理時間は間隔から差し引く）。1 周期以上遅れたら取りこぼしとして数え、追いつこうと連写はしない
+    # record() にセンサー時刻を渡すと実測 FPS・揺らぎを集計する
+
+    def __init__(self, fps, window=120):
+        self.fps = 0.0
+        self.interval = 0.0
+        self.set_fps(fps)
+        self._next_due = None
+        self._last_ts = None
+        self._intervals = deque(maxlen=window)
+        self._source = "clock"
+        self.frames = 0
+        self.dropped = 0
+
+    def set_fps(self, fps):
+        self.fps = float(fps) if fps and fps > 0 else 0.0
+        self.interval = 1.0 / self.fps if self.fps else 0.0
+
+    def reset(self):
+        # 予定をやり直す（アイドル明けの休止を取りこぼしに数えない）
+        self._next_due = None
+        self._last_ts = None
+
+    def hold(self):
+        # このフレームはペース調整しない（連写用）。予定は後でやり直す
+        self._next_due = None
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        due = self._next_due if self._next_due is not None else now
+        if due > now:
+            time.sleep(due - now)
+        else:
+            self.dropped += int((now - due) / self.interval)
+        self._next_due = max(due, now - self.interval) + self.interval
+
+    def record(self, sensor_ts=None):
+        if sensor_ts is None:
+            ts, self._source = time.monotonic(), "clock"
+        else:
+            ts, self._source = sensor_ts, "sensor"
+        if self._last_ts is not None and ts > self._last_ts:
+            self._intervals.append(ts - self._last_ts)
+        self._last_ts = ts
+        self.frames += 1
+
+    def stats(self):
+        intervals = list(self._intervals)
+        achieved = jitter = mean = 0.0
+        if intervals:
+            mean = sum(intervals) / len(intervals)
+            achieved = 1.0 / mean if mean else 0.0
+            jitter = (sum((i - mean) ** 2 for i in intervals) / len(intervals)) ** 0.5
+        return {
+            "target_fps": round(self.fps, 2),
+            "fps": round(achieved, 2),
+            "interval_ms": round(mean * 1000.0, 2),
+            "jitter_ms": round(jitter * 1000.0, 2),
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "timestamps": self._source,
+        }
+
+
+class Burst:
+    # 連写 1 回分のフレーム（事前確保したバッファにキャプチャスレッドがコピー）。count 枚か、最初のフレームから duration 秒で終了
+    # 配列はバッファのビューなので、エンコードし終えたら release() で次の連写に返す
+
+    def __init__(self, count, duration=None):
+        self.count = count
+        self.duration = duration
+        self.buffer = None
+        self.frames = []  # (order, timestamp, sensor_ts) per filled slot
+        self.done = threading.Event()
+        self._release = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame(self, index):
+        # 1 枚分の (配列, 順序, 撮影時刻, センサー時刻)
+        order, timestamp, sensor_ts = self.frames[index]
+        return self.buffer[index], order, timestamp, sensor_ts
+
+    def fps(self):
+        stamps = [s if s is not None else t for _, t, s in self.frames]
+        if len(stamps) < 2 or stamps[-1] <= stamps[0]:
+            return None
+        return (len(stamps) - 1) / (stamps[-1] - stamps[0])
+
+    def release(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+
+class AdjustmentEngine:
+    # ソフトウェア補正を 2 パスで: コントラスト・明るさは 256 段のテーブル 1 つ、彩度は輝度とのブレンド、シャープネスだけ Pillow
+    # テーブルは configure() で設定が変わったときだけ作り直す
+
+    # Pillow's RGB->L weights in 16-bit fixed point
+    LUMA_WEIGHTS = (19595, 38470, 7471)
+
+    def __init__(self, settings=None):
+        self._lock = threading.Lock()
+        self._luts = {}
+        self.contrast = 1.0
+        self.gains = ()
+        self.saturation = 1.0
+        self.sharpness = 1.0
+        if settings:
+            self.configure(settings)
+
+    def configure(self, settings):
+        contrast = float(settings.get("contrast", 1.0))
+        iso_factor = float(settings.get("iso", 100.0)) / 100.0
+        ev = float(settings.get("ev", 0.0))
+        gains = []
+        if abs(iso_factor - 1.0) > 0.01:
+            gains.append(iso_factor)
+        if abs(ev) > 0.01:
+            gains.append(pow(2.0, ev))
+        with self._lock:
+            self.contrast = contrast if abs(contrast - 1.0) > 0.01 else 1.0
+            self.gains = tuple(gains)
+            self.saturation = float(settings.get("saturation", 1.0))
+            self.sharpness = float(settings.get("sharpness", 1.0))
+            self._luts = {}
+
+    @property
+    def uses_lut(self):
+        return self.contrast != 1.0 or bool(self.gains)
+
+    @property
+    def active(self):
+        return (
+            self.uses_lut
+            or abs(self.saturation - 1.0) > 0.01
+            or abs(self.sharpness - 1.0) > 0.01
+        )
+
+    def _luma(self, arr, order):
+        import numpy as np
+
+        cv2 = _optional_cv2()
+        if cv2 is not None:
+            code = cv2.COLOR_BGR2GRAY if order == "BGR" else cv2.COLOR_RGB2GRAY
+            return cv2.cvtColor(packed(arr), code)
+        wr, wg, wb = self.LUMA_WEIGHTS
+        if order == "BGR":
+            wr, wb = wb, wr
+        acc = arr[..., 0].astype(np.uint32) * wr
+        acc += arr[..., 1].astype(np.uint32) * wg
+        acc += arr[..., 2].astype(np.uint32) * wb
+        return ((acc + 0x8000) >> 16).astype(np.uint8)
+
+    def _lut(self, pivot):
+        import numpy as np
+
+        with self._lock:
+            lut = self._luts.get(pivot)
+            if lut is not None:
+                return lut
+            # Pillow's blend truncates towards zero after each enhancement step
+            v = np.arange(256, dtype=np.float32)
+            if self.contrast != 1.0:
+                v = np.floor(np.clip(pivot + np.float32(self.contrast) * (v - pivot), 0, 255))
+            for gain in self.gains:
+                v = np.floor(np.clip(v * np.float32(gain), 0, 255))
+            lut = v.astype(np.uint8)
+            self._luts[pivot] = lut
+            return lut
+
+    def apply(self, arr, order="RGB"):
+        # 補正したコピーを返す（補正が無効なら arr をそのまま）
+        import numpy as np
+
+        if not self.active:
+            return arr
+        saturate = abs(self.saturation - 1.0) > 0.01
+        sharpen = abs(self.sharpness - 1.0) > 0.01
+        lut = None
+        if self.uses_lut:
+            pivot = 0
+            if self.contrast != 1.0:
+                pivot = int(self._luma(arr[::4, ::4], order).mean() + 0.5)
+            lut = self._lut(pivot)
+        cv2 = _optional_cv2()
+        if cv2 is not None:
+            arr = packed(arr)
+            if lut is not None:
+                arr = cv2.LUT(arr, lut)
+            if saturate:
+                gray = cv2.cvtColor(self._luma(arr, order), cv2.COLOR_GRAY2RGB)
+                arr = cv2.addWeighted(arr, self.saturation, gray, 1.0 - self.saturation, 0.0)
+            if not sharpen:
+                return arr
+        # Without OpenCV, Pillow's C loops beat NumPy fancy indexing: one point() pass for the LUT
+        if order == "BGR":
+            arr = arr[..., ::-1]
+        img = Image.fromarray(np.ascontiguousarray(arr), mode="RGB")
+        if cv2 is None:
+            if lut is not None:
+                img = img.point(lut.tolist() * 3)
+            if saturate:
+                img = ImageEnhance.Color(img).enhance(self.saturation)
+        if sharpen:
+            img = ImageEnhance.Sharpness(img).enhance(self.sharpness)
+        arr = np.asarray(img)
+        return arr[..., ::-1] if order == "BGR" else arr
+
+
+class CameraBase:
+    def __init__(self, size=None):
+        # `size` is the preview/capture resolution for this camera (FRAME_SIZE by default)
+        self.width, self.height = size or FRAME_SIZE
         self.running = False
-        self.last_frame = None  # JPEG bytes
+        self.frames = FrameBuffer()
+        self.profiles = {
+            "still": Profile("still", STILL_SIZE, STILL_QUALITY, "main"),
+            "preview": Profile("preview", (self.width, self.height), JPEG_QUALITY, "lores"),
+            "thumb": Profile("thumb", THUMB_SIZE, THUMB_QUALITY, "lores"),
+        }
+        self._profile_users = {}
+        self._profile_lock = threading.Lock()
+        self.encoder = select_encoder()
+        # On-demand encoding / idle bookkeeping
+        self.encode_on_demand = ENCODE_ON_DEMAND
+        self._last_demand = time.time()
+        self._demand = threading.Event()
+        self.frames_captured = 0
+        self.encode_counts = {}
+        self._count_lock = threading.Lock()
+        self.pacer = FramePacer(CAPTURE_FPS)
+        self._burst = None
+        self._burst_lock = threading.Lock()
+        self._burst_spare = None  # buffer of the last released burst, kept for the next one
+        self._taps = ()  # callables run on every captured frame (see add_frame_tap)
+        self.encode_workers = ENCODE_WORKERS
+        self._stage = None
+        self._t = None
+        # Readiness: set once the source delivers usable frames (see _frame_ready)
+        self._ready = threading.Event()
+        self.started_at = None
+        self.ready_at = None
+        self.ready_ms = None
+        self.ready_reason = None
         self._settings_lock = threading.Lock()
         self.camera_id = "default"
         self._adjustments = {
@@ -44,26 +779,474 @@ class CameraBase:
             "awb_mode": "auto",
             "hdr": False,
         }
-        self.software_adjustments = True
+        self.software_adjustments = True
+        self.adjuster = AdjustmentEngine(self._adjustments)
 
     def start(self):
         self.running = True
+        self._last_demand = time.time()
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        self.frames.open()
+        if self.encode_workers > 0:
+            self._stage = EncodeStage(
+                self._prepare_frame,
+                self.frames.publish,
+                workers=self.encode_workers,
+                depth=ENCODE_QUEUE_SIZE,
+                name=f"{self.__class__.__name__}-encode",
+            )
         self._t = threading.Thread(target=self._loop, daemon=True)
         self._t.start()
         debug_print(f"[DEBUG] {self.__class__.__name__}: capture thread started")
 
-    def stop(self):
-        self.running = False
+    def _halt(self):
+        # Stop the capture thread and the encode stage; the device stays as it is
+        self.running = False
+        self._demand.set()
+        t = self._t
+        if t is not None and t is not threading.current_thread():
+            t.join(2.0)
+        if self._stage is not None:
+            self._stage.stop()
+            self._stage = None
 
-    def _loop(self):
+    def stop(self):
+        self._halt()
+        self.frames.close()
+
+    def pause(self):
+        # ホットスタンバイ: デバイスは開いて設定したまま、キャプチャだけ止める
+        self._halt()
+        self._pause_device()
+
+    def resume(self):
+        # スタンバイから戻る（デバイスは開き直さない）
+        self._resume_device()
+        self.start()
+
+    def _pause_device(self):
+        pass
+
+    def _resume_device(self):
+        pass
+
+    def _frame_ready(self, raw):
+        # キャプチャしたフレームが使えるか（サブクラスで露出・AWB の収束を見る）
+        return True
+
+    def _check_ready(self, raw, captured_at):
+        if self._ready.is_set():
+            return
+        reason = None
+        if self._frame_ready(raw):
+            reason = "converged"
+        elif time.monotonic() - self.started_at > READY_TIMEOUT:
+            reason = "timeout"
+        if reason is None:
+            return
+        self.ready_at = captured_at
+        self.ready_ms = round((time.monotonic() - self.started_at) * 1000.0, 1)
+        self.ready_reason = reason
+        self._ready.set()
+        debug_print(f"[DEBUG] {self.camera_id}: ready after {self.ready_ms} ms ({reason})")
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=READY_TIMEOUT):
+        # カメラの準備完了まで待つ（固定のウォームアップ待ちの代わり）
+        return self._ready.wait(timeout)
+
+    def _capture(self):
+        # 1 フレーム取る: ({ストリーム: 元配列}, 撮影時刻, センサー時刻（秒、無ければ None)）か None。ペース調整はループ側
         raise NotImplementedError
 
-    def get_jpeg(self):
-        with self.lock:
-            return self.last_frame
+    def _to_pixels(self, stream, arr):
+        # _capture の元配列から、エンコーダに渡す (配列, チャンネル順) を作る
+        return arr, "RGB"
+
+    def _touch(self):
+        # A consumer asked for frames: leave idle mode right away
+        self._last_demand = time.time()
+        self._demand.set()
+
+    def is_idle(self):
+        # Frame taps (e.g. motion detection) are consumers too: never idle while one is attached
+        if self._taps:
+            return False
+        return IDLE_AFTER_SEC > 0 and (time.time() - self._last_demand) > IDLE_AFTER_SEC
+
+    def demand_age(self):
+        # 最後にフレームを求められてからの秒数（タップがあれば常に使用中として 0）
+        return 0.0 if self._taps else time.time() - self._last_demand
+
+    def stats(self):
+        encodes = dict(self.encode_counts)
+        return {
+            "frames_captured": self.frames_captured,
+            "encodes": encodes,
+            "encodes_avoided": max(0, self.frames_captured - encodes.get("preview", 0)),
+            "encode_on_demand": self.encode_on_demand,
+            "encoder": self.encoder.name,
+            "idle": self.is_idle(),
+            "ready": self.is_ready(),
+            "ready_ms": self.ready_ms,
+            "ready_reason": self.ready_reason,
+            "capture": self.pacer.stats(),
+            "encode_stage": self._stage.stats() if self._stage is not None else None,
+        }
+
+    def _loop(self):
+        name = self.__class__.__name__
+        debug_print(f"[DEBUG] {name}: loop started")
+        self.pacer.reset()
+        while self.running:
+            try:
+                started = time.perf_counter()
+                captured = self._capture()
+                if captured is None:
+                    continue
+                STAGE_SECONDS.observe(time.perf_counter() - started, self.camera_id, "capture")
+                raw, captured_at, sensor_ts = captured
+                self._check_ready(raw, captured_at)
+                frame = Frame(raw, captured_at, sensor_ts=sensor_ts)
+                bursting = self._burst is not None and self._burst_offer(frame)
+                for tap in self._taps:
+                    try:
+                        tap(frame)
+                    except Exception as e:
+                        print(f"[WARN] {name} frame tap failed:", e)
+                if self._stage is not None:
+                    self._stage.submit(frame)
+                else:
+                    self._prepare_frame(frame)
+                    self.frames.publish(frame)
+                self.frames_captured += 1
+                self.pacer.record(sensor_ts)
+                if CAMERA_DEBUG:
+                    pacing = self.pacer.stats()
+                    debug_print(f"[DEBUG] {self.camera_id}: {pacing['fps']} fps, {pacing['dropped']} dropped, "
+                                f"{self.frames_captured} captured", every=CAMERA_DEBUG_INTERVAL, key=(id(self), "loop"))
+                if bursting:
+                    # Full source rate while a burst is being captured
+                    self.pacer.hold()
+                elif self.is_idle():
+                    # Nobody watching: drop to IDLE_FPS until a consumer shows up
+                    self._demand.clear()
+                    self._demand.wait(1.0 / max(0.01, IDLE_FPS))
+                    self.pacer.reset()
+                else:
+                    self.pacer.wait()
+            except Exception as e:
+                print(f"[ERROR] {name} loop exception:", e)
+                time.sleep(0.2)
+        debug_print(f"[DEBUG] {name}: loop stopped")
+
+    def add_frame_tap(self, tap):
+        # キャプチャスレッドで全フレームに tap(frame) を呼ぶ。変換前の元配列が渡るので、重い処理は別スレッドへ回すこと
+        with self._profile_lock:
+            if tap not in self._taps:
+                self._taps = self._taps + (tap,)
+
+    def remove_frame_tap(self, tap):
+        with self._profile_lock:
+            self._taps = tuple(t for t in self._taps if t != tap)
+
+    def luma(self, raw, width=160):
+        # 解析用の小さなグレースケール（幅 約 width 画素）。低解像度ストリームを間引くだけで色変換もコピーもしない
+        stream = "lores" if "lores" in raw else "main"
+        arr = raw.get(stream)
+        if arr is None:
+            return None
+        plane = self._luma(stream, arr)
+        step = max(1, plane.shape[1] // max(1, width))
+        return plane[::step, ::step]
+
+    def _luma(self, stream, arr):
+        # Green is channel 1 in RGB, BGR and the 4-byte X*8888 layouts alike
+        return arr[:, :, 1] if arr.ndim == 3 else arr
+
+    def burst(self, count=None, duration=None, timeout=3.0):
+        # 静止画ストリームをセンサーの最大レートで連写（count 枚、最大 BURST_MAX_FRAMES か duration 秒）
+        # 取り込んだ時点で Burst を返す。エンコードは呼び出し側（encode_pixels と Burst.release）
+        count = max(1, min(BURST_MAX_FRAMES, int(count or BURST_MAX_FRAMES)))
+        burst = Burst(count, float(duration) if duration else None)
+        with self._burst_lock:
+            if self._burst is not None:
+                raise RuntimeError("a burst is already being captured")
+            self._burst = burst
+        self._touch()
+        self.acquire_profile("still")
+        try:
+            self.wait_ready(timeout)
+            burst.done.wait(timeout + (burst.duration or 0.0))
+        finally:
+            # Under the lock, so a capture thread still inside _burst_offer cannot add
+            # a frame (or allocate a buffer) after this returns
+            with self._burst_lock:
+                burst.done.set()
+                self._burst = None
+            self.release_profile("still")
+        if not len(burst):
+            burst.release()
+        return burst
+
+    def _burst_offer(self, frame):
+        # Capture thread: copy `frame` into the running burst; False once it is complete
+        burst = self._burst
+        if burst is None or burst.done.is_set():
+            return False
+        if self.ready_at is None or frame.timestamp < self.ready_at:
+            return True
+        with frame.lock:
+            pixels = self._profile_source(frame, self.profiles["still"])
+        if pixels is None:
+            return True
+        arr, order = pixels
+        with self._burst_lock:
+            if burst.done.is_set():
+                return False
+            if burst.buffer is None:
+                self._allocate_burst(burst, arr.shape, arr.dtype)
+            index = len(burst.frames)
+            packed(arr, out=burst.buffer[index])
+            burst.frames.append((order, frame.timestamp, frame.sensor_ts))
+            first = burst.frames[0][1]
+            if len(burst.frames) >= len(burst.buffer) or (burst.duration and frame.timestamp - first >= burst.duration):
+                burst.done.set()
+            return not burst.done.is_set()
+
+    def _allocate_burst(self, burst, shape, dtype):
+        # Called with _burst_lock held
+        import numpy as np
+
+        # Never hold more than BURST_MAX_MB of raw frames
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        capacity = max(1, min(burst.count, int(BURST_MAX_MB * 1024 * 1024) // max(1, frame_bytes)))
+        spare, self._burst_spare = self._burst_spare, None
+        if spare is not None and spare.shape[1:] == tuple(shape) and spare.dtype == dtype and len(spare) >= capacity:
+            buffer = spare
+        else:
+            buffer = np.empty((capacity,) + tuple(shape), dtype=dtype)
+        burst.buffer = buffer[:capacity]
+
+        def release():
+            with self._burst_lock:
+                self._burst_spare = buffer
+
+        burst._release = release
+
+    def encode_raw(self, raw, profile="still"):
+        # フレームタップに渡る元配列をプロファイルの JPEG に（そのストリームが無ければある方の解像度で）
+        pixels = self._raw_pixels(raw, profile)
+        if pixels is None:
+            return None
+        return self.encode_pixels(pixels[0], pixels[1], profile)
+
+    def render_raw(self, raw, profile="preview", size=None):
+        # 元配列を、プロファイルの JPEG と同じ見た目の (配列, 順序) に（size に収めて補正も適用）。動画エンコーダ用
+        pixels = self._raw_pixels(raw, profile)
+        if pixels is None:
+            return None
+        arr, order = pixels
+        return self._render_array(arr, size or self.profiles[profile].size, order), order
+
+    def _raw_pixels(self, raw, profile):
+        # Profile's stream, else whatever the capture carries
+        stream = self.profiles[profile].stream
+        if stream not in raw:
+            stream = "main" if "main" in raw else "lores"
+        if stream not in raw:
+            return None
+        return self._to_pixels(stream, raw[stream])
+
+    def encode_pixels(self, arr, order="RGB", profile="still"):
+        # 画素配列をプロファイルのサイズ・品質・補正で JPEG に
+        prof = self.profiles[profile]
+        data = self._encode_array(arr, prof.size, prof.quality, order)
+        with self._count_lock:
+            self.encode_counts[profile] = self.encode_counts.get(profile, 0) + 1
+        return data
+
+    def _eager_profiles(self):
+        # 要求を待たずにエンコードするプロファイル: ENCODE_ON_DEMAND でなければ preview と、取得中の全プロファイル
+        with self._profile_lock:
+            names = [n for n in self._profile_users if n in self.profiles]
+        if not self.encode_on_demand and "preview" not in names:
+            names.append("preview")
+        return names
+
+    def _prepare_frame(self, frame):
+        # エンコード段での 1 フレーム分の処理（ワーカープールで動く）
+        for name in self._eager_profiles():
+            self.encode_frame(frame, name)
+
+    def acquire_profile(self, name):
+        # name の利用者を登録する: 元ストリームをキャプチャさせ、保持中はワーカーでエンコードする
+        with self._profile_lock:
+            self._profile_users[name] = self._profile_users.get(name, 0) + 1
+
+    def release_profile(self, name):
+        with self._profile_lock:
+            count = self._profile_users.get(name, 0) - 1
+            if count > 0:
+                self._profile_users[name] = count
+            else:
+                self._profile_users.pop(name, None)
+
+    def _stream_wanted(self, stream):
+        with self._profile_lock:
+            names = list(self._profile_users)
+        return any(self.profiles[n].stream == stream for n in names if n in self.profiles)
+
+    def _source_stream(self, raw, profile):
+        if profile.stream in raw:
+            return profile.stream
+        if profile.stream == "lores" and "main" in raw:
+            return "main"
+        return None
+
+    def _profile_source(self, frame, profile):
+        # プロファイルの元になる (配列, 順序)、無ければ None。frame.lock を持って呼ぶ
+        # One read of frame.raw: FrameBuffer.publish may swap it for {} (drop_raw) meanwhile
+        raw = frame.raw
+        stream = self._source_stream(raw, profile)
+        if stream is None:
+            return None
+        pixels = frame.pixels.get(stream)
+        if pixels is None:
+            started = time.perf_counter()
+            pixels = self._to_pixels(stream, raw[stream])
+            STAGE_SECONDS.observe(time.perf_counter() - started, self.camera_id, "convert")
+            frame.pixels[stream] = pixels
+        return pixels
+
+    def _render_array(self, arr, size, order="RGB"):
+        height, width = arr.shape[:2]
+        target = _fit_size((width, height), size)
+        if target != (width, height):
+            started = time.perf_counter()
+            arr = _resize_array(arr, target)
+            STAGE_SECONDS.observe(time.perf_counter() - started, self.camera_id, "convert")
+        if self._software_adjustments_active():
+            started = time.perf_counter()
+            arr = self.adjuster.apply(arr, order)
+            STAGE_SECONDS.observe(time.perf_counter() - started, self.camera_id, "adjust")
+        return arr
+
+    def _encode_array(self, arr, size, quality, order="RGB"):
+        arr = self._render_array(arr, size, order)
+        started = time.perf_counter()
+        data = self.encoder.encode(arr, quality, order)
+        STAGE_SECONDS.observe(time.perf_counter() - started, self.camera_id, "encode")
+        return data
+
+    def encode_frame(self, frame, profile="preview"):
+        # frame のプロファイル JPEG（1 回だけエンコードしてフレームにキャッシュ）
+        if frame is None:
+            return None
+        prof = self.profiles[profile]
+        data = frame.encoded.get(profile)
+        if data is not None:
+            return data
+        with frame.lock:
+            data = frame.encoded.get(profile)
+            if data is None:
+                pixels = self._profile_source(frame, prof)
+                if pixels is None:
+                    return None
+                arr, order = pixels
+                data = self._encode_array(arr, prof.size, prof.quality, order)
+                frame.encoded[profile] = data
+                with self._count_lock:
+                    self.encode_counts[profile] = self.encode_counts.get(profile, 0) + 1
+        return data
+
+    def capture_jpeg(self, profile="still", timeout=3.0):
+        # 元ストリームを持つ最新フレームから profile の JPEG を作る。ストリームを取っていなければ 1 フレームだけ取得し、
+        # 準備完了前（暗い・収束前）のフレームは使わない
+        self._touch()
+        prof = self.profiles[profile]
+        self.wait_ready(timeout)
+
+        def usable(f):
+            if self.ready_at is not None and f.timestamp < self.ready_at:
+                return False
+            return self._source_stream(f.raw, prof) is not None
+
+        frame = self.frames.latest()
+        if frame is None or not usable(frame):
+            self.acquire_profile(profile)
+            try:
+                deadline = time.time() + timeout
+                after = frame.seq if frame else 0
+                frame = None
+                while frame is None and time.time() < deadline:
+                    candidate = self.wait_for_frame(after, max(0.0, deadline - time.time()))
+                    if candidate is None:
+                        break
+                    after = candidate.seq
+                    if usable(candidate):
+                        frame = candidate
+            finally:
+                self.release_profile(profile)
+        return self.encode_frame(frame, profile)
+
+    @property
+    def last_frame(self):
+        return self.get_jpeg()
+
+    def get_frame(self):
+        # 最新の Frame（最初のキャプチャ前は None）
+        self._touch()
+        return self.frames.latest()
+
+    def wait_for_frame(self, after_seq=0, timeout=None):
+        self._touch()
+        return self.frames.wait_for_frame(after_seq, timeout)
+
+    def get_jpeg(self, profile="preview"):
+        return self.encode_frame(self.get_frame(), profile)
+
+    def get_jpeg_variant(self, frame, quality=None, scale=1.0):
+        # frame を品質・縮小率を変えた JPEG に（配信の段の 1 つ）。フレームにキャッシュし、同じ段の視聴者で共有する
+        if frame is None:
+            return None
+        if scale >= 1.0 and (not quality or int(quality) >= JPEG_QUALITY):
+            return self.encode_frame(frame, "preview")
+        quality = max(10, min(JPEG_QUALITY, int(quality or JPEG_QUALITY)) // 5 * 5)
+        prof = self.profiles["preview"]
+        size = prof.size if scale >= 1.0 else (max(16, int(prof.size[0] * scale)), max(16, int(prof.size[1] * scale)))
+        key = ("preview", quality, size)
+        data = frame.encoded.get(key)
+        if data is not None:
+            return data
+        with frame.lock:
+            data = frame.encoded.get(key)
+            if data is not None:
+                return data
+            pixels = self._profile_source(frame, prof)
+            if pixels is not None:
+                arr, order = pixels
+                data = self._encode_array(arr, size, quality, order)
+            else:
+                preview = frame.data
+                if preview is None:
+                    return None
+                img = Image.open(io.BytesIO(preview))
+                img.thumbnail(size)
+                buf = io.BytesIO()
+                img.save(buf, format="JPEG", quality=quality)
+                data = buf.getvalue()
+            frame.encoded[key] = data
+        label = f"preview@{size[0]}x{size[1]}q{quality}"
+        with self._count_lock:
+            self.encode_counts[label] = self.encode_counts.get(label, 0) + 1
+        return data
 
-    def save_snapshot(self, path=None):
-        data = self.get_jpeg()
+    def save_snapshot(self, path=None, profile="still"):
+        data = self.capture_jpeg(profile)
         if not data:
             print(f"[WARN] {self.__class__.__name__}: no frame available for snapshot")
             return None
@@ -141,6 +1324,7 @@ class CameraBase:
             if updated:
                 current = dict(self._adjustments)
         if updated and current:
+            self.adjuster.configure(current)
             self._apply_runtime_adjustments(current)
         return updated
 
@@ -148,32 +1332,13 @@ class CameraBase:
         # Subclasses override when they can touch hardware controls
         pass
 
-    def _apply_adjustments(self, img):
-        if not getattr(self, "software_adjustments", True):
-            return img
-        adj = self.get_adjustments()
-        contrast = adj.get("contrast", 1.0)
-        if abs(contrast - 1.0) > 0.01:
-            img = ImageEnhance.Contrast(img).enhance(contrast)
-        iso = adj.get("iso", 100.0)
-        iso_factor = iso / 100.0
-        if abs(iso_factor - 1.0) > 0.01:
-            img = ImageEnhance.Brightness(img).enhance(iso_factor)
-        ev = adj.get("ev", 0.0)
-        if abs(ev) > 0.01:
-            img = ImageEnhance.Brightness(img).enhance(pow(2.0, ev))
-        saturation = adj.get("saturation", 1.0)
-        if abs(saturation - 1.0) > 0.01:
-            img = ImageEnhance.Color(img).enhance(saturation)
-        sharpness = adj.get("sharpness", 1.0)
-        if abs(sharpness - 1.0) > 0.01:
-            img = ImageEnhance.Sharpness(img).enhance(sharpness)
-        return img
+    def _software_adjustments_active(self):
+        return getattr(self, "software_adjustments", True) and self.adjuster.active
 
 
 class Picamera2Camera(CameraBase):
-    def __init__(self, camera_index=None):
-        super().__init__()
+    def __init__(self, camera_index=None, size=None):
+        super().__init__(size)
         debug_print("[DEBUG] Picamera2Camera: initializing...")
         self.camera_index = camera_index
         effective_index = camera_index if camera_index is not None else 0
@@ -185,7 +1350,8 @@ class Picamera2Camera(CameraBase):
             from libcamera import controls as lib_controls
         except Exception:
             lib_controls = None
-        import time
+        self._metadata = {}
+        self._settle = {}
 
         if hasattr(Picamera2, "set_logging"):
             level = getattr(Picamera2, "ERROR", None)
@@ -207,13 +1373,11 @@ class Picamera2Camera(CameraBase):
             raise
 
         try:
-            self.config = self.picam2.create_preview_configuration(
-                main={"size": (self.width, self.height), "format": "RGB888"},
-                transform=Transform(hflip=0, vflip=0)
+            self._configure_streams(Transform(hflip=0, vflip=0))
+            debug_print(
+                f"[DEBUG] Picamera2Camera: configured with preview mode (format: {self.output_format},"
+                f" lores: {self.lores_format or 'none'})"
             )
-            self.picam2.configure(self.config)
-            self.output_format = self.picam2.camera_configuration()["main"]["format"]
-            debug_print(f"[DEBUG] Picamera2Camera: configured with preview mode (format: {self.output_format})")
         except Exception as e:
             print("[ERROR] Picamera2 configure failed:", e)
             raise
@@ -237,37 +1401,128 @@ class Picamera2Camera(CameraBase):
             print("[ERROR] Picamera2 start failed:", e)
             raise
 
-        time.sleep(1.0)
+        # No fixed warmup: the capture loop marks the camera ready once AE/AWB settle
         self.software_adjustments = False
         self._apply_runtime_adjustments(self.get_adjustments())
-        debug_print("[DEBUG] Picamera2Camera: warmup done")
-
-    def _loop(self):
-        import io, time
-        from PIL import Image
 
-        debug_print("[DEBUG] Picamera2Camera: loop started")
-        while self.running:
+    def _configure_streams(self, transform):
+        # main carries full-resolution stills, lores the preview. Pi 5 can give
+        # lores in RGB; older ISPs only do YUV420. Without lores, main is the preview.
+        still_size = tuple(STILL_SIZE) if STILL_SIZE else tuple(self.picam2.sensor_resolution)
+        self.lores_format = None
+        for lores_format in ("RGB888", "YUV420", None):
+            kwargs = {"main": {"size": still_size, "format": "RGB888"}, "transform": transform}
+            if lores_format:
+                kwargs["lores"] = {"size": (self.width, self.height), "format": lores_format}
+            else:
+                kwargs["main"] = {"size": (self.width, self.height), "format": "RGB888"}
             try:
-                frame = self.picam2.capture_array("main")
-                if frame is None:
-                    print("[WARN] capture_array returned None")
-                    time.sleep(0.2)
-                    continue
-                debug_print("[DEBUG] got frame:", frame.shape)
-                frame = self._frame_to_rgb(frame)
-                img = Image.fromarray(frame, mode="RGB")
-                img = self._apply_adjustments(img)
-                buf = io.BytesIO()
-                img.save(buf, format="JPEG", quality=JPEG_QUALITY)
-                with self.lock:
-                    self.last_frame = buf.getvalue()
-                time.sleep(0.05)
+                self.config = self.picam2.create_preview_configuration(**kwargs)
+                self.picam2.configure(self.config)
             except Exception as e:
-                print("[ERROR] Picamera2 loop exception:", e)
-                time.sleep(0.2)
+                if lores_format is None:
+                    raise
+                debug_print(f"[DEBUG] Picamera2Camera: lores {lores_format} unavailable:", e)
+                continue
+            self.lores_format = lores_format
+            break
+        streams = self.picam2.camera_configuration()
+        self.output_format = streams["main"]["format"]
+        if self.lores_format:
+            self.lores_format = streams["lores"]["format"]
+
+    def _capture(self):
+        request = self.picam2.capture_request()
+        if request is None:
+            print("[WARN] capture_request returned None")
+            time.sleep(0.2)
+            return None
+        try:
+            captured_at = time.time()
+            sensor_ts = None
+            try:
+                self._metadata = request.get_metadata() or {}
+            except Exception:
+                self._metadata = {}
+            # libcamera's SensorTimestamp is the start of exposure in ns
+            sensor_ns = self._metadata.get("SensorTimestamp")
+            if sensor_ns:
+                sensor_ts = sensor_ns / 1e9
+            raw = {}
+            if self.lores_format:
+                raw["lores"] = request.make_array("lores")
+            if not self.lores_format or self._stream_wanted("main"):
+                raw["main"] = request.make_array("main")
+        finally:
+            request.release()
+        return raw, captured_at, sensor_ts
+
+    def _settled(self, key, values, tolerance=0.02, frames=3):
+        # True once `values` stayed within `tolerance` for `frames` consecutive captures
+        prev, count = self._settle.get(key, (None, 0))
+        stable = prev is not None and all(
+            a is not None and b is not None and abs(a - b) <= tolerance * max(abs(b), 1e-6)
+            for a, b in zip(values, prev)
+        )
+        count = count + 1 if stable else 0
+        self._settle[key] = (values, count)
+        return count >= frames
+
+    def _frame_ready(self, raw):
+        meta = self._metadata
+        if not meta:
+            # No metadata to judge by: the first frame is the best we can do
+            return True
+        settings = self.get_adjustments()
+        ae_done = True
+        if settings.get("auto_exposure", True):
+            locked = meta.get("AeLocked")
+            if locked is not None:
+                ae_done = bool(locked)
+            else:
+                ae_done = self._settled("ae", (meta.get("ExposureTime"), meta.get("AnalogueGain")))
+        gains = meta.get("ColourGains")
+        awb_done = gains is None or self._settled("awb", tuple(gains))
+        return ae_done and awb_done
+
+    def stop(self):
+        super().stop()
+        try:
+            self.picam2.stop()
+            self.picam2.close()
+        except Exception as e:
+            debug_print("[DEBUG] Picamera2Camera: close failed:", e)
+
+    def _to_pixels(self, stream, arr):
+        if stream == "lores":
+            if self.lores_format.upper().startswith("YUV"):
+                return yuv420_to_rgb(arr, self.width, self.height), "RGB"
+            return self._frame_view(arr, self.lores_format)
+        return self._frame_view(arr)
+
+    def _luma(self, stream, arr):
+        # The Y plane of YUV420 is the first `height` rows: luma for free
+        if stream == "lores" and self.lores_format.upper().startswith("YUV"):
+            return arr[: self.height, : self.width]
+        return super()._luma(stream, arr)
 
-        debug_print("[DEBUG] Picamera2Camera: loop stopped")
+    def start_recording(self, path, bitrate_kbps):
+        # プレビューストリームを Picamera2 の H.264 エンコーダで録画（フレームは Python を通らない）
+        # .mp4 は FfmpegOutput、それ以外は生の H.264。stop_recording に渡すハンドルを返す
+        from picamera2.encoders import H264Encoder
+        from picamera2.outputs import FfmpegOutput, FileOutput
+
+        encoder = H264Encoder(bitrate=int(bitrate_kbps * 1000))
+        output = FfmpegOutput(path) if path.endswith(".mp4") else FileOutput(path)
+        self.picam2.start_encoder(encoder, output, name="lores" if self.lores_format else "main")
+        return encoder
+
+    def stop_recording(self, encoder):
+        try:
+            self.picam2.stop_encoder(encoder)
+        except TypeError:
+            # Older Picamera2: a single encoder, stop_encoder() takes no argument
+            self.picam2.stop_encoder()
 
     def _native_order_from_format(self, fmt):
         fmt = (fmt or "").upper()
@@ -277,36 +1532,14 @@ class Picamera2Camera(CameraBase):
             return "RGB"
         return "RGB"
 
-    def _frame_to_rgb(self, frame):
-        fmt = getattr(self, "output_format", "RGB888")
-        fmt = (fmt or "").upper()
-        order = None
-        if fmt == "XBGR8888":
-            frame = frame[..., [1, 2, 3]]
-            order = "BGR"
-        elif fmt == "XRGB8888":
-            frame = frame[..., [1, 2, 3]]
-            order = "RGB"
-        else:
-            if frame.ndim == 3 and frame.shape[2] > 3:
-                frame = frame[..., :3]
-            if fmt == "BGR888":
-                order = "BGR"
-            elif fmt == "RGB888":
-                order = "RGB"
-            else:
-                order = self.native_color_order or "RGB"
-
-        if order is None:
-            order = self.native_color_order or "RGB"
-
-        assumed = getattr(self, "assumed_color_order", "RGB")
-        if assumed == "AUTO":
-            assumed = order
-        if assumed == "BGR":
-            frame = frame[..., ::-1]
-
-        return frame.copy()
+    def _frame_view(self, frame, fmt=None):
+        fmt = fmt or getattr(self, "output_format", "RGB888")
+        return frame_view(
+            frame,
+            fmt,
+            getattr(self, "assumed_color_order", "RGB"),
+            self.native_color_order or "RGB",
+        )
 
     def _resolve_awb_mode(self, mode):
         lc = getattr(self, "libcamera_controls", None)
@@ -391,8 +1624,8 @@ class Picamera2Camera(CameraBase):
 
 
 class OpenCVCamera(CameraBase):
-    def __init__(self, device_index=0):
-        super().__init__()
+    def __init__(self, device_index=0, size=None):
+        super().__init__(size)
         import cv2
         self.cv2 = cv2
         self.device_index = device_index
@@ -407,20 +1640,29 @@ class OpenCVCamera(CameraBase):
         self.cap.set(self.cv2.CAP_PROP_FRAME_WIDTH, self.width)
         self.cap.set(self.cv2.CAP_PROP_FRAME_HEIGHT, self.height)
 
-    def _loop(self):
-        while self.running:
-            ok, frame = self.cap.read()
-            if not ok:
-                time.sleep(0.05)
-                continue
-            frame_rgb = self.cv2.cvtColor(frame, self.cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(frame_rgb)
-            img = self._apply_adjustments(img)
-            buf = io.BytesIO()
-            img.save(buf, format="JPEG", quality=JPEG_QUALITY)
-            with self.lock:
-                self.last_frame = buf.getvalue()
-            time.sleep(0.01)
+    def _capture(self):
+        ok, frame = self.cap.read()
+        if not ok:
+            time.sleep(0.05)
+            return None
+        return {"main": frame}, time.time(), None
+
+    def _to_pixels(self, stream, arr):
+        # OpenCV frames are BGR; encoders that read BGR take them without cvtColor
+        return arr, "BGR"
+
+    def _frame_ready(self, raw):
+        # Many UVC cameras hand out a few black frames while they start up
+        frame = raw.get("main")
+        return frame is not None and frame.size > 0 and float(frame[::16, ::16].mean()) > 1.0
+
+    def _resume_device(self):
+        # Frames queued in the driver while paused are stale; drain them
+        try:
+            for _ in range(int(self.cap.get(self.cv2.CAP_PROP_BUFFERSIZE) or 0)):
+                self.cap.grab()
+        except Exception:
+            pass
 
     def stop(self):
         super().stop()
@@ -430,6 +1672,38 @@ class OpenCVCamera(CameraBase):
             pass
 
 
+class SyntheticCamera(CameraBase):
+    # カメラ無しのフレーム源（ベンチマーク・負荷試験用）
+
+    def __init__(self, fps=30.0, size=None):
+        super().__init__(size)
+        self.camera_id = "synthetic"
+        self.fps = fps
+        self._background = Image.linear_gradient("L").resize((self.width, self.height)).convert("RGB")
+        self._n = 0
+        self._next_due = 0.0
+
+    def _capture(self):
+        import numpy as np
+        from PIL import ImageDraw
+
+        delay = self._next_due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        started = time.time()
+        self._next_due = max(self._next_due, started - 1.0 / self.fps) + 1.0 / self.fps
+        box = max(16, self.height // 6)
+        n = self._n
+        img = self._background.copy()
+        draw = ImageDraw.Draw(img)
+        x = (n * 8) % max(1, self.width - box)
+        draw.rectangle((x, self.height // 2 - box // 2, x + box, self.height // 2 + box // 2), fill=(255, 64, 32))
+        draw.text((8, 8), f"{n} {datetime.now().strftime('%H:%M:%S.%f')[:-3]}", fill=(255, 255, 255))
+        self._n += 1
+        # The simulated sensor clock is the frame start time
+        return {"main": np.asarray(img)}, started, started
+
+
 def _parse_camera_id(camera_id):
     if not camera_id:
         return None, None
@@ -466,46 +1740,91 @@ def _list_picamera2_devices():
     return devices
 
 
-def _list_opencv_devices(max_devices=6):
-    devices = []
+# V4L2 nodes that belong to the libcamera / ISP / codec pipeline rather than to a
+# UVC camera; opening them with OpenCV would fight Picamera2 for the sensor.
+_PLATFORM_NODE_PREFIXES = ("unicam", "rp1-cfe", "bcm2835-isp", "bcm2835-codec", "pispbe", "rpivid", "hevc")
+
+
+def video_device_indices():
+    # いま存在する /dev/videoN の番号（Linux 以外は空）
+    indices = []
+    for path in glob.glob("/dev/video*"):
+        suffix = path[len("/dev/video"):]
+        if suffix.isdigit():
+            indices.append(int(suffix))
+    return sorted(indices)
+
+
+def _v4l2_name(idx):
     try:
-        import cv2
-    except Exception:
-        cv2 = None
-    for idx in range(max_devices):
-        path_hint = f"/dev/video{idx}"
-        opened = False
-        cap = None
-        if cv2 is not None:
-            cap = cv2.VideoCapture(idx)
-            if cap is not None and cap.isOpened():
-                opened = True
-        exists = os.path.exists(path_hint)
-        if opened or exists:
-            name = path_hint if exists else f"Video {idx}"
-            devices.append(
-                {
-                    "id": f"opencv:{idx}",
-                    "type": "opencv",
-                    "name": name,
-                    "details": {"index": idx, "path": path_hint if exists else None},
-                }
-            )
+        with open(f"/sys/class/video4linux/video{idx}/name") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _probe_opencv(idx):
+    cv2 = _optional_cv2()
+    if cv2 is None:
+        return None
+    cap = cv2.VideoCapture(idx)
+    try:
+        return bool(cap is not None and cap.isOpened())
+    finally:
         if cap is not None:
             cap.release()
+
+
+def _list_opencv_devices(max_devices=6, busy=()):
+    # OpenCV のキャプチャデバイスを並列に調べる。busy（このプロセスで使用中）のものは開き直さず sysfs の情報だけで載せる
+    indices = video_device_indices()
+    exists = set(indices)
+    if not indices:
+        # No /dev nodes to look at (not Linux): fall back to probing indices
+        indices = list(range(max_devices))
+    candidates = []
+    for idx in indices:
+        sysname = _v4l2_name(idx)
+        if sysname and sysname.lower().startswith(_PLATFORM_NODE_PREFIXES):
+            continue
+        candidates.append((idx, sysname))
+    to_probe = [idx for idx, _ in candidates if f"opencv:{idx}" not in busy]
+    opened = {}
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=min(8, len(to_probe))) as pool:
+            opened = dict(zip(to_probe, pool.map(_probe_opencv, to_probe)))
+    devices = []
+    for idx, sysname in candidates:
+        in_use = f"opencv:{idx}" in busy
+        ok = True if in_use else opened.get(idx)
+        if not (ok or idx in exists):
+            continue
+        path_hint = f"/dev/video{idx}" if idx in exists else None
+        devices.append(
+            {
+                "id": f"opencv:{idx}",
+                "type": "opencv",
+                "name": sysname or path_hint or f"Video {idx}",
+                "details": {"index": idx, "path": path_hint, "openable": ok, "in_use": in_use},
+            }
+        )
     return devices
 
 
-def list_available_cameras(max_video_devices=6):
+def list_available_cameras(max_video_devices=6, busy=()):
+    # 全デバイスを走査。busy はこのプロセスが開いているカメラの ID
     cameras = []
-    cameras.extend(_list_picamera2_devices())
-    cameras.extend(_list_opencv_devices(max_video_devices))
+    for device in _list_picamera2_devices():
+        device["details"]["in_use"] = device["id"] in busy
+        cameras.append(device)
+    cameras.extend(_list_opencv_devices(max_video_devices, busy))
     if not cameras:
         cameras.append({"id": "picam2:0", "type": "picamera2", "name": "Default Pi Camera", "details": {}})
     return cameras
 
 
-def create_camera(camera_id=None):
+def create_camera(camera_id=None, size=None):
+    # ID（picam2:N / opencv:N / synthetic）でカメラを開く。size は FRAME_SIZE の代わり
     cam_type, value = _parse_camera_id(camera_id)
     if cam_type == "picam2":
         idx = None
@@ -514,7 +1833,7 @@ def create_camera(camera_id=None):
                 idx = int(value)
             except ValueError:
                 idx = None
-        return Picamera2Camera(camera_index=idx)
+        return Picamera2Camera(camera_index=idx, size=size)
     if cam_type == "opencv":
         idx = 0
         if value not in {None, ""}:
@@ -522,23 +1841,29 @@ def create_camera(camera_id=None):
                 idx = int(value)
             except ValueError:
                 idx = 0
-        return OpenCVCamera(device_index=idx)
+        return OpenCVCamera(device_index=idx, size=size)
+    if cam_type == "synthetic":
+        cam = SyntheticCamera(size=size)
+        if value:
+            # synthetic:N lets several fake cameras run side by side
+            cam.camera_id = f"synthetic:{value}"
+        return cam
 
     # Picamera2優先、初期化に失敗したらOpenCVでフォールバック
     try:
         from picamera2 import Picamera2  # noqa: F401
     except Exception as e:
         print("[WARN] Picamera2 unavailable, fallback to OpenCV:", e)
-        cam = OpenCVCamera()
+        cam = OpenCVCamera(size=size)
         cam.camera_id = getattr(cam, "camera_id", "opencv:0")
         return cam
 
     try:
-        cam = Picamera2Camera()
+        cam = Picamera2Camera(size=size)
         cam.camera_id = getattr(cam, "camera_id", "picam2:0")
         return cam
     except Exception as e:
         print("[WARN] Picamera2 init failed, fallback to OpenCV:", e)
-        cam = OpenCVCamera()
+        cam = OpenCVCamera(size=size)
         cam.camera_id = getattr(cam, "camera_id", "opencv:0")
         return cam
@@ -0,0 +1,174 @@
+import os
+import select
+import struct
+import threading
+import time
+
+from camera import list_available_cameras, video_device_indices
+from config import CAMERA_SCAN_TTL
+
+# inotify(7) event bits used to notice /dev/videoN nodes coming and going
+_IN_ATTRIB = 0x004
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _inotify_fd(path, mask):
+    """inotify descriptor watching `path` (via libc, no extra dependency)."""
+    import ctypes
+    import ctypes.util
+
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    if libc.inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+        err = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(err, f"inotify_add_watch {path} failed")
+    return fd
+
+
+def _video_events(data):
+    # True if any event in the buffer names a videoN node
+    offset = 0
+    while offset + _EVENT_HEADER.size <= len(data):
+        _wd, _mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+        name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length].rstrip(b"\0")
+        offset += _EVENT_HEADER.size + length
+        if name.startswith(b"video"):
+            return True
+    return False
+
+
+class CameraInventory:
+    """Camera list kept in the background and answered from cache.
+
+    A scan (Picamera2 info + parallel OpenCV probes) runs at start, when the
+    cache is older than CAMERA_SCAN_TTL, and shortly after /dev/video* nodes
+    appear or disappear (inotify on /dev, or a cheap directory poll where
+    inotify is unavailable). Devices the process already has open are passed
+    as `busy` and never re-opened by a probe.
+    """
+
+    POLL_INTERVAL = 2.0
+    DEBOUNCE = 0.5  # udev creates the node, then fixes its permissions
+
+    def __init__(self, busy=None, ttl=CAMERA_SCAN_TTL, max_video_devices=6):
+        # busy() -> ids of cameras this process has open (live or in the warm pool)
+        self._busy = busy or tuple
+        self.ttl = ttl
+        self.max_video_devices = max_video_devices
+        self._cameras = None
+        self._scanned_at = 0.0
+        self._scan_ms = None
+        self._scanning = False
+        self._first_scan = threading.Event()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pending = None
+        self.scans = 0
+        self.watch_mode = None
+
+    def start(self):
+        self.refresh()
+        threading.Thread(target=self._watch, name="camera-inventory", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def cameras(self, wait=5.0):
+        """Cached camera list; only the very first call may wait for a scan."""
+        if self._cameras is None:
+            self.refresh()
+            self._first_scan.wait(wait)
+        with self._lock:
+            cameras = self._cameras or []
+            stale = time.monotonic() - self._scanned_at > self.ttl
+        if stale:
+            self.refresh()
+        busy = set(self._busy())
+        result = []
+        for cam in cameras:
+            cam = dict(cam, details=dict(cam.get("details") or {}))
+            # Cameras opened or closed since the scan: keep the flag current
+            cam["details"]["in_use"] = cam["id"] in busy
+            result.append(cam)
+        return result
+
+    def refresh(self):
+        """Start a background rescan unless one is already running."""
+        with self._lock:
+            if self._scanning:
+                return False
+            self._scanning = True
+        threading.Thread(target=self._scan, name="camera-scan", daemon=True).start()
+        return True
+
+    def invalidate(self):
+        """Rescan soon; bursts of device events collapse into one scan."""
+        with self._lock:
+            if self._pending is not None:
+                return
+            self._pending = threading.Timer(self.DEBOUNCE, self._run_pending)
+            self._pending.daemon = True
+            self._pending.start()
+
+    def _run_pending(self):
+        with self._lock:
+            self._pending = None
+        if not self.refresh():
+            # A scan was already running and may have missed this change
+            self.invalidate()
+
+    def _scan(self):
+        start = time.monotonic()
+        found = None
+        try:
+            found = list_available_cameras(self.max_video_devices, busy=set(self._busy()))
+        except Exception as e:
+            print("[WARN] camera scan failed:", e)
+        with self._lock:
+            if found is not None:
+                self._cameras = found
+                self._scanned_at = time.monotonic()
+                self._scan_ms = round((self._scanned_at - start) * 1000.0, 1)
+            self._scanning = False
+            self.scans += 1
+        self._first_scan.set()
+
+    def _watch(self):
+        try:
+            fd = _inotify_fd("/dev", _IN_CREATE | _IN_DELETE | _IN_ATTRIB)
+        except Exception:
+            fd = None
+        if fd is not None:
+            self.watch_mode = "inotify"
+            try:
+                while not self._stop.is_set():
+                    ready, _, _ = select.select([fd], [], [], 1.0)
+                    if ready and _video_events(os.read(fd, 4096)):
+                        self.invalidate()
+            finally:
+                os.close(fd)
+            return
+        self.watch_mode = "poll"
+        known = video_device_indices()
+        while not self._stop.wait(self.POLL_INTERVAL):
+            current = video_device_indices()
+            if current != known:
+                known = current
+                self.invalidate()
+
+    def stats(self):
+        with self._lock:
+            age = time.monotonic() - self._scanned_at if self._cameras is not None else None
+            return {
+                "age_s": round(age, 1) if age is not None else None,
+                "scan_ms": self._scan_ms,
+                "scans": self.scans,
+                "ttl_s": self.ttl,
+                "scanning": self._scanning,
+                "watch": self.watch_mode,
+            }
@@ -0,0 +1,323 @@
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+
+from camera import _fit_size, create_camera
+from config import CAMERA_BUDGETS, CAPTURE_FPS, FRAME_SIZE, MAX_CAMERAS, READY_TIMEOUT, WARM_POOL_SIZE
+
+# Per-camera resource cap: capture FPS and preview/capture resolution
+Budget = namedtuple("Budget", ["fps", "size"])
+
+
+def parse_budgets(spec):
+    """Parse CAMERA_BUDGETS ("picam2:0=15@1280x720;opencv:0=10") into {id: Budget}.
+
+    Either half may be left out; missing values fall back to CAPTURE_FPS and
+    FRAME_SIZE. The id "*" sets the default for cameras without an entry.
+    """
+    budgets = {}
+    for entry in (spec or "").split(";"):
+        entry = entry.strip()
+        if not entry or "=" not in entry:
+            continue
+        camera_id, value = (part.strip() for part in entry.rsplit("=", 1))
+        fps_part, _, size_part = value.partition("@")
+        try:
+            fps = float(fps_part) if fps_part.strip() else None
+            size = tuple(int(v) for v in size_part.lower().split("x")) if size_part.strip() else None
+        except ValueError:
+            print(f"[WARN] ignoring camera budget {entry!r}")
+            continue
+        if size is not None and len(size) != 2:
+            print(f"[WARN] ignoring camera budget {entry!r}")
+            continue
+        budgets[camera_id] = Budget(fps, size)
+    return budgets
+
+
+def _stop_camera(cam):
+    try:
+        cam.stop()
+    except Exception:
+        pass
+
+
+class CameraManager:
+    """Keeps several cameras running side by side.
+
+    Each open camera has its own capture thread, frame buffer, settings and
+    budget; a budget only ever lowers CAPTURE_FPS / FRAME_SIZE, so the total
+    load is bounded by MAX_CAMERAS and the per-camera caps. One camera is the
+    default: requests that do not name a camera use it, which keeps the old
+    single-camera API working unchanged.
+
+    Cameras that stop being used are not closed but parked in a warm pool
+    (WARM_POOL_SIZE, least recently used evicted first): the device stays
+    open and configured with capture paused, so bringing one back is a
+    pointer swap plus a resumed capture thread instead of a full reopen.
+    A non-default camera counts as unused once nothing has read a frame from
+    it for UNWATCHED_GRACE seconds and it is not in `in_use()` (ids with a
+    push subscriber or a recording).
+    """
+
+    # Seconds without a frame read before a camera nobody subscribes to is let go
+    UNWATCHED_GRACE = 2.0
+
+    def __init__(self, budgets=None, max_cameras=MAX_CAMERAS, warm_pool_size=WARM_POOL_SIZE,
+                 factory=create_camera, in_use=None):
+        self._cameras = OrderedDict()
+        self._standby = OrderedDict()  # id -> (camera, budget), least recently used first
+        self._budgets = {}
+        self._pinned = set()
+        self._default_id = None
+        self._lock = threading.Lock()
+        self._factory = factory
+        self.in_use = in_use or set  # in_use() -> ids something still reads from
+        self.max_cameras = max(1, int(max_cameras))
+        self.warm_pool_size = max(0, int(warm_pool_size))
+        self.budget_spec = parse_budgets(CAMERA_BUDGETS) if budgets is None else dict(budgets)
+        self._switches = deque(maxlen=50)
+
+    def budget_for(self, camera_id):
+        spec = self.budget_spec.get(camera_id) or self.budget_spec.get("*") or Budget(None, None)
+        fps = min(spec.fps, CAPTURE_FPS) if spec.fps else CAPTURE_FPS
+        size = _fit_size(FRAME_SIZE, spec.size) if spec.size else FRAME_SIZE
+        return Budget(fps, tuple(size))
+
+    def open(self, camera_id=None, pin=False):
+        """Start `camera_id` (auto-select when None) if it is not running yet.
+
+        Returns the camera's resolved id. The first camera opened becomes the
+        default. Pinned cameras (the CAMERAS list) are never parked when idle.
+        """
+        cam_id, _mode = self._open(camera_id)
+        if pin:
+            with self._lock:
+                self._pinned.add(cam_id)
+        return cam_id
+
+    def _open(self, camera_id):
+        # Returns (id, mode): "live" already running, "warm" resumed from standby, "cold" newly opened
+        warm = None
+        with self._lock:
+            if camera_id and camera_id in self._cameras:
+                return camera_id, "live"
+            if not camera_id and self._default_id is not None:
+                return self._default_id, "live"
+            if len(self._cameras) >= self.max_cameras:
+                raise RuntimeError(f"camera limit reached ({self.max_cameras}); close one first")
+            if camera_id in self._standby:
+                warm, budget = self._standby.pop(camera_id)
+                self._cameras[camera_id] = warm
+                self._budgets[camera_id] = budget
+                if self._default_id is None:
+                    self._default_id = camera_id
+        if warm is not None:
+            try:
+                warm.resume()
+            except Exception:
+                self.close(camera_id, keep_warm=False)
+                raise
+            return camera_id, "warm"
+
+        budget = self.budget_for(camera_id or "")
+        cam = self._factory(camera_id, size=budget.size)
+        cam_id = getattr(cam, "camera_id", None) or camera_id or "default"
+        if not camera_id and cam_id in self.budget_spec:
+            # Auto-selected camera: its id is only known now, so only its FPS cap can still apply
+            budget = self.budget_for(cam_id)
+        cam.pacer.set_fps(budget.fps)
+        with self._lock:
+            existing = self._cameras.get(cam_id)
+            if existing is None:
+                self._cameras[cam_id] = cam
+                self._budgets[cam_id] = budget
+                if self._default_id is None:
+                    self._default_id = cam_id
+        if existing is not None:
+            # Lost a race with another open() of the same device
+            cam.stop()
+            return cam_id, "live"
+        try:
+            cam.start()
+        except Exception:
+            self.close(cam_id, keep_warm=False)
+            raise
+        print(f"[INFO] camera {cam_id} opened (fps<={budget.fps:g}, {budget.size[0]}x{budget.size[1]})")
+        return cam_id, "cold"
+
+    def close(self, camera_id, keep_warm=True):
+        """Stop serving `camera_id`. With a warm pool it is parked, else released."""
+        with self._lock:
+            cam = self._cameras.pop(camera_id, None)
+            budget = self._budgets.pop(camera_id, None)
+            self._pinned.discard(camera_id)
+            if camera_id == self._default_id:
+                self._default_id = next(iter(self._cameras), None)
+            if cam is None:
+                entry = self._standby.pop(camera_id, None)
+        if cam is None:
+            # Closing a parked camera releases the device
+            if entry is None:
+                return False
+            _stop_camera(entry[0])
+            return True
+        if not (keep_warm and self.warm_pool_size):
+            _stop_camera(cam)
+            return True
+        cam.pause()
+        evicted = []
+        with self._lock:
+            self._standby[camera_id] = (cam, budget)
+            while len(self._standby) > self.warm_pool_size:
+                evicted.append(self._standby.popitem(last=False)[1][0])
+        for old in evicted:
+            _stop_camera(old)
+        return True
+
+    def prewarm(self, camera_id):
+        """Open `camera_id`, let it converge, then park it in the warm pool."""
+        if not self.warm_pool_size:
+            return None
+        cam_id, mode = self._open(camera_id)
+        if mode == "live":
+            return cam_id
+        cam = self.get(cam_id)
+        if cam is not None:
+            cam.wait_ready()
+        with self._lock:
+            is_default = cam_id == self._default_id
+        if not is_default:
+            self.close(cam_id, keep_warm=True)
+        return cam_id
+
+    def park_idle(self, keep=None):
+        """Park (or, without a warm pool, release) live non-default cameras that
+        are idle or unused, so viewers moving between cameras do not pile up
+        open devices against MAX_CAMERAS."""
+        in_use = set(self.in_use())
+        with self._lock:
+            idle = [
+                cam_id for cam_id, cam in self._cameras.items()
+                if cam_id not in (keep, self._default_id) and cam_id not in self._pinned
+                and (cam.is_idle() or (cam_id not in in_use and cam.demand_age() > self.UNWATCHED_GRACE))
+            ]
+        for cam_id in idle:
+            self.close(cam_id, keep_warm=True)
+
+    def switch(self, camera_id, make_default=True, timeout=READY_TIMEOUT):
+        """Bring `camera_id` up (live, warm or cold) and record how long it took.
+
+        Latency is measured to the swap itself, to the first new frame and to
+        readiness (AE/AWB settled), so warm and cold switches can be compared.
+        """
+        self.park_idle(keep=camera_id)
+        previous = self.default_id
+        start = time.monotonic()
+        cam_id, mode = self._open(camera_id)
+        if make_default:
+            with self._lock:
+                if cam_id in self._cameras:
+                    self._default_id = cam_id
+        swapped = time.monotonic()
+        cam = self.get(cam_id)
+        first_frame_ms = ready_ms = None
+        if cam is not None:
+            latest = cam.frames.latest()
+            frame = cam.wait_for_frame(latest.seq if latest else 0, timeout=timeout)
+            if frame is not None:
+                first_frame_ms = round((time.monotonic() - start) * 1000.0, 1)
+            if cam.wait_ready(max(0.0, timeout - (time.monotonic() - start))):
+                ready_ms = round((time.monotonic() - start) * 1000.0, 1)
+        self._switches.append(
+            {
+                "at": time.time(),
+                "from": previous,
+                "to": cam_id,
+                "mode": mode,
+                "swap_ms": round((swapped - start) * 1000.0, 1),
+                "first_frame_ms": first_frame_ms,
+                "ready_ms": ready_ms,
+            }
+        )
+        return cam_id
+
+    def activate(self, camera_id):
+        """Open `camera_id` if needed and make it the default camera."""
+        return self.switch(camera_id, make_default=True)
+
+    def get(self, camera_id=None, wake=False):
+        """Running camera for `camera_id` (the default one when None), or None.
+
+        With wake=True a camera parked in the warm pool is resumed first.
+        """
+        with self._lock:
+            cam = self._cameras.get(camera_id or self._default_id)
+            parked = camera_id in self._standby
+        if cam is None and wake and parked:
+            try:
+                self.switch(camera_id, make_default=False)
+            except Exception as e:
+                print(f"[WARN] camera {camera_id} failed to resume:", e)
+                return None
+            with self._lock:
+                cam = self._cameras.get(camera_id)
+        return cam
+
+    @property
+    def default_id(self):
+        with self._lock:
+            return self._default_id
+
+    def ids(self):
+        with self._lock:
+            return list(self._cameras)
+
+    def standby_ids(self):
+        with self._lock:
+            return list(self._standby)
+
+    def stop_all(self):
+        for cam_id in self.ids() + self.standby_ids():
+            self.close(cam_id, keep_warm=False)
+
+    def stats(self):
+        with self._lock:
+            entries = [(cam_id, cam, self._budgets.get(cam_id)) for cam_id, cam in self._cameras.items()]
+            default_id = self._default_id
+        result = []
+        for cam_id, cam, budget in entries:
+            result.append(
+                {
+                    "id": cam_id,
+                    "default": cam_id == default_id,
+                    "budget": {"fps": budget.fps, "size": list(budget.size)} if budget else None,
+                    "stats": cam.stats(),
+                }
+            )
+        return result
+
+    def last_switch(self):
+        return self._switches[-1] if self._switches else None
+
+    def switch_stats(self):
+        events = list(self._switches)
+        modes = {}
+        for event in events:
+            m = modes.setdefault(event["mode"], {"count": 0, "first_frame_ms": [], "ready_ms": []})
+            m["count"] += 1
+            for key in ("first_frame_ms", "ready_ms"):
+                if event[key] is not None:
+                    m[key].append(event[key])
+        summary = {}
+        for mode, m in modes.items():
+            summary[mode] = {"count": m["count"]}
+            for key in ("first_frame_ms", "ready_ms"):
+                values = m[key]
+                summary[mode][f"avg_{key}"] = round(sum(values) / len(values), 1) if values else None
+        return {
+            "warm_pool_size": self.warm_pool_size,
+            "standby": self.standby_ids(),
+            "by_mode": summary,
+            "recent": events[-10:],
+        }
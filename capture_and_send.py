@@ -1,23 +1,73 @@
-import os, requests
-from camera import create_camera
-from config import SNAP_DIR, UPLOAD_URL, UPLOAD_API_KEY
+import sys
+
+import requests
+
+from config import CAMERA_ID, SERVICE_URL, UPLOAD_URL, UPLOAD_TIMEOUT
+
+def via_service():
+    # 稼働中の app.py に撮影を依頼する（カメラは起動済みなので数ミリ秒で撮れ、デバイスの取り合いも起きない）
+    # 返り値: 依頼できたら True。サービスが動いていなければ False
+    # サービスは動いているのに失敗したとき（タイムアウト・エラー応答）は、カメラをサービスが
+    # 握ったままなので自分では撮らず、エラーを出して終了コード 1 で終わる
+    endpoint = "/api/capture_and_upload" if UPLOAD_URL else "/api/capture"
+    try:
+        r = requests.post(f"{SERVICE_URL}{endpoint}", timeout=UPLOAD_TIMEOUT)
+    except requests.ConnectTimeout as e:
+        sys.exit(f"service error: {e}")
+    except requests.ConnectionError:
+        return False
+    except requests.RequestException as e:
+        sys.exit(f"service error: {e}")
+    try:
+        result = r.json() if r.headers.get("Content-Type", "").startswith("application/json") else {}
+        if not result.get("ok"):
+            sys.exit(f"service error: {r.status_code} {result.get('error') or r.text[:200]}")
+        elif "job" in result:
+            print("queued:", result["queued"], result["status_url"])
+        else:
+            print("saved:", result["path"])
+    except (ValueError, KeyError, AttributeError) as e:
+        sys.exit(f"service error: unexpected response ({r.status_code}): {e!r} {r.text[:200]}")
+    return True
 
 def main():
-    cam = create_camera()
+    if via_service():
+        return
+    # サービスが止まっているときだけ、自分でカメラを開いて撮る
+    from camera import create_camera
+    from snapshot_store import UPLOAD_PENDING, UPLOAD_QUEUED, SnapshotStore, StoreAcks
+    from uploader import UploadQueue
+
+    cam = create_camera(CAMERA_ID or None)
     cam.start()
-    # ウォームアップ
-    import time; time.sleep(1.0)
-    path = cam.save_snapshot()
+    # ウォームアップ: 露出/ホワイトバランスが収束する（または最初の有効フレームが出る）まで待つ
+    cam.wait_ready(timeout=10.0)
+    data = cam.capture_jpeg("still")
+    settings = cam.get_adjustments()
     cam.stop()
+    if not data:
+        print("no frame")
+        return
+    # app.py と同じ索引付きの保存先に置く（稼働中の app からもそのまま見える）
+    snapshots = SnapshotStore()
+    record = snapshots.save(data, camera_id=cam.camera_id, settings=settings)
+    path = record["path"]
     print("saved:", path)
 
     if UPLOAD_URL:
-        headers = {}
-        if UPLOAD_API_KEY:
-            headers["Authorization"] = f"Bearer {UPLOAD_API_KEY}"
-        with open(path, "rb") as f:
-            r = requests.post(UPLOAD_URL, headers=headers, files={"file": (os.path.basename(path), f, "image/jpeg")})
-        print("upload:", r.status_code, r.text[:200])
+        # スプール経由で送る。時間内に送れなければジョブはスプールに残り、app.py の次回起動時に再送される
+        uploads = UploadQueue(workers=1, acked=StoreAcks(snapshots))
+        uploads.start(load_spool=False)
+        # app.py と同じく、送信待ちを書いてから積む
+        snapshots.mark_upload(record["name"], UPLOAD_QUEUED)
+        job_id = uploads.enqueue(path)
+        snapshots.set_upload_job(record["name"], job_id)
+        uploads.drain(timeout=UPLOAD_TIMEOUT * 2)
+        uploads.stop()
+        job = uploads.status(job_id)
+        if job["state"] == "failed":
+            snapshots.mark_upload(record["name"], UPLOAD_PENDING)
+        print("upload:", job["state"], job["status"], job["last_error"] or job.get("response") or "")
 
 if __name__ == "__main__":
     main()
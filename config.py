@@ -1,27 +1,150 @@
 import os
 
+
+def _env_flag(name, default="0"):
+    value = os.getenv(name, default)
+    return value.lower() in {"1", "true", "yes", "on"}
+
+
 # プレビュー用の解像度（幅, 高さ）
 FRAME_SIZE = tuple(map(int, os.getenv("FRAME_SIZE", "1280,720").split(",")))
 # JPEG品質（UI配信の画質/帯域バランス）
 JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", "80"))
+# 出力プロファイル: 静止画（スナップショット）とサムネイル
+# STILL_SIZE が空なら Picamera2 はセンサー最大解像度、OpenCV はキャプチャ解像度
+_still_size = os.getenv("STILL_SIZE", "").strip()
+STILL_SIZE = tuple(map(int, _still_size.split(","))) if _still_size else None
+STILL_QUALITY = int(os.getenv("STILL_QUALITY", "92"))
+THUMB_SIZE = tuple(map(int, os.getenv("THUMB_SIZE", "320,180").split(",")))
+THUMB_QUALITY = int(os.getenv("THUMB_QUALITY", "70"))
 # UI配信の最大FPS（負荷対策）
 MAX_FPS = float(os.getenv("MAX_FPS", "15"))
+# キャプチャループの目標FPS（0 なら MAX_FPS と同じ）。処理時間を差し引いた期限ベースで刻む
+CAPTURE_FPS = float(os.getenv("CAPTURE_FPS", "0")) or MAX_FPS
+# push 配信で送信待ちがこのパケット数を超えたクライアントにはフレームを送らずスキップ
+STREAM_MAX_PENDING = int(os.getenv("STREAM_MAX_PENDING", "2"))
+# 帯域に合わせたプレビュー: クライアントごとに届くまでの時間を測り、下の段（縮小率:品質）を上下する
+PREVIEW_ADAPTIVE = _env_flag("PREVIEW_ADAPTIVE", "1")
+# 良い順に "縮小率:品質" をカンマ区切り（品質省略は JPEG_QUALITY）。同じ段のクライアントはエンコード結果を共有する
+PREVIEW_LADDER = os.getenv("PREVIEW_LADDER", "1,1:60,0.75:50,0.5:45,0.33:40")
+# カメラごとに保持する直近フレーム数（シーケンス番号付きリングバッファ）
+FRAME_BUFFER_SIZE = int(os.getenv("FRAME_BUFFER_SIZE", "8"))
 
+# 起動時に開くカメラ (例: picam2:0 / opencv:1 / synthetic)。空なら自動選択
+CAMERA_ID = os.getenv("CAMERA_ID", "").strip()
+# カメラ一覧のキャッシュ有効秒数。/dev/video* の増減は inotify で検知して即座に再スキャンする
+CAMERA_SCAN_TTL = float(os.getenv("CAMERA_SCAN_TTL", "60"))
+# 同時に動かすカメラ（カンマ区切り。例: picam2:0,opencv:0）。先頭が既定カメラ、空なら CAMERA_ID の1台
+CAMERAS = [c.strip() for c in os.getenv("CAMERAS", "").split(",") if c.strip()]
+# 同時に開けるカメラ数の上限（CPU 負荷の上限を決める）
+MAX_CAMERAS = int(os.getenv("MAX_CAMERAS", "4"))
+# カメラごとの上限 "ID=FPS@WxH" をセミコロン区切りで（例: picam2:0=15@1280x720;opencv:0=10@640x480）
+# ID に * を書くと全カメラの既定値。FPS か @WxH の片方だけでもよい
+CAMERA_BUDGETS = os.getenv("CAMERA_BUDGETS", "").strip()
+# 待機プール: 使われなくなったカメラを閉じずにキャプチャだけ止めて保持する台数（0 で無効）
+# WARM_CAMERAS に並べたカメラは起動時から待機させておき、切替をポインタの付け替えだけで済ませる
+WARM_POOL_SIZE = int(os.getenv("WARM_POOL_SIZE", "1"))
+WARM_CAMERAS = [c.strip() for c in os.getenv("WARM_CAMERAS", "").split(",") if c.strip()]
+# カメラ起動後、露出/ホワイトバランスの収束（メタデータが無ければ最初の有効フレーム）を待つ上限秒数
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "3"))
+
+# JPEG エンコーダ (auto / pillow / opencv / simplejpeg / turbojpeg)。auto は起動時の計測で最速を選ぶ
+JPEG_ENCODER = os.getenv("JPEG_ENCODER", "auto").strip().lower()
+# フレームは要求されたときだけ JPEG 化する（0 ならキャプチャごとにプレビューをエンコード）
+ENCODE_ON_DEMAND = _env_flag("ENCODE_ON_DEMAND", "1")
+# 視聴者がこの秒数いなければキャプチャを IDLE_FPS まで落とす（0 で無効）
+IDLE_AFTER_SEC = float(os.getenv("IDLE_AFTER_SEC", "30"))
+IDLE_FPS = float(os.getenv("IDLE_FPS", "1"))
+# エンコード段のワーカースレッド数（0 ならキャプチャスレッド内で直列に処理）と、その手前のキュー長
+# キューが溢れたら一番古いフレームを捨てるので、キャプチャはエンコード待ちでブロックしない
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", "2"))
+ENCODE_QUEUE_SIZE = int(os.getenv("ENCODE_QUEUE_SIZE", "4"))
+# 連写: 1回の最大枚数と、生フレームを溜めるバッファの上限（MB）。JPEG 化と保存はワーカーで後から行う
+BURST_MAX_FRAMES = int(os.getenv("BURST_MAX_FRAMES", "30"))
+BURST_MAX_MB = float(os.getenv("BURST_MAX_MB", "512"))
+BURST_WORKERS = int(os.getenv("BURST_WORKERS", "2"))
+# 動体検知: 縮小したグレースケール（lores / Y プレーン）を移動平均の背景と比べ、変化があれば撮影してアップロード
+MOTION_ENABLED = _env_flag("MOTION_ENABLED", "0")
+MOTION_FPS = float(os.getenv("MOTION_FPS", "10"))              # 検知を回す最大FPS（検知中はアイドルに落とさない）
+MOTION_WIDTH = int(os.getenv("MOTION_WIDTH", "160"))           # 検知に使う画像の幅（px）
+# 検知範囲 "x,y,w,h[:面積比]" をセミコロン区切りで（0〜1 の割合。例: 0,0.5,1,0.5:0.02）。空なら画面全体
+MOTION_ZONES = os.getenv("MOTION_ZONES", "").strip()
+MOTION_THRESHOLD = float(os.getenv("MOTION_THRESHOLD", "25"))   # 背景との輝度差がこれを超えた画素を「変化」とみなす（0〜255）
+MOTION_MIN_AREA = float(os.getenv("MOTION_MIN_AREA", "0.01"))  # 範囲内の変化画素の割合がこれを超えたら検知
+MOTION_ALPHA = float(os.getenv("MOTION_ALPHA", "0.05"))        # 背景の更新率（大きいほど照明変化に早く追従）
+MOTION_PRE_ROLL = int(os.getenv("MOTION_PRE_ROLL", "3"))       # 検知直前のフレームも何枚残すか
+MOTION_POST_FRAMES = int(os.getenv("MOTION_POST_FRAMES", "3")) # 検知後にフル画質で撮る枚数（連写）
+MOTION_COOLDOWN = float(os.getenv("MOTION_COOLDOWN", "10"))    # 次の検知までの最短秒数
+MOTION_UPLOAD = _env_flag("MOTION_UPLOAD", "1")  # 撮った画像をアップロードキューへ
+MOTION_CLIP_SEC = float(os.getenv("MOTION_CLIP_SEC", "0"))      # 検知時にこの秒数の動画クリップも録る（0 で無効）
+
 # 保存ディレクトリ
 SNAP_DIR = os.getenv("SNAP_DIR", "./snaps")
 os.makedirs(SNAP_DIR, exist_ok=True)
+# 録画（H.264/MP4 のセグメント）とタイムラプスの保存先
+RECORD_DIR = os.getenv("RECORD_DIR", os.path.join(SNAP_DIR, "recordings"))
+# エンコーダ (auto / picamera2 / ffmpeg / opencv)。auto は Picamera2 のハードウェアエンコーダ → ffmpeg → OpenCV の順
+RECORD_BACKEND = os.getenv("RECORD_BACKEND", "auto").strip().lower()
+RECORD_FFMPEG_CODEC = os.getenv("RECORD_FFMPEG_CODEC", "auto").strip()  # auto なら h264_v4l2m2m（Pi のハードウェア）→ libx264
+RECORD_FPS = float(os.getenv("RECORD_FPS", "0")) or CAPTURE_FPS       # 録画のFPS（0 ならキャプチャと同じ）
+_record_size = os.getenv("RECORD_SIZE", "").strip()                   # 録画の解像度（空ならプレビューと同じ）
+RECORD_SIZE = tuple(map(int, _record_size.split(","))) if _record_size else None
+RECORD_BITRATE_KBPS = float(os.getenv("RECORD_BITRATE_KBPS", "4000"))
+# セグメントの切り替え: 秒数かサイズのどちらかに達したら次のファイルへ（0 でその条件は無効）
+RECORD_SEGMENT_SEC = float(os.getenv("RECORD_SEGMENT_SEC", "300"))
+RECORD_SEGMENT_MB = float(os.getenv("RECORD_SEGMENT_MB", "100"))
+# 録画ファイルの合計サイズの上限（MB、超えたら古いセグメントから削除。0 で無制限）
+RECORD_MAX_MB = float(os.getenv("RECORD_MAX_MB", "2048"))
+# タイムラプス: 何秒ごとに1フレーム取り込むかと、再生時のFPS
+RECORD_TIMELAPSE_INTERVAL = float(os.getenv("RECORD_TIMELAPSE_INTERVAL", "10"))
+RECORD_TIMELAPSE_FPS = float(os.getenv("RECORD_TIMELAPSE_FPS", "25"))
+# 書き終わったセグメントをアップロードキューに積む
+RECORD_UPLOAD = _env_flag("RECORD_UPLOAD", "0")
+# スナップショットの索引（SQLite）。画像は SNAP_DIR/YYYY/MM/DD/ に日付ごとに保存
+SNAPSHOT_DB = os.getenv("SNAPSHOT_DB", os.path.join(SNAP_DIR, "snapshots.db"))
+# 保存期間・合計サイズの上限（0 で無制限）。超えた分は古い順に削除
+SNAP_RETENTION_DAYS = float(os.getenv("SNAP_RETENTION_DAYS", "0"))
+SNAP_RETENTION_MB = float(os.getenv("SNAP_RETENTION_MB", "0"))
+# スナップショット一覧用サムネイルのキャッシュ（合計サイズを超えたら使われていない順に削除）
+THUMB_CACHE_DIR = os.getenv("THUMB_CACHE_DIR", os.path.join(SNAP_DIR, ".thumbs"))
+THUMB_CACHE_MB = float(os.getenv("THUMB_CACHE_MB", "64"))
 
 # アップロード先REST API（空だとアップロード無効）
 UPLOAD_URL = os.getenv("UPLOAD_URL", "")           # 例: https://example.com/upload
 UPLOAD_API_KEY = os.getenv("UPLOAD_API_KEY", "")   # 例: ベアラートークンなど
+# アップロードはバックグラウンドのキューで送る。未送信分はスプールに残り、再起動後も再送される
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", os.path.join(SNAP_DIR, ".upload_spool"))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))          # 同時送信数
+UPLOAD_TIMEOUT = float(os.getenv("UPLOAD_TIMEOUT", "20"))       # 1回の送信のタイムアウト秒
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", "10"))  # これを超えたら failed/ へ（0 で無制限）
+UPLOAD_BACKOFF_BASE = float(os.getenv("UPLOAD_BACKOFF_BASE", "2"))   # 再送間隔の初期値（秒、失敗ごとに倍）
+UPLOAD_BACKOFF_MAX = float(os.getenv("UPLOAD_BACKOFF_MAX", "300"))   # 再送間隔の上限（秒）
+# 送信済みファイルの記録（まとめ送信で二重送信しないため）
+UPLOAD_ACK_INDEX = os.getenv("UPLOAD_ACK_INDEX", os.path.join(SNAP_DIR, ".upload_acked"))
+# 定時撮影（cron 形式）。稼働中のカメラで撮るので起動待ちが無い。"式[=capture|capture_and_upload]" をセミコロン区切りで
+# 例: "0 7,17 * * *" / "*/10 * * * *=capture"。初回起動時にだけ登録し、以降は /api/schedules と SCHEDULE_FILE で管理
+SCHEDULES = os.getenv("SCHEDULES", "").strip()
+SCHEDULE_FILE = os.getenv("SCHEDULE_FILE", os.path.join(SNAP_DIR, ".schedules.json"))
+SCHEDULE_JITTER = float(os.getenv("SCHEDULE_JITTER", "0"))       # 実行時刻を 0〜この秒数だけランダムに遅らせる（新規スケジュールの既定値）
+SCHEDULE_CATCH_UP = float(os.getenv("SCHEDULE_CATCH_UP", "3600"))  # 停止中などで逃した回は、この秒数以内なら1回だけ取り戻す
+# capture_and_send.py が撮影を依頼する稼働中のサービス（つながらなければ自分でカメラを開いて撮る）
+SERVICE_URL = os.getenv("SERVICE_URL", "http://127.0.0.1:5000")
+# 未送信分のまとめ送信（回線断からの復帰用）
+BULK_UPLOAD_URL = os.getenv("BULK_UPLOAD_URL", "") or UPLOAD_URL
+BULK_FORMAT = os.getenv("BULK_FORMAT", "multipart").strip().lower()  # multipart / tar
+if BULK_FORMAT not in {"multipart", "tar"}:
+    BULK_FORMAT = "multipart"
+BULK_BATCH_FILES = int(os.getenv("BULK_BATCH_FILES", "10"))     # 1リクエストあたりの最大ファイル数
+BULK_BATCH_MB = float(os.getenv("BULK_BATCH_MB", "8"))         # 1リクエストあたりの最大サイズ
+BULK_RATE_KBPS = float(os.getenv("BULK_RATE_KBPS", "512"))     # 送信レート上限（0 で無制限）
 
 # カメラからの生データの色順序 (AUTO / RGB / BGR) デフォルトはBGR
 CAMERA_COLOR_ORDER = os.getenv("CAMERA_COLOR_ORDER", "BGR").strip().upper()
 if CAMERA_COLOR_ORDER not in {"AUTO", "RGB", "BGR"}:
     CAMERA_COLOR_ORDER = "BGR"
 
-def _env_flag(name, default="0"):
-    value = os.getenv(name, default)
-    return value.lower() in {"1", "true", "yes", "on"}
-
 CAMERA_DEBUG = _env_flag("CAMERA_DEBUG")
+# CAMERA_DEBUG の定期ログ（FPS・各段の時間）の間隔（秒）。フレームごとには出さない
+CAMERA_DEBUG_INTERVAL = float(os.getenv("CAMERA_DEBUG_INTERVAL", "5"))
+# /metrics（Prometheus 形式）用の計測。0 で計測自体を止める
+METRICS_ENABLED = _env_flag("METRICS_ENABLED", "1")
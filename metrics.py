@@ -0,0 +1,201 @@
+import bisect
+import threading
+import weakref
+
+from config import METRICS_ENABLED
+
+# Seconds; covers a sub-millisecond colour conversion up to a slow upload
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Sharded:
+    """Per-thread storage: every thread writes only its own dict of
+    label values -> state, so recording takes no lock. A scrape merges all
+    shards; shards of threads that have exited are folded into `_retired`
+    once and dropped, so short-lived threads do not accumulate."""
+
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []  # [(weakref to thread, shard)]
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+            return shard
+
+    def _collect(self):
+        merged = {}
+        with self._lock:
+            alive = []
+            for ref, shard in self._shards:
+                thread = ref()
+                if thread is None or not thread.is_alive():
+                    for labels, state in list(shard.items()):
+                        self._fold(self._retired, labels, state)
+                else:
+                    alive.append((ref, shard))
+            self._shards = alive
+            for labels, state in self._retired.items():
+                self._fold(merged, labels, state)
+        for _ref, shard in alive:
+            for labels, state in list(shard.items()):
+                self._fold(merged, labels, state)
+        return merged
+
+
+class Counter(_Sharded):
+    type = "counter"
+
+    def inc(self, amount=1.0, *labels):
+        if not METRICS_ENABLED:
+            return
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    @staticmethod
+    def _fold(into, labels, value):
+        into[labels] = into.get(labels, 0.0) + value
+
+    def render(self):
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+                for labels, value in sorted(self._collect().items())]
+
+
+class Histogram(_Sharded):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        if not METRICS_ENABLED:
+            return
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # One slot per bucket plus +Inf, then the sum
+            state = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    @staticmethod
+    def _fold(into, labels, state):
+        total = into.get(labels)
+        if total is None:
+            into[labels] = list(state)
+        else:
+            for i, v in enumerate(state):
+                total[i] += v
+
+    def render(self):
+        lines = []
+        for labels, state in sorted(self._collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(state[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Callback:
+    """Values read at scrape time from state the app already keeps
+    (queue lengths, FPS, client counts). `fn()` returns [(label values, value)]."""
+
+    def __init__(self, name, help, labelnames, fn, type="gauge"):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self.type = type
+
+    def render(self):
+        try:
+            samples = self.fn()
+        except Exception as e:
+            return [f"# {self.name} failed: {_escape(e)}"]
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+                for labels, value in samples if value is not None]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            # Re-registering (e.g. the app module imported twice) replaces the callback
+            existing = self._metrics.get(metric.name)
+            if existing is not None and not isinstance(metric, Callback):
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, labelnames, fn, type="gauge"):
+        return self._add(Callback(name, help, labelnames, fn, type))
+
+    def render(self):
+        """Everything in the Prometheus text exposition format (0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        out = []
+        for metric in metrics:
+            out.append(f"# HELP {metric.name} {metric.help}")
+            out.append(f"# TYPE {metric.name} {metric.type}")
+            out.extend(metric.render())
+        return "\n".join(out) + "\n"
+
+
+REGISTRY = Registry()
+
+# Time spent per pipeline stage: capture (reading the sensor), convert (colour
+# conversion and resize), adjust (software adjustments), encode (JPEG) and
+# emit (handing a frame to a Socket.IO or MJPEG client)
+STAGE_SECONDS = REGISTRY.histogram(
+    "raspicam_stage_seconds", "Time per frame spent in each pipeline stage.", ("camera", "stage"))
+STREAM_BYTES = REGISTRY.counter(
+    "raspicam_stream_bytes_total", "Preview bytes sent to clients.", ("camera", "transport"))
+STREAM_SKIPPED = REGISTRY.counter(
+    "raspicam_stream_frames_skipped_total", "Preview frames not sent to a client (rate limit or backpressure).",
+    ("camera", "reason"))
+UPLOAD_SECONDS = REGISTRY.histogram(
+    "raspicam_upload_seconds", "Duration of successful snapshot uploads.", (),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
@@ -0,0 +1,293 @@
+import math
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from config import (
+    MOTION_FPS, MOTION_WIDTH, MOTION_ZONES, MOTION_THRESHOLD, MOTION_MIN_AREA, MOTION_ALPHA,
+    MOTION_PRE_ROLL, MOTION_POST_FRAMES, MOTION_COOLDOWN,
+)
+
+# Detection events remembered for GET /api/motion
+RECENT_EVENTS_KEPT = 20
+
+
+def parse_zones(spec, min_area=MOTION_MIN_AREA):
+    """Parse MOTION_ZONES ("x,y,w,h[:area];...", fractions of the frame) into
+    [(x, y, w, h, area)]. An empty spec is one zone covering the whole frame."""
+    zones = []
+    for entry in (spec or "").split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        rect, _, area = entry.partition(":")
+        values = [float(v) for v in rect.split(",")]
+        if len(values) != 4:
+            raise ValueError(f"zone {entry!r} needs x,y,w,h")
+        x, y, w, h = values
+        if w <= 0 or h <= 0 or not (0 <= x < 1 and 0 <= y < 1):
+            raise ValueError(f"zone {entry!r} is outside the frame")
+        zones.append((x, y, min(w, 1 - x), min(h, 1 - y), float(area) if area.strip() else min_area))
+    return zones or [(0.0, 0.0, 1.0, 1.0, min_area)]
+
+
+class MotionDetector:
+    """Frame differencing against a running-average background.
+
+    Works on a small grayscale image (see CameraBase.luma): every pixel whose
+    difference from the background exceeds `threshold` counts as changed, and
+    a zone triggers when its share of changed pixels exceeds the zone's area
+    threshold. The background follows the scene at rate `alpha`, so slow
+    lighting changes are absorbed. All of it is a handful of whole-array
+    NumPy operations on ~160x90 pixels.
+    """
+
+    def __init__(self, zones=None, threshold=MOTION_THRESHOLD, alpha=MOTION_ALPHA, warmup=5):
+        self.zones = zones or parse_zones(MOTION_ZONES)
+        self.threshold = threshold
+        self.alpha = alpha
+        self.warmup = warmup
+        self.reset()
+
+    def reset(self):
+        self._bg = None
+        self._diff = None
+        self._slices = None
+        self._seen = 0
+
+    def _zone_slices(self, shape):
+        height, width = shape
+        slices = []
+        for x, y, w, h, _area in self.zones:
+            rows = slice(int(y * height), max(int(y * height) + 1, math.ceil((y + h) * height)))
+            cols = slice(int(x * width), max(int(x * width) + 1, math.ceil((x + w) * width)))
+            slices.append((rows, cols))
+        return slices
+
+    def feed(self, luma):
+        """Update the background with `luma`; returns the changed share per zone
+        (None while the background is still being learned)."""
+        frame = luma.astype(np.float32)
+        if self._bg is None or self._bg.shape != frame.shape:
+            self._bg = frame
+            self._diff = np.empty_like(frame)
+            self._slices = self._zone_slices(frame.shape)
+            self._seen = 1
+            return None
+        diff = self._diff
+        np.subtract(frame, self._bg, out=diff)
+        # bg += alpha * (frame - bg), reusing the difference already computed
+        self._bg += self.alpha * diff
+        np.abs(diff, out=diff)
+        changed = diff > self.threshold
+        self._seen += 1
+        if self._seen <= self.warmup:
+            return None
+        return [float(np.count_nonzero(changed[rows, cols])) / changed[rows, cols].size for rows, cols in self._slices]
+
+    def triggered(self, scores):
+        """Indexes of the zones whose changed share is over their threshold."""
+        if scores is None:
+            return []
+        return [i for i, (score, zone) in enumerate(zip(scores, self.zones)) if score > zone[4]]
+
+
+class MotionCapture:
+    """Motion detection on a camera's capture loop, with snapshots on trigger.
+
+    A frame tap runs the detector on the capture thread at up to MOTION_FPS
+    and keeps the last MOTION_PRE_ROLL analysed captures (references to their
+    raw arrays, no copies). On a trigger a worker thread saves the pre-roll
+    frames, takes a burst of MOTION_POST_FRAMES full-quality stills and hands
+    everything to `on_capture(records)` (the app queues them for upload);
+    `on_trigger(cam, event)` runs first, e.g. to start a video clip.
+    Triggers within MOTION_COOLDOWN seconds of the last one are ignored.
+    """
+
+    def __init__(self, store, writer, thumbs=None, on_capture=None, fps=MOTION_FPS, width=MOTION_WIDTH,
+                 pre_roll=MOTION_PRE_ROLL, post_frames=MOTION_POST_FRAMES, cooldown=MOTION_COOLDOWN,
+                 on_trigger=None):
+        self.store = store
+        self.writer = writer
+        self.thumbs = thumbs
+        self.on_capture = on_capture
+        self.on_trigger = on_trigger
+        self.detector = MotionDetector()
+        self.fps = fps
+        self.width = width
+        self.post_frames = post_frames
+        self.cooldown = cooldown
+        self._pre_roll = deque(maxlen=max(0, pre_roll))
+        self._events = queue.Queue(maxsize=1)
+        self._lock = threading.Lock()
+        self._cam = None
+        self.camera_id = None
+        self._thread = None
+        self._next_due = 0.0
+        self._last_trigger = 0.0
+        self._recent = deque(maxlen=RECENT_EVENTS_KEPT)
+        self.last_scores = None
+        self.frames_analysed = 0
+        self.triggers = 0
+        self.suppressed = 0
+        self._analyse_time = 0.0
+        self._analyse_since = None
+
+    @property
+    def enabled(self):
+        return self._cam is not None
+
+    def attach(self, cam, camera_id=None):
+        """Start watching `cam` (replacing the camera watched before, if any)."""
+        self.detach()
+        with self._lock:
+            self.detector.reset()
+            self._pre_roll.clear()
+            self._cam = cam
+            self.camera_id = camera_id or cam.camera_id
+            self._analyse_since = time.monotonic()
+            self._analyse_time = 0.0
+            self.frames_analysed = 0
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="motion", daemon=True)
+                self._thread.start()
+        cam.add_frame_tap(self._on_frame)
+
+    def detach(self):
+        with self._lock:
+            cam, self._cam = self._cam, None
+            self._pre_roll.clear()
+        if cam is not None:
+            cam.remove_frame_tap(self._on_frame)
+
+    def configure(self, zones=None, threshold=None, alpha=None, cooldown=None, post_frames=None):
+        """Change detection settings at runtime; the background is relearned."""
+        with self._lock:
+            if zones is not None:
+                self.detector.zones = zones
+            if threshold is not None:
+                self.detector.threshold = float(threshold)
+            if alpha is not None:
+                self.detector.alpha = float(alpha)
+            if cooldown is not None:
+                self.cooldown = float(cooldown)
+            if post_frames is not None:
+                self.post_frames = max(0, int(post_frames))
+            self.detector.reset()
+
+    def _on_frame(self, frame):
+        # Capture thread: analyse at most `fps` frames per second and never block
+        now = frame.timestamp
+        if now < self._next_due:
+            return
+        # Keep the average rate at `fps` even when it does not divide the capture rate
+        self._next_due = max(self._next_due + 1.0 / max(0.1, self.fps), now)
+        cam = self._cam
+        if cam is None or not cam.is_ready():
+            return
+        luma = cam.luma(frame.raw, self.width)
+        if luma is None:
+            return
+        start = time.perf_counter()
+        with self._lock:
+            scores = self.detector.feed(luma)
+            zones = self.detector.triggered(scores)
+            self._pre_roll.append((frame.raw, frame.timestamp))
+            self._analyse_time += time.perf_counter() - start
+            self.frames_analysed += 1
+            self.last_scores = scores
+            if not zones:
+                return
+            if now - self._last_trigger < self.cooldown:
+                self.suppressed += 1
+                return
+            self._last_trigger = now
+            self.triggers += 1
+            event = {
+                "at": now,
+                "zones": zones,
+                "scores": [round(s, 4) for s in scores],
+                "camera": self.camera_id,
+                "state": "capturing",
+                "records": [],
+            }
+            pre_roll = list(self._pre_roll)
+            self._pre_roll.clear()
+            self._recent.append(event)
+        try:
+            self._events.put_nowait((cam, event, pre_roll))
+        except queue.Full:
+            event["state"] = "dropped"  # the previous trigger is still being saved
+
+    def _run(self):
+        while True:
+            cam, event, pre_roll = self._events.get()
+            try:
+                self._capture(cam, event, pre_roll)
+            except Exception as e:
+                print("[WARN] motion capture failed:", e)
+                event["state"] = "failed"
+
+    def _capture(self, cam, event, pre_roll):
+        if self.on_trigger is not None:
+            try:
+                self.on_trigger(cam, event)
+            except Exception as e:
+                print("[WARN] motion on_trigger failed:", e)
+        settings = cam.get_adjustments()
+        records = []
+        for raw, taken_at in pre_roll:
+            data = cam.encode_raw(raw, "still")
+            if not data:
+                continue
+            record = self.store.save(data, camera_id=event["camera"], settings=settings, taken_at=taken_at)
+            if self.thumbs is not None:
+                self.thumbs.submit(record)
+            records.append(record)
+        burst = None
+        if self.post_frames:
+            try:
+                burst = cam.burst(count=self.post_frames)
+            except RuntimeError as e:
+                print("[WARN] motion burst skipped:", e)  # a burst requested over the API is running
+        if burst is None or not len(burst):
+            self._finish(event, records)
+            return
+        # The burst is encoded on the writer's pool; this thread is free for the next trigger
+        self.writer.submit(cam, burst, camera_id=event["camera"],
+                           on_done=lambda job: self._finish(event, records + job["records"]))
+
+    def _finish(self, event, records):
+        event["records"] = [r["name"] for r in records]
+        event["state"] = "done"
+        if self.on_capture is not None and records:
+            self.on_capture(records)
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._analyse_since if self._analyse_since else 0.0
+            analysed = self.frames_analysed
+            return {
+                "enabled": self.enabled,
+                "camera": self.camera_id if self.enabled else None,
+                "fps": self.fps,
+                "zones": [
+                    {"x": round(x, 4), "y": round(y, 4), "w": round(w, 4), "h": round(h, 4), "min_area": area} for x, y, w, h, area in self.detector.zones
+                ],
+                "threshold": self.detector.threshold,
+                "alpha": self.detector.alpha,
+                "cooldown": self.cooldown,
+                "pre_roll": self._pre_roll.maxlen,
+                "post_frames": self.post_frames,
+                "scores": [round(s, 4) for s in self.last_scores] if self.last_scores else None,
+                "frames_analysed": analysed,
+                "triggers": self.triggers,
+                "suppressed": self.suppressed,
+                "avg_analyse_ms": round(self._analyse_time / analysed * 1000.0, 3) if analysed else None,
+                # Share of one core spent in the detector since it was attached
+                "cpu_percent": round(self._analyse_time / elapsed * 100.0, 2) if elapsed > 0 else None,
+                "events": [dict(e) for e in reversed(self._recent)],
+            }
@@ -0,0 +1,517 @@
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from camera import _optional_cv2, packed
+from config import (
+    RECORD_DIR, RECORD_BACKEND, RECORD_FFMPEG_CODEC, RECORD_FPS, RECORD_SIZE, RECORD_BITRATE_KBPS,
+    RECORD_SEGMENT_SEC, RECORD_SEGMENT_MB, RECORD_MAX_MB, RECORD_TIMELAPSE_INTERVAL, RECORD_TIMELAPSE_FPS,
+)
+
+MODES = ("video", "clip", "timelapse")
+VIDEO_EXTENSIONS = (".mp4", ".h264")
+# Captures waiting for the video encoder; when it falls behind, new ones are dropped
+RECORD_QUEUE_SIZE = 8
+# Finished sessions remembered for GET /api/recordings
+RECENT_SESSIONS_KEPT = 20
+
+_ffmpeg_codecs = None
+_codecs_lock = threading.Lock()
+
+
+def _test_encode(codec):
+    # ffmpeg lists h264_v4l2m2m even where there is no M2M device (Pi 5, containers),
+    # so only a frame that actually encodes counts
+    try:
+        return subprocess.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "color=s=64x64",
+             "-frames:v", "1", "-c:v", codec, "-f", "null", "-"],
+            capture_output=True, timeout=20,
+        ).returncode == 0
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+def ffmpeg_codecs():
+    """H.264 encoders ffmpeg can use here, preferred first: RECORD_FFMPEG_CODEC
+    (or, for auto, the Pi's h264_v4l2m2m hardware encoder), then libx264.
+    Each passes a one-frame test encode before it is cached; empty without ffmpeg."""
+    global _ffmpeg_codecs
+    with _codecs_lock:
+        if _ffmpeg_codecs is None:
+            codecs = []
+            if shutil.which("ffmpeg"):
+                first = "h264_v4l2m2m" if RECORD_FFMPEG_CODEC == "auto" else RECORD_FFMPEG_CODEC
+                for codec in dict.fromkeys((first, "libx264")):
+                    if _test_encode(codec):
+                        codecs.append(codec)
+                    elif codec == RECORD_FFMPEG_CODEC:
+                        print(f"[WARN] ffmpeg cannot encode with RECORD_FFMPEG_CODEC={codec}")
+            _ffmpeg_codecs = codecs
+        return list(_ffmpeg_codecs)
+
+
+def ffmpeg_codec():
+    """The preferred working encoder from ffmpeg_codecs(), or None."""
+    codecs = ffmpeg_codecs()
+    return codecs[0] if codecs else None
+
+
+def _drop_codec(codec):
+    with _codecs_lock:
+        if _ffmpeg_codecs and codec in _ffmpeg_codecs:
+            _ffmpeg_codecs.remove(codec)
+
+
+class FfmpegWriter:
+    """Raw frames piped into an ffmpeg H.264 encoder, written as fragmented MP4
+    (playable up to the last fragment even if recording is cut off)."""
+
+    backend = "ffmpeg"
+
+    # How long the first frame may take to get through ffmpeg's encoder setup
+    START_TIMEOUT = 5.0
+    # stderr lines kept for error messages; the rest is read and dropped
+    STDERR_LINES = 20
+
+    def __init__(self, path, size, fps, order, bitrate_kbps=RECORD_BITRATE_KBPS, codec=None):
+        self.codec = codec or ffmpeg_codec()
+        self.path = path
+        self._started = False
+        width, height = size
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "rgb24" if order == "RGB" else "bgr24",
+            "-s", f"{width}x{height}", "-framerate", f"{fps:g}", "-i", "-",
+            "-an", "-c:v", self.codec, "-b:v", f"{int(bitrate_kbps)}k", "-pix_fmt", "yuv420p",
+            "-g", str(max(1, int(fps * 2))),
+            "-movflags", "+frag_keyframe+empty_moov+default_base_moof", "-f", "mp4", path,
+        ]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Drained for the whole segment: a chatty encoder would otherwise fill the pipe,
+        # block ffmpeg and with it write() on the capture thread
+        self._stderr = deque(maxlen=self.STDERR_LINES)
+        self._drain = threading.Thread(target=self._read_stderr, name="ffmpeg-stderr", daemon=True)
+        self._drain.start()
+
+    def _read_stderr(self):
+        for line in self._proc.stderr:
+            self._stderr.append(line)
+
+    def _errors(self):
+        self._drain.join(1.0)
+        return b"".join(self._stderr).decode(errors="replace")[-300:].strip()
+
+    def write(self, arr, order):
+        try:
+            self._proc.stdin.write(packed(arr).data)
+            if not self._started:
+                self._proc.stdin.flush()
+        except OSError:
+            self._fail()
+        if not self._started:
+            self._wait_started()
+            self._started = True
+
+    def _wait_started(self):
+        # With empty_moov the header reaches the file once the encoder has opened on
+        # the first frame; an encoder that cannot open makes ffmpeg exit instead
+        deadline = time.monotonic() + self.START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self._proc.poll() is not None:
+                self._fail()
+            try:
+                if os.path.getsize(self.path):
+                    return
+            except OSError:
+                pass
+            time.sleep(0.02)
+
+    def _fail(self):
+        self._proc.kill()
+        self._proc.wait()
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        raise RuntimeError(f"ffmpeg {self.codec} failed: {self._errors()}")
+
+    def close(self):
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        self._proc.wait(timeout=30)
+        if self._proc.returncode:
+            raise RuntimeError(f"ffmpeg exited with {self._proc.returncode}: {self._errors()}")
+
+
+class OpenCVWriter:
+    """cv2.VideoWriter fallback: H.264 when OpenCV's FFmpeg build has it, MPEG-4 otherwise."""
+
+    backend = "opencv"
+    FOURCCS = (("avc1", "h264"), ("mp4v", "mpeg4"))
+    _usable = None  # the first fourcc that opened; later segments skip the failing probes
+
+    def __init__(self, path, size, fps, order, bitrate_kbps=None):
+        cv2 = _optional_cv2()
+        if cv2 is None:
+            raise RuntimeError("no video encoder: install ffmpeg or OpenCV")
+        self._cv2 = cv2
+        for fourcc, codec in ((OpenCVWriter._usable,) if OpenCVWriter._usable else self.FOURCCS):
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, tuple(size))
+            if writer.isOpened():
+                OpenCVWriter._usable = (fourcc, codec)
+                self._writer, self.codec = writer, codec
+                return
+            writer.release()
+        raise RuntimeError("OpenCV VideoWriter cannot write MP4 here")
+
+    def write(self, arr, order):
+        if order == "RGB":
+            arr = self._cv2.cvtColor(arr, self._cv2.COLOR_RGB2BGR)
+        self._writer.write(arr)
+
+    def close(self):
+        self._writer.release()
+
+
+def open_writer(path, size, fps, order, first, bitrate_kbps=RECORD_BITRATE_KBPS, backend=RECORD_BACKEND):
+    """Video writer for frames coming through Python, returned with `first`
+    (the segment's first frame) already written.
+
+    Tries ffmpeg with each encoder from ffmpeg_codecs(), then OpenCV. An
+    encoder that fails on a real frame is dropped for later segments.
+    """
+    if backend != "opencv":
+        for codec in ffmpeg_codecs():
+            writer = FfmpegWriter(path, size, fps, order, bitrate_kbps, codec)
+            try:
+                writer.write(first, order)
+                return writer
+            except RuntimeError as e:
+                print("[WARN] recording: falling back from", e)
+                _drop_codec(codec)
+        if backend == "ffmpeg":
+            raise RuntimeError("RECORD_BACKEND=ffmpeg but no working ffmpeg H.264 encoder was found")
+    writer = OpenCVWriter(path, size, fps, order, bitrate_kbps)
+    writer.write(first, order)
+    return writer
+
+
+class Recorder:
+    """Recording sessions: segmented H.264/MP4 video, event clips and time-lapse.
+
+    "video" records until stopped and "clip" for a fixed duration; both use
+    Picamera2's H.264 encoder when the camera has one (frames never pass
+    through Python), otherwise a frame tap feeds ffmpeg or cv2.VideoWriter.
+    "timelapse" takes one capture every `interval` seconds from the tap and
+    appends it to the video straight away, so no JPEG sequence piles up.
+
+    Segments rotate after `segment_sec` seconds or `segment_mb` MB, and the
+    oldest finished files in the recording directory are deleted whenever
+    the total exceeds RECORD_MAX_MB. `on_segment(path)` is called for every
+    finished segment. The cap never deletes files named by `exclude()`
+    (basenames with an upload still queued, e.g. uploads.pending_files).
+    """
+
+    def __init__(self, record_dir=RECORD_DIR, max_mb=RECORD_MAX_MB, on_segment=None, exclude=None):
+        self.record_dir = record_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.on_segment = on_segment
+        self._exclude = exclude or set  # exclude() -> names that must stay on disk
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # id -> session dict, oldest first
+        self._open_paths = set()
+        self.deleted = 0
+        os.makedirs(record_dir, exist_ok=True)
+
+    def start(self, cam, camera_id=None, mode="video", duration=None, interval=None, fps=None,
+              segment_sec=None, segment_mb=None, size=RECORD_SIZE):
+        """Start a session on `cam`; returns its public form.
+
+        Raises ValueError for bad arguments and RuntimeError when the camera
+        is already being recorded.
+        """
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if mode == "clip" and not duration:
+            raise ValueError("a clip needs a duration")
+        camera_id = camera_id or cam.camera_id
+        timelapse = mode == "timelapse"
+        native = (
+            not timelapse and size is None and RECORD_BACKEND in ("auto", "picamera2")
+            and hasattr(cam, "start_recording")
+        )
+        if RECORD_BACKEND == "picamera2" and not native:
+            raise ValueError("RECORD_BACKEND=picamera2 needs a Picamera2 camera, no RECORD_SIZE and no time-lapse")
+        now = time.time()
+        session = {
+            "id": uuid.uuid4().hex[:12],
+            "mode": mode,
+            "camera": camera_id,
+            "state": "recording",
+            "backend": "picamera2" if native else None,
+            "codec": "h264" if native else None,
+            "started_at": now,
+            "until": now + float(duration) if duration else None,
+            "interval": float(interval or RECORD_TIMELAPSE_INTERVAL) if timelapse else None,
+            "fps": float(fps or (RECORD_TIMELAPSE_FPS if timelapse else RECORD_FPS)),
+            "segment_sec": float(segment_sec if segment_sec is not None else (0 if timelapse else RECORD_SEGMENT_SEC)),
+            "segment_mb": float(segment_mb if segment_mb is not None else RECORD_SEGMENT_MB),
+            "frames": 0,
+            "dropped": 0,
+            "bytes": 0,
+            "segments": [],
+            "error": None,
+            "finished_at": None,
+            "_cam": cam,
+            "_size": size,
+            "_stop": threading.Event(),
+            "_queue": queue.Queue(maxsize=RECORD_QUEUE_SIZE),
+            "_next_due": 0.0,
+        }
+        with self._lock:
+            for other in self._sessions.values():
+                if other["camera"] == camera_id and other["state"] == "recording":
+                    raise RuntimeError(f"{camera_id} is already being recorded")
+            self._sessions[session["id"]] = session
+            while len(self._sessions) > RECENT_SESSIONS_KEPT:
+                oldest = next(iter(self._sessions.values()))
+                if oldest["state"] == "recording":
+                    break
+                self._sessions.popitem(last=False)
+        if native:
+            target = self._run_native
+        else:
+            session["_tap"] = lambda frame: self._offer(session, frame)
+            cam.add_frame_tap(session["_tap"])
+            target = self._run_tap
+        threading.Thread(target=target, args=(session,), name=f"record-{session['id']}", daemon=True).start()
+        return self._public(session)
+
+    def stop(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None:
+            return False
+        session["_stop"].set()
+        return True
+
+    def stop_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            session["_stop"].set()
+
+    def _offer(self, session, frame):
+        # Capture thread: sample at the session's rate and hand the raw arrays over without waiting
+        now = frame.timestamp
+        if now < session["_next_due"]:
+            return
+        step = session["interval"] or 1.0 / max(0.1, session["fps"])
+        session["_next_due"] = max(session["_next_due"] + step, now)
+        try:
+            session["_queue"].put_nowait((frame.raw, now))
+        except queue.Full:
+            session["dropped"] += 1
+
+    def _finished(self, session):
+        return session["_stop"].is_set() or (session["until"] is not None and time.time() >= session["until"])
+
+    def _new_segment(self, session):
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        camera = session["camera"].replace(":", "-")
+        ext = ".mp4" if session["backend"] != "picamera2" or shutil.which("ffmpeg") else ".h264"
+        base = os.path.join(self.record_dir, f"{session['mode']}_{camera}_{stamp}")
+        path, n = f"{base}{ext}", 1
+        while os.path.exists(path):
+            path, n = f"{base}-{n}{ext}", n + 1
+        segment = {"name": os.path.basename(path), "started_at": time.time(), "ended_at": None, "frames": 0, "size": 0}
+        with self._lock:
+            self._open_paths.add(path)
+            session["segments"].append(segment)
+        return path, segment
+
+    def _segment_full(self, session, path, segment):
+        if session["segment_sec"] and time.time() - segment["started_at"] >= session["segment_sec"]:
+            return True
+        if session["segment_mb"]:
+            try:
+                return os.path.getsize(path) >= session["segment_mb"] * 1024 * 1024
+            except OSError:
+                return False
+        return False
+
+    def _close_segment(self, session, path, segment):
+        try:
+            segment["size"] = os.path.getsize(path)
+        except OSError:
+            segment["size"] = 0
+        segment["ended_at"] = time.time()
+        with self._lock:
+            self._open_paths.discard(path)
+            session["bytes"] += segment["size"]
+        # Hand the segment over first, so a queued upload already protects it from the cap
+        if self.on_segment is not None and segment["size"]:
+            try:
+                self.on_segment(path)
+            except Exception as e:
+                print("[WARN] recording on_segment failed:", e)
+        self._enforce_cap()
+
+    def _run_tap(self, session):
+        cam = session["_cam"]
+        writer = path = segment = None
+        frame_size = None
+        try:
+            while not self._finished(session):
+                try:
+                    raw, _taken_at = session["_queue"].get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                rendered = cam.render_raw(raw, "preview", session["_size"])
+                if rendered is None:
+                    continue
+                arr, order = rendered
+                size = (arr.shape[1], arr.shape[0])
+                # A new segment on rotation, and whenever the camera's output size changes
+                if writer is not None and (size != frame_size or self._segment_full(session, path, segment)):
+                    writer.close()
+                    self._close_segment(session, path, segment)
+                    writer = None
+                if writer is None:
+                    path, segment = self._new_segment(session)
+                    writer = open_writer(path, size, session["fps"], order, arr)
+                    session["backend"], session["codec"] = writer.backend, writer.codec
+                    frame_size = size
+                else:
+                    writer.write(arr, order)
+                segment["frames"] += 1
+                session["frames"] += 1
+        except Exception as e:
+            print(f"[WARN] recording {session['id']} failed:", e)
+            session["error"] = str(e)
+        finally:
+            cam.remove_frame_tap(session["_tap"])
+            if writer is not None:
+                try:
+                    writer.close()
+                except Exception as e:
+                    session["error"] = str(e)
+                self._close_segment(session, path, segment)
+            self._end(session)
+
+    def _run_native(self, session):
+        cam = session["_cam"]
+        try:
+            while not self._finished(session):
+                path, segment = self._new_segment(session)
+                handle = cam.start_recording(path, RECORD_BITRATE_KBPS)
+                try:
+                    while not self._finished(session) and not self._segment_full(session, path, segment):
+                        session["_stop"].wait(0.5)
+                finally:
+                    cam.stop_recording(handle)
+                    self._close_segment(session, path, segment)
+        except Exception as e:
+            print(f"[WARN] recording {session['id']} failed:", e)
+            session["error"] = str(e)
+        finally:
+            self._end(session)
+
+    def _end(self, session):
+        with self._lock:
+            session["state"] = "failed" if session["error"] and not session["bytes"] else "done"
+            session["finished_at"] = time.time()
+
+    def _enforce_cap(self):
+        # Oldest finished files go first; segments being written or waiting for upload are never touched
+        if not self.max_bytes:
+            return
+        with self._lock:
+            open_paths = set(self._open_paths)
+        keep = set(self._exclude())
+        files = []
+        total = 0
+        for name in os.listdir(self.record_dir):
+            path = os.path.join(self.record_dir, name)
+            if not name.endswith(VIDEO_EXTENSIONS) or path in open_paths:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            # Kept files still count towards the total, they just cannot be deleted
+            total += st.st_size
+            if name not in keep:
+                files.append((st.st_mtime, path, st.st_size))
+        for _mtime, path, size in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.deleted += 1
+
+    def _public(self, session):
+        info = {k: v for k, v in session.items() if not k.startswith("_")}
+        info["segments"] = [dict(s) for s in session["segments"]]
+        return info
+
+    def sessions(self):
+        with self._lock:
+            return [self._public(s) for s in reversed(self._sessions.values())]
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return self._public(session) if session is not None else None
+
+    def path(self, name):
+        """Path of a finished recording file, or None (names only, no directories)."""
+        if os.path.basename(name) != name or not name.endswith(VIDEO_EXTENSIONS):
+            return None
+        path = os.path.join(self.record_dir, name)
+        with self._lock:
+            if path in self._open_paths:
+                return None
+        return path if os.path.isfile(path) else None
+
+    def files(self):
+        """Recording files, newest first."""
+        with self._lock:
+            open_paths = set(self._open_paths)
+        files = []
+        for name in os.listdir(self.record_dir):
+            path = os.path.join(self.record_dir, name)
+            if not name.endswith(VIDEO_EXTENSIONS):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append({"name": name, "size": st.st_size, "modified": st.st_mtime, "recording": path in open_paths})
+        files.sort(key=lambda f: f["modified"], reverse=True)
+        return files
+
+    def stats(self):
+        files = self.files()
+        with self._lock:
+            recording = sum(1 for s in self._sessions.values() if s["state"] == "recording")
+        return {
+            "recording": recording,
+            "files": len(files),
+            "bytes": sum(f["size"] for f in files),
+            "max_bytes": self.max_bytes,
+            "deleted": self.deleted,
+            "ffmpeg_codec": ffmpeg_codec(),
+        }
@@ -0,0 +1,349 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from config import SCHEDULES, SCHEDULE_FILE, SCHEDULE_JITTER, SCHEDULE_CATCH_UP
+
+TASKS = ("capture_and_upload", "capture")
+
+# Upper bound on slots walked when working out what was missed during a long stop
+MAX_MISSED_SCAN = 100000
+
+_MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+_MONTHS = {name: i + 1 for i, name in enumerate("jan feb mar apr may jun jul aug sep oct nov dec".split())}
+_DAYS = {name: i for i, name in enumerate("sun mon tue wed thu fri sat".split())}
+
+
+def _parse_field(text, low, high, names=None):
+    values = set()
+    for part in text.lower().split(","):
+        part, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if part == "*":
+            start, end = low, high
+        else:
+            first, _, last = part.partition("-")
+            start = int(names.get(first, first) if names else first)
+            end = int(names.get(last, last) if names else last) if last else (high if step > 1 else start)
+        if step < 1 or start < low or end > high or start > end:
+            raise ValueError(f"cron field {text!r} is out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpr:
+    """Five-field cron expression (minute hour day-of-month month day-of-week).
+
+    Supports *, lists, ranges, steps, month/day names and the @daily-style
+    macros. As in cron, when both day fields are restricted a day matches if
+    either does. Times are local wall-clock times.
+    """
+
+    def __init__(self, text):
+        self.text = " ".join(text.split())
+        fields = _MACROS.get(self.text.lower(), self.text).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression {text!r} needs 5 fields")
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12, _MONTHS)
+        self.weekdays = {d % 7 for d in _parse_field(fields[4], 0, 7, _DAYS)}  # 7 is Sunday too
+        # As in cron, a field starting with * ("*/2" too) counts as unrestricted
+        self._any_day = fields[2].startswith("*")
+        self._any_weekday = fields[4].startswith("*")
+
+    def _day_matches(self, t):
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, t):
+        """First matching time strictly after datetime `t`."""
+        t = t.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t.year + 8  # covers Feb 29 and any valid day/month combination
+        while t.year <= limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"cron expression {self.text!r} never matches")
+
+
+def parse_schedules(spec):
+    """Parse SCHEDULES ("CRON[=task];...") into [(cron, task)]."""
+    entries = []
+    for entry in (spec or "").split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        cron, _, task = entry.partition("=")
+        task = task.strip() or TASKS[0]
+        if task not in TASKS:
+            raise ValueError(f"unknown schedule task {task!r}")
+        CronExpr(cron)
+        entries.append((cron.strip(), task))
+    return entries
+
+
+class Scheduler:
+    """Runs capture tasks on cron schedules inside the service.
+
+    `run(entry)` does the work (the app takes a still from the camera that
+    is already running) and returns a result dict or raises. Each firing
+    runs on its own short-lived thread, so a slow upload never delays other
+    schedules; a schedule whose previous run is still going skips that
+    slot. Start times are spread by a random 0..jitter seconds.
+
+    Schedules and the last slot each one ran for are kept in SCHEDULE_FILE.
+    Slots missed while the service was down (or the device was suspended)
+    are caught up with a single run if the newest one is at most catch_up
+    seconds old; older ones are counted as missed and skipped.
+    """
+
+    def __init__(self, run, path=SCHEDULE_FILE, seed=SCHEDULES, jitter=SCHEDULE_JITTER, catch_up=SCHEDULE_CATCH_UP):
+        self._run_task = run
+        self.path = path
+        self.jitter = jitter
+        self.catch_up = catch_up
+        self._entries = {}  # id -> entry dict (persisted fields + runtime "_" fields)
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        if os.path.exists(path):
+            self._load()
+        else:
+            for cron, task in parse_schedules(seed):
+                self.add(cron, task)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[WARN] schedule file {self.path} unreadable:", e)
+            return
+        for entry in stored:
+            try:
+                entry["_cron"] = CronExpr(entry["cron"])
+            except (KeyError, ValueError) as e:
+                print("[WARN] skipping stored schedule:", e)
+                continue
+            entry["_running"] = False
+            self._entries[entry["id"]] = entry
+
+    def _save(self):
+        # Caller holds _cond
+        data = [{k: v for k, v in e.items() if not k.startswith("_")} for e in self._entries.values()]
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(data, f, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[WARN] schedule file {self.path} not written:", e)
+
+    def start(self):
+        with self._cond:
+            self._running = True
+            now = time.time()
+            for entry in self._entries.values():
+                self._plan(entry, now)
+        self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def add(self, cron, task=TASKS[0], camera=None, jitter=None, catch_up=None, enabled=True):
+        """Register a schedule; returns its public form. Raises ValueError on bad input."""
+        expr = CronExpr(cron)
+        if task not in TASKS:
+            raise ValueError(f"task must be one of {', '.join(TASKS)}")
+        now = time.time()
+        entry = {
+            "id": uuid.uuid4().hex[:8],
+            "cron": expr.text,
+            "task": task,
+            "camera": camera or None,
+            "jitter": self.jitter if jitter is None else max(0.0, float(jitter)),
+            "catch_up": self.catch_up if catch_up is None else max(0.0, float(catch_up)),
+            "enabled": bool(enabled),
+            "created_at": now,
+            "last_slot": now,  # nothing before creation counts as missed
+            "last_run": None,
+            "last_status": None,
+            "last_result": None,
+            "runs": 0,
+            "failures": 0,
+            "missed": 0,
+            "_cron": expr,
+            "_running": False,
+        }
+        with self._cond:
+            self._entries[entry["id"]] = entry
+            self._plan(entry, now)
+            self._save()
+            self._cond.notify_all()
+            return self._public(entry)
+
+    def update(self, schedule_id, **fields):
+        """Change cron/task/camera/jitter/catch_up/enabled; None leaves a field as it is."""
+        with self._cond:
+            entry = self._entries.get(schedule_id)
+            if entry is None:
+                return None
+            if fields.get("cron") is not None:
+                entry["_cron"] = CronExpr(fields["cron"])
+                entry["cron"] = entry["_cron"].text
+            if fields.get("task") is not None:
+                if fields["task"] not in TASKS:
+                    raise ValueError(f"task must be one of {', '.join(TASKS)}")
+                entry["task"] = fields["task"]
+            if "camera" in fields:
+                entry["camera"] = fields["camera"] or None
+            for key in ("jitter", "catch_up"):
+                if fields.get(key) is not None:
+                    entry[key] = max(0.0, float(fields[key]))
+            if fields.get("enabled") is not None:
+                entry["enabled"] = bool(fields["enabled"])
+            # Re-planning from now: a changed expression must not replay old slots
+            now = time.time()
+            entry["last_slot"] = max(entry["last_slot"], now)
+            self._plan(entry, now)
+            self._save()
+            self._cond.notify_all()
+            return self._public(entry)
+
+    def remove(self, schedule_id):
+        with self._cond:
+            entry = self._entries.pop(schedule_id, None)
+            if entry is not None:
+                self._save()
+                self._cond.notify_all()
+            return entry is not None
+
+    def run_now(self, schedule_id):
+        """Fire a schedule immediately (outside its cron slots); False if unknown or busy."""
+        with self._cond:
+            entry = self._entries.get(schedule_id)
+            if entry is None or entry["_running"]:
+                return False
+            self._fire(entry, None, time.time())
+            return True
+
+    def _plan(self, entry, now):
+        # Caller holds _cond. Work out the next slot and handle slots already past.
+        entry["_slot"] = entry["_due"] = None
+        if not entry["enabled"]:
+            return
+        expr = entry["_cron"]
+        slot = expr.next_after(datetime.fromtimestamp(entry["last_slot"]))
+        missed = []
+        while slot.timestamp() <= now and len(missed) < MAX_MISSED_SCAN:
+            missed.append(slot)
+            slot = expr.next_after(slot)
+        if missed and now - missed[-1].timestamp() <= entry["catch_up"]:
+            # Catch up once for the newest missed slot; the older ones are dropped
+            entry["missed"] += len(missed) - 1
+            slot = missed[-1]
+        elif missed:
+            entry["missed"] += len(missed)
+            entry["last_slot"] = missed[-1].timestamp()
+            if len(missed) >= MAX_MISSED_SCAN:
+                slot = expr.next_after(datetime.fromtimestamp(now))
+        entry["_slot"] = slot.timestamp()
+        entry["_due"] = max(entry["_slot"], now) + random.uniform(0.0, entry["jitter"])
+
+    def _loop(self):
+        with self._cond:
+            while self._running:
+                now = time.time()
+                due = [e for e in self._entries.values() if e["_due"] is not None and e["_due"] <= now]
+                for entry in due:
+                    slot = entry["_slot"]
+                    if entry["_running"]:
+                        entry["missed"] += 1  # the previous run has not finished
+                        entry["last_slot"] = slot
+                    else:
+                        self._fire(entry, slot, now)
+                    self._plan(entry, now)
+                if due:
+                    self._save()
+                pending = [e["_due"] for e in self._entries.values() if e["_due"] is not None]
+                # Wake up at least once a minute so wall-clock jumps are noticed
+                wait = min([60.0] + [d - time.time() for d in pending])
+                if wait > 0:
+                    self._cond.wait(wait)
+
+    def _fire(self, entry, slot, now):
+        # Caller holds _cond
+        entry["_running"] = True
+        if slot is not None:
+            entry["last_slot"] = slot
+        threading.Thread(
+            target=self._execute, args=(entry, self._public(entry), slot, now), name=f"schedule-{entry['id']}",
+            daemon=True,
+        ).start()
+
+    def _execute(self, entry, info, slot, fired_at):
+        start = time.monotonic()
+        try:
+            result, status = self._run_task(info), "ok"
+        except Exception as e:
+            result, status = {"error": str(e)}, "error"
+            print(f"[WARN] schedule {entry['id']} ({entry['cron']}) failed:", e)
+        with self._cond:
+            entry["_running"] = False
+            entry["runs"] += 1
+            entry["failures"] += status != "ok"
+            entry["last_run"] = fired_at
+            entry["last_status"] = status
+            entry["last_result"] = dict(
+                result or {},
+                slot=slot,
+                late_ms=round((fired_at - slot) * 1000.0, 1) if slot is not None else None,
+                duration_ms=round((time.monotonic() - start) * 1000.0, 1),
+            )
+            if entry["id"] in self._entries:
+                self._save()
+
+    def _public(self, entry):
+        info = {k: v for k, v in entry.items() if not k.startswith("_")}
+        info["next_run"] = entry.get("_due")
+        info["running"] = entry.get("_running", False)
+        return info
+
+    def get(self, schedule_id):
+        with self._cond:
+            entry = self._entries.get(schedule_id)
+            return self._public(entry) if entry is not None else None
+
+    def list(self):
+        with self._cond:
+            return sorted((self._public(e) for e in self._entries.values()),
+                          key=lambda e: (e["next_run"] is None, e["next_run"] or 0))
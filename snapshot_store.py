@@ -0,0 +1,370 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from config import SNAP_DIR, SNAPSHOT_DB, SNAP_RETENTION_DAYS, SNAP_RETENTION_MB, UPLOAD_ACK_INDEX
+
+# Upload states kept per snapshot
+UPLOAD_PENDING = "pending"
+UPLOAD_QUEUED = "queued"
+UPLOAD_SENT = "sent"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    taken_at REAL NOT NULL,
+    camera_id TEXT,
+    size INTEGER NOT NULL,
+    settings TEXT,
+    upload_state TEXT NOT NULL DEFAULT 'pending',
+    upload_job TEXT,
+    uploaded_at REAL
+);
+CREATE INDEX IF NOT EXISTS snapshots_taken_at ON snapshots (taken_at);
+CREATE INDEX IF NOT EXISTS snapshots_camera ON snapshots (camera_id, id);
+CREATE INDEX IF NOT EXISTS snapshots_upload ON snapshots (upload_state, id);
+"""
+
+_LEGACY_NAME = re.compile(r"capture_(\d{8}_\d{6})")
+
+
+def _row(row):
+    if row is None:
+        return None
+    record = dict(row)
+    record["settings"] = json.loads(record["settings"]) if record["settings"] else None
+    return record
+
+
+class SnapshotStore:
+    """Snapshots on disk plus a SQLite index of them.
+
+    Files go to SNAP_DIR/YYYY/MM/DD/capture_YYYYMMDD_HHMMSS_mmm.jpg; the name
+    is claimed with O_EXCL, so two captures in the same millisecond get a
+    "-1", "-2"... suffix instead of overwriting each other. Every file has a
+    row (path, time, camera, size, settings, upload state), so "latest",
+    paginated listings and retention are index lookups, never a directory
+    scan. Flat snapshots from older versions are indexed once, in place, when
+    the database is first created. Retention runs on a background thread
+    (at start-up and at most every PRUNE_INTERVAL seconds after a save), so
+    a large backlog of deletions never lands on a capture request.
+    """
+
+    PRUNE_INTERVAL = 60.0
+
+    def __init__(self, root=SNAP_DIR, db_path=SNAPSHOT_DB,
+                 retention_days=SNAP_RETENTION_DAYS, retention_mb=SNAP_RETENTION_MB):
+        self.root = root
+        self.db_path = db_path
+        self.retention_days = retention_days
+        self.retention_bytes = int(retention_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self._pruning = False
+        self.pruned = 0
+        os.makedirs(root, exist_ok=True)
+        created = not os.path.exists(db_path)
+        # One connection shared by all threads, serialised by _lock; WAL lets
+        # capture_and_send.py write while the app is reading
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10.0)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        if created:
+            self._import_flat()
+        self.prune_soon()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # --- writing ---------------------------------------------------------------
+
+    def _claim(self, when):
+        # Create the file exclusively; returns (name, absolute path, fd)
+        folder = os.path.join(self.root, when.strftime("%Y"), when.strftime("%m"), when.strftime("%d"))
+        os.makedirs(folder, exist_ok=True)
+        base = f"capture_{when.strftime('%Y%m%d_%H%M%S')}_{when.microsecond // 1000:03d}"
+        n = 0
+        while True:
+            name = f"{base}.jpg" if n == 0 else f"{base}-{n}.jpg"
+            path = os.path.join(folder, name)
+            try:
+                return name, path, os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                n += 1
+
+    def save(self, data, camera_id=None, settings=None, taken_at=None):
+        """Write JPEG bytes as a new snapshot and index it; returns the record."""
+        taken_at = time.time() if taken_at is None else taken_at
+        name, path, fd = self._claim(datetime.fromtimestamp(taken_at))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+        except Exception:
+            os.remove(path)
+            raise
+        record = self._insert(name, path, taken_at, camera_id, len(data), settings)
+        if time.monotonic() - self._last_prune > self.PRUNE_INTERVAL:
+            self.prune_soon()
+        return record
+
+    def _insert(self, name, path, taken_at, camera_id, size, settings, upload_state=UPLOAD_PENDING):
+        rel = os.path.relpath(path, self.root)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO snapshots (name, path, taken_at, camera_id, size, settings, upload_state)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (name, rel, taken_at, camera_id, size, json.dumps(settings) if settings else None, upload_state),
+            )
+            row = self._db.execute("SELECT * FROM snapshots WHERE name = ?", (name,)).fetchone()
+        return self._public(row)
+
+    def _import_flat(self):
+        # Snapshots saved before the store existed stay where they are
+        acked = set()
+        try:
+            with open(UPLOAD_ACK_INDEX) as f:
+                acked = {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            pass
+        names = sorted(n for n in os.listdir(self.root) if n.endswith(".jpg"))
+        for name in names:
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            m = _LEGACY_NAME.match(name)
+            taken_at = datetime.strptime(m.group(1), "%Y%m%d_%H%M%S").timestamp() if m else st.st_mtime
+            state = UPLOAD_SENT if name in acked else UPLOAD_PENDING
+            self._insert(name, path, taken_at, None, st.st_size, None, state)
+        if names:
+            print(f"[INFO] snapshot store: indexed {len(names)} existing snapshot(s)")
+
+    def mark_upload(self, names, state, job_id=None):
+        """Record the upload state of snapshots by name.
+
+        A snapshot already sent stays "sent" when it is queued again (a manual
+        re-upload), so a late "queued" never hides a finished upload.
+        """
+        if isinstance(names, str):
+            names = [names]
+        uploaded_at = time.time() if state == UPLOAD_SENT else None
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE snapshots SET upload_state = ?, upload_job = COALESCE(?, upload_job),"
+                " uploaded_at = COALESCE(?, uploaded_at) WHERE name = ? AND (upload_state != ? OR ? = ?)",
+                [(state, job_id, uploaded_at, name, UPLOAD_SENT, state, UPLOAD_SENT) for name in names],
+            )
+
+    def set_upload_job(self, name, job_id):
+        """Attach the queue's job id without touching the state: mark the
+        snapshot queued before enqueueing, then call this, so a job that
+        finishes fast is never overwritten by a late "queued"."""
+        with self._lock, self._db:
+            self._db.execute("UPDATE snapshots SET upload_job = ? WHERE name = ?", (job_id, name))
+
+    def delete(self, name):
+        with self._lock:
+            row = self._db.execute("SELECT id, path FROM snapshots WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return False
+        self._remove([row])
+        return True
+
+    # --- reading ---------------------------------------------------------------
+
+    def _public(self, row):
+        record = _row(row)
+        if record is not None:
+            record["path"] = os.path.join(self.root, record["path"])
+        return record
+
+    def get(self, key):
+        """Record by id (int) or file name."""
+        column = "id" if isinstance(key, int) else "name"
+        with self._lock:
+            row = self._db.execute(f"SELECT * FROM snapshots WHERE {column} = ?", (key,)).fetchone()
+        return self._public(row)
+
+    def latest(self, camera_id=None):
+        records, _ = self.query(limit=1, camera_id=camera_id)
+        return records[0] if records else None
+
+    def query(self, limit=50, before=None, camera_id=None, since=None, until=None, upload_state=None):
+        """Newest first, `limit` at a time.
+
+        Returns (records, next_cursor); pass next_cursor as `before` to get the
+        following page (keyset pagination, so deep pages cost the same as the
+        first). next_cursor is None on the last page.
+        """
+        where, args = [], []
+        if before is not None:
+            where.append("id < ?")
+            args.append(int(before))
+        if camera_id:
+            where.append("camera_id = ?")
+            args.append(camera_id)
+        if since is not None:
+            where.append("taken_at >= ?")
+            args.append(float(since))
+        if until is not None:
+            where.append("taken_at < ?")
+            args.append(float(until))
+        if upload_state:
+            where.append("upload_state = ?")
+            args.append(upload_state)
+        sql = "SELECT * FROM snapshots"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        limit = max(1, min(500, int(limit)))
+        with self._lock:
+            rows = self._db.execute(sql, args + [limit + 1]).fetchall()
+        records = [self._public(r) for r in rows[:limit]]
+        next_cursor = records[-1]["id"] if len(rows) > limit else None
+        return records, next_cursor
+
+    def upload_backlog(self, min_age=0.0):
+        """(path, size) of snapshots not uploaded yet, oldest first."""
+        cutoff = time.time() - min_age
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path, size FROM snapshots WHERE upload_state != ? AND taken_at <= ? ORDER BY id",
+                (UPLOAD_SENT, cutoff),
+            ).fetchall()
+        return [(os.path.join(self.root, r["path"]), r["size"]) for r in rows]
+
+    def stats(self):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COUNT(*) AS count, COALESCE(SUM(size), 0) AS bytes, MIN(taken_at) AS oldest,"
+                " MAX(taken_at) AS newest FROM snapshots"
+            ).fetchone()
+            states = self._db.execute(
+                "SELECT upload_state, COUNT(*) FROM snapshots GROUP BY upload_state"
+            ).fetchall()
+        return {
+            "count": row["count"],
+            "bytes": row["bytes"],
+            "oldest": row["oldest"],
+            "newest": row["newest"],
+            "upload": {state: count for state, count in states},
+            "retention_days": self.retention_days or None,
+            "retention_mb": round(self.retention_bytes / 1024 / 1024, 1) if self.retention_bytes else None,
+            "pruned": self.pruned,
+        }
+
+    # --- retention -------------------------------------------------------------
+
+    def prune_soon(self):
+        """Run prune() on a background thread unless one is already running."""
+        with self._lock:
+            if self._pruning:
+                return
+            self._pruning = True
+            self._last_prune = time.monotonic()
+        threading.Thread(target=self._prune_worker, name="snapshot-prune", daemon=True).start()
+
+    def _prune_worker(self):
+        try:
+            self.prune()
+        except Exception as e:
+            print("[WARN] snapshot store: prune failed:", e)
+        finally:
+            self._pruning = False
+
+    def prune(self):
+        """Delete the oldest snapshots beyond the age / total size limits.
+
+        Snapshots with an upload still queued are kept until it finishes.
+        """
+        self._last_prune = time.monotonic()
+        removed = 0
+        if self.retention_days:
+            cutoff = time.time() - self.retention_days * 86400.0
+            while True:
+                with self._lock:
+                    rows = self._db.execute(
+                        "SELECT id, path FROM snapshots WHERE taken_at < ? AND upload_state != ?"
+                        " ORDER BY taken_at LIMIT 200",
+                        (cutoff, UPLOAD_QUEUED),
+                    ).fetchall()
+                if not rows:
+                    break
+                removed += self._remove(rows)
+        if self.retention_bytes:
+            with self._lock:
+                total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM snapshots").fetchone()[0]
+            last_id = 0
+            while total > self.retention_bytes:
+                with self._lock:
+                    rows = self._db.execute(
+                        "SELECT id, path, size FROM snapshots WHERE id > ? AND upload_state != ?"
+                        " ORDER BY id LIMIT 200",
+                        (last_id, UPLOAD_QUEUED),
+                    ).fetchall()
+                if not rows:
+                    break
+                batch = []
+                for r in rows:
+                    if total <= self.retention_bytes:
+                        break
+                    batch.append(r)
+                    total -= r["size"]
+                last_id = rows[-1]["id"]
+                removed += self._remove(batch)
+        if removed:
+            self.pruned += removed
+            print(f"[INFO] snapshot store: pruned {removed} snapshot(s)")
+        return removed
+
+    def _remove(self, rows):
+        for r in rows:
+            path = os.path.join(self.root, r["path"])
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[WARN] could not delete {path}:", e)
+            self._remove_empty_dirs(os.path.dirname(path))
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM snapshots WHERE id = ?", [(r["id"],) for r in rows])
+        return len(rows)
+
+    def _remove_empty_dirs(self, folder):
+        # Drop emptied day / month / year shards, never the root itself
+        root = os.path.abspath(self.root)
+        folder = os.path.abspath(folder)
+        while folder != root and folder.startswith(root + os.sep):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                return
+            folder = os.path.dirname(folder)
+
+
+class StoreAcks:
+    """AckIndex interface over the store's upload state, for UploadQueue / BulkSync."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __contains__(self, name):
+        record = self.store.get(name)
+        return record is not None and record["upload_state"] == UPLOAD_SENT
+
+    def __len__(self):
+        return self.store.stats()["upload"].get(UPLOAD_SENT, 0)
+
+    def add(self, names):
+        self.store.mark_upload(list(names), UPLOAD_SENT)
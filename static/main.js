@@ -3,6 +3,8 @@ const overlay = document.getElementById("overlay");
 const ctx = overlay.getContext("2d");
 const gridChk = document.getElementById("grid");
 const fpsInput = document.getElementById("fps");
+const qualityInput = document.getElementById("quality");
+const adaptiveChk = document.getElementById("adaptive");
 const stats = document.getElementById("stats");
 const contrastInput = document.getElementById("contrast");
 const isoInput = document.getElementById("iso");
@@ -20,44 +22,127 @@ const sharpnessVal = document.getElementById("sharpnessVal");
 const awbSelect = document.getElementById("awb");
 const hdrToggle = document.getElementById("hdr");
 const cameraSelect = document.getElementById("cameraSelect");
+const snapList = document.getElementById("snapList");
+const snapMore = document.getElementById("snapMore");
 
 const socket = io();
 
 let running = false;
-let lastTime = performance.now(), frames = 0, shownFps = 0;
-let pendingSettings = {};
-let settingsTimer = null;
+let lastTime = performance.now(), frames = 0, shownFps = 0, frameBytes = 0;
+let pendingSettings = {};
+let settingsTimer = null;
+let frameUrl = null;
+// このページで見ているカメラ（サーバ側では複数のカメラが同時に動いている）
+let selectedCamera = null;
+// スナップショット一覧の次ページのカーソル（null なら最後まで表示済み）
+let snapCursor = null;
 
-function requestFrame() {
+function cameraQuery() {
+  return selectedCamera ? `?camera=${encodeURIComponent(selectedCamera)}` : "";
+}
+
+// Blob が使えるブラウザではバイナリ添付でフレームを受け取る（base64 より軽い）
+const binaryFrames = typeof Blob !== "undefined" && typeof URL !== "undefined" && !!URL.createObjectURL;
+
+// push モード: 一度 subscribe すればサーバが新しいフレームを送ってくる
+// ack を返すと、サーバは届くまでの時間を見て画質・解像度の段を上下する（Auto のとき。Quality は上限）
+function subscribe() {
   if (!running) return;
-  socket.emit("request_frame", {});
-  setTimeout(requestFrame, Math.max(5, 1000 / Number(fpsInput.value || 15)));
+  socket.emit("subscribe", {
+    binary: binaryFrames,
+    fps: Number(fpsInput.value || 15),
+    quality: qualityInput ? Number(qualityInput.value || 0) || null : null,
+    adaptive: adaptiveChk ? adaptiveChk.checked : true,
+    ack: true,
+    camera: selectedCamera
+  });
+}
+
+socket.on("connect", subscribe);
+
+function showFrame(data) {
+  if (typeof data === "string") {
+    img.src = data;
+    return;
+  }
+  const prev = frameUrl;
+  frameUrl = URL.createObjectURL(new Blob([data], {type: "image/jpeg"}));
+  img.src = frameUrl;
+  if (prev) URL.revokeObjectURL(prev);
+}
+
+function formatRate(bytesPerSec) {
+  return bytesPerSec >= 1024 * 1024 ? `${(bytesPerSec / 1024 / 1024).toFixed(1)} MB/s` : `${Math.round(bytesPerSec / 1024)} KB/s`;
 }
 
-socket.on("frame", msg => {
-  img.src = msg.data;
+socket.on("frame", (msg, ack) => {
+  // 受け取った時点ですぐ ack（描画時間を転送時間に含めない）
+  if (typeof ack === "function") ack();
+  showFrame(msg.data);
   drawOverlay();
   const now = performance.now();
   frames++;
+  frameBytes += typeof msg.data === "string" ? msg.data.length : (msg.data.byteLength || msg.data.size || 0);
   if (now - lastTime > 1000) {
-    shownFps = frames; frames = 0; lastTime = now;
-    stats.textContent = `FPS: ${shownFps}`;
+    const rate = frameBytes * 1000 / (now - lastTime);
+    shownFps = frames; frames = 0; frameBytes = 0; lastTime = now;
+    const quality = msg.quality ? ` · Q${msg.quality} ${img.naturalWidth}x${img.naturalHeight}` : "";
+    stats.textContent = `FPS: ${shownFps}${quality} · ${formatRate(rate)}`;
   }
 });
 
-document.getElementById("start").onclick = () => { running = true; requestFrame(); };
-document.getElementById("stop").onclick  = () => { running = false; };
+document.getElementById("start").onclick = () => { running = true; subscribe(); };
+document.getElementById("stop").onclick  = () => { running = false; socket.emit("unsubscribe"); };
+fpsInput.addEventListener("change", subscribe);
+if (qualityInput) qualityInput.addEventListener("change", subscribe);
+if (adaptiveChk) adaptiveChk.addEventListener("change", subscribe);
 document.getElementById("snap").onclick  = async () => {
-  const r = await fetch("/api/capture", {method:"POST"});
+  const r = await fetch(`/api/capture${cameraQuery()}`, {method:"POST"});
   const js = await r.json();
   alert(js.ok ? `Saved: ${js.filename}` : `Failed: ${js.error||'unknown'}`);
+  if (js.ok) loadSnapshots(true);
 };
 document.getElementById("snapUp").onclick = async () => {
-  const r = await fetch("/api/capture_and_upload", {method:"POST"});
+  const r = await fetch(`/api/capture_and_upload${cameraQuery()}`, {method:"POST"});
   const js = await r.json();
-  alert(js.ok ? `Uploaded: ${js.sent}` : `Failed: ${js.status||js.error}`);
+  alert(js.ok ? `Queued: ${js.queued} (job ${js.job})` : `Failed: ${js.error}`);
+  if (js.ok) loadSnapshots(true);
 };
 
+// サムネイルは ETag 付きでキャッシュされるので、一覧を開き直しても再送されない
+async function loadSnapshots(reset) {
+  if (!snapList) return;
+  const params = new URLSearchParams({limit: "24"});
+  if (!reset && snapCursor) params.set("before", snapCursor);
+  try {
+    const r = await fetch(`/api/snapshots?${params}`);
+    const js = await r.json();
+    if (!js.ok) return;
+    if (reset) snapList.textContent = "";
+    for (const item of js.items) {
+      const link = document.createElement("a");
+      link.href = item.image;
+      link.target = "_blank";
+      link.title = `${item.name} (${item.camera || "-"}, ${item.upload_state})`;
+      const thumb = document.createElement("img");
+      thumb.src = item.thumb;
+      thumb.loading = "lazy";
+      thumb.alt = item.name;
+      const label = document.createElement("div");
+      label.textContent = new Date(item.taken_at * 1000).toLocaleString();
+      link.append(thumb, label);
+      snapList.append(link);
+    }
+    snapCursor = js.next;
+    if (snapMore) snapMore.hidden = !snapCursor;
+  } catch (err) {
+    console.error("Failed to load snapshots", err);
+  }
+}
+
+document.getElementById("snapRefresh").onclick = () => loadSnapshots(true);
+if (snapMore) snapMore.onclick = () => loadSnapshots(false);
+
 function queueSettings(update) {
   pendingSettings = {...pendingSettings, ...update};
   if (settingsTimer) clearTimeout(settingsTimer);
@@ -66,7 +151,7 @@ function queueSettings(update) {
     pendingSettings = {};
     settingsTimer = null;
     try {
-      await fetch("/api/settings", {
+      await fetch(`/api/settings${cameraQuery()}`, {
         method: "POST",
         headers: {"Content-Type": "application/json"},
         body: JSON.stringify(payload)
@@ -79,7 +164,7 @@ function queueSettings(update) {
 
 async function loadSettings() {
   try {
-    const r = await fetch("/api/settings");
+    const r = await fetch(`/api/settings${cameraQuery()}`);
     const js = await r.json();
     if (js.ok && js.settings) {
       applySettings(js.settings);
@@ -96,7 +181,8 @@ async function loadCameraList() {
     const r = await fetch("/api/cameras");
     const js = await r.json();
     if (js.ok && Array.isArray(js.cameras)) {
-      setCameraOptions(js.cameras, js.active);
+      const live = new Set((js.open || []).map(cam => cam.id));
+      setCameraOptions(js.cameras, selectedCamera || js.active, live);
     } else {
       cameraSelect.innerHTML = "<option value=\"\">Unavailable</option>";
     }
@@ -107,7 +193,7 @@ async function loadCameraList() {
   }
 }
 
-function setCameraOptions(list, active) {
+function setCameraOptions(list, active, live) {
   if (!cameraSelect) return;
   cameraSelect.innerHTML = "";
   if (!list || list.length === 0) {
@@ -123,7 +209,8 @@ function setCameraOptions(list, active) {
     opt.value = cam.id;
     const label = cam.name || cam.id;
     const suffix = cam.type ? ` (${cam.type})` : "";
-    opt.textContent = `${label}${suffix}`;
+    const liveMark = live && live.has(cam.id) ? " ●" : "";
+    opt.textContent = `${label}${suffix}${liveMark}`;
     cameraSelect.appendChild(opt);
   });
   if (active) {
@@ -301,15 +388,18 @@ if (cameraSelect) {
     if (!id) return;
     cameraSelect.disabled = true;
     try {
+      // 他の視聴者のカメラは止めずに、選んだカメラを追加で起動してそちらを購読する
       const r = await fetch("/api/cameras", {
         method: "POST",
         headers: {"Content-Type": "application/json"},
-        body: JSON.stringify({id})
+        body: JSON.stringify({id, action: "open"})
       });
       const js = await r.json();
       if (!js.ok) {
         alert(js.error || "Failed to switch camera");
       } else {
+        selectedCamera = id;
+        subscribe();
         setTimeout(() => {
           loadSettings();
         }, 200);
@@ -341,6 +431,7 @@ if (sharpnessInput && sharpnessVal) {
 
 loadSettings();
 loadCameraList();
+loadSnapshots(true);
 
 function drawOverlay() {
   overlay.width = img.clientWidth;
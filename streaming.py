@@ -0,0 +1,403 @@
+import time
+import base64
+import threading
+from collections import deque
+
+# プレビュー配信のペイロード形式
+FRAME_MODE_BINARY = "binary"
+FRAME_MODE_BASE64 = "base64"
+
+
+def wants_binary(msg):
+    """Return True when a client asked for raw JPEG attachments."""
+    if not isinstance(msg, dict):
+        return False
+    if msg.get("binary"):
+        return True
+    return str(msg.get("mode", "")).lower() == FRAME_MODE_BINARY
+
+
+def frame_payload(jpeg, binary=False, quality=None):
+    """Build the `frame` event body for one JPEG.
+
+    Binary mode hands the bytes to Socket.IO untouched so they travel as a
+    binary attachment; base64 mode keeps the legacy data URL for old clients.
+    `quality` tells the client which JPEG quality it is being sent.
+    """
+    if binary:
+        payload = {"mode": FRAME_MODE_BINARY, "data": jpeg}
+    else:
+        b64 = base64.b64encode(jpeg).decode("ascii")
+        payload = {"mode": FRAME_MODE_BASE64, "data": f"data:image/jpeg;base64,{b64}"}
+    if quality is not None:
+        payload["quality"] = quality
+    return payload
+
+
+def parse_ladder(spec, top_quality):
+    """Parse PREVIEW_LADDER ("scale:quality,...", best first) into
+    [(scale, quality)]. A rung without a quality uses `top_quality`."""
+    rungs = []
+    for entry in (spec or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        scale, _, quality = entry.partition(":")
+        rung = (float(scale), int(quality) if quality.strip() else int(top_quality))
+        if not 0 < rung[0] <= 1 or not 10 <= rung[1] <= 95:
+            raise ValueError(f"ladder rung {entry!r} is out of range")
+        if rung not in rungs:
+            rungs.append(rung)
+    return rungs or [(1.0, int(top_quality))]
+
+
+class RateAdapter:
+    """Moves one client along the preview ladder (rung 0 is the best).
+
+    Fed with the delivery time of every frame (emit to client ack). The
+    smallest recent delivery time is taken as the link's round trip and the
+    rest as transfer time: when transferring takes most of the frame
+    interval the link is saturated and the client steps down; when it takes
+    well under half for a while, it steps up. A step up followed quickly by
+    a step down doubles the wait before the next try, so a client on a
+    marginal link settles instead of oscillating. Clients that do not ack
+    step down on backpressure only and probe one rung up after every
+    `up_after` seconds of clean sending.
+    """
+
+    DOWN_BUSY = 0.8   # transfer time / frame interval above which we step down
+    UP_BUSY = 0.35    # ... and below which we may step up
+    DOWN_HOLD = 1.0   # seconds between two steps down (lets the old queue drain)
+    UP_AFTER = 3.0
+    UP_AFTER_MAX = 30.0
+
+    def __init__(self, rungs, top=0):
+        self.rungs = rungs
+        self.top = top  # best rung this client asked for
+        self.rung = top
+        self.transfer = None  # smoothed transfer time (s) at the current rung
+        self.acked = False
+        self.up_after = self.UP_AFTER
+        self.steps_up = 0
+        self.steps_down = 0
+        self._delays = deque(maxlen=64)
+        self._changed_at = time.monotonic()
+        self._last_up = None
+        self._lock = threading.Lock()
+
+    def set_top(self, top):
+        with self._lock:
+            self.top = max(0, min(top, len(self.rungs) - 1))
+            self.rung = max(self.rung, self.top)
+
+    def delivered(self, delay, interval, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.acked = True
+            self._delays.append(delay)
+            transfer = max(0.0, delay - min(self._delays))
+            self.transfer = transfer if self.transfer is None else 0.7 * self.transfer + 0.3 * transfer
+            busy = self.transfer / interval
+            if busy > self.DOWN_BUSY:
+                self._down(now)
+            elif busy < self.UP_BUSY:
+                self._up(now)
+
+    def congested(self, now=None):
+        with self._lock:
+            self._down(time.monotonic() if now is None else now)
+
+    def clear(self, now=None):
+        # A frame went out without backpressure; only clients without acks probe on this
+        if not self.acked:
+            with self._lock:
+                self._up(time.monotonic() if now is None else now)
+
+    def _down(self, now):
+        if self.rung >= len(self.rungs) - 1 or now - self._changed_at < self.DOWN_HOLD:
+            return
+        if self._last_up is not None and now - self._last_up < 2 * self.up_after:
+            self.up_after = min(self.up_after * 2, self.UP_AFTER_MAX)
+        else:
+            self.up_after = self.UP_AFTER
+        self.rung += 1
+        self.steps_down += 1
+        self._changed_at = now
+        self.transfer = None
+
+    def _up(self, now):
+        if self.rung <= self.top or now - self._changed_at < self.up_after:
+            return
+        self.rung -= 1
+        self.steps_up += 1
+        self._changed_at = now
+        self._last_up = now
+        self.transfer = None
+
+    def encoding(self):
+        return self.rungs[self.rung]
+
+
+class ClientState:
+    """Delivery bookkeeping for one Socket.IO session."""
+
+    def __init__(self, sid, max_fps, ladder=None):
+        self.sid = sid
+        self.ladder = ladder or []
+        self.max_fps = max_fps
+        self.fps = max_fps
+        self.interval = 1.0 / max_fps
+        self.next_due = 0.0
+        self.last_seq = 0  # 直近に送ったフレームのシーケンス番号（重複送信の抑止用）
+        self.frames_sent = 0
+        self.skipped = 0
+        self.bytes_sent = 0
+        # push モード（subscribe 済み）の配信条件
+        self.subscribed = False
+        self.pushing = False  # push タスクが動いているか
+        self.binary = False
+        self.quality = None
+        self.camera_id = None  # 視聴するカメラ（None は既定カメラ）
+        self.adapter = None  # 帯域に合わせて段を選ぶ（adaptive で subscribe したとき）
+        self.acks = False  # クライアントがフレームごとに ack を返すか
+        self.bytes_per_s = 0.0
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+
+    def set_quality(self, quality):
+        try:
+            quality = int(quality)
+        except (TypeError, ValueError):
+            self.quality = None
+        else:
+            self.quality = max(10, min(95, quality))
+        if self.adapter is not None:
+            self.adapter.set_top(self._top_rung())
+
+    def set_adaptive(self, adaptive):
+        if adaptive and self.ladder:
+            if self.adapter is None:
+                self.adapter = RateAdapter(self.ladder, self._top_rung())
+        else:
+            self.adapter = None
+
+    def _top_rung(self):
+        # 指定された品質は上限: それ以下の品質の最初の段から始める
+        if not self.quality:
+            return 0
+        for i, (_scale, quality) in enumerate(self.ladder):
+            if quality <= self.quality:
+                return i
+        return len(self.ladder) - 1
+
+    def encoding(self):
+        """(quality, scale) to send next; quality None means the shared preview."""
+        if self.adapter is not None:
+            scale, quality = self.adapter.encoding()
+            return quality, scale
+        return self.quality, 1.0
+
+    def count_bytes(self, nbytes, now):
+        self._window_bytes += nbytes
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.bytes_per_s = self._window_bytes / elapsed
+            self._window_start, self._window_bytes = now, 0
+
+    def set_fps(self, fps):
+        try:
+            fps = float(fps)
+        except (TypeError, ValueError):
+            return
+        if fps <= 0:
+            return
+        self.fps = min(fps, self.max_fps)
+        self.interval = 1.0 / self.fps
+
+    def take_slot(self, now):
+        """Consume one slot of this client's rate budget if one is due."""
+        if now < self.next_due:
+            return False
+        # 期限ベースで進めるので、クライアント側タイマーの揺れで FPS が半減しない
+        self.next_due = max(self.next_due, now - self.interval) + self.interval
+        return True
+
+    def snapshot(self):
+        quality, scale = self.encoding()
+        adapter = self.adapter
+        return {
+            "sid": self.sid,
+            "camera": self.camera_id,
+            "fps": self.fps,
+            "subscribed": self.subscribed,
+            "quality": self.quality,
+            "frames_sent": self.frames_sent,
+            "skipped": self.skipped,
+            "bytes_sent": self.bytes_sent,
+            "bytes_per_s": round(self.bytes_per_s),
+            "adaptive": adapter is not None,
+            "encoding": {"quality": quality, "scale": scale},
+            "rung": adapter.rung if adapter is not None else None,
+            "transfer_ms": round(adapter.transfer * 1000.0, 1) if adapter is not None and adapter.transfer is not None else None,
+            "steps": {"up": adapter.steps_up, "down": adapter.steps_down} if adapter is not None else None,
+        }
+
+
+class FrameDelivery:
+    """Per-session frame delivery.
+
+    Every connected client gets its own rate budget and its own latest-frame
+    slot. A request that arrives before the client's next slot, or when the
+    camera has nothing newer than what the client already has, is dropped
+    instead of queued, so a slow viewer never holds back the others.
+
+    With a `ladder` of (scale, quality) rungs, adaptive clients are moved
+    between rungs by a RateAdapter; clients on the same rung receive the
+    same cached JPEG, so encoding cost grows with the rungs in use, not
+    with the number of viewers.
+    """
+
+    def __init__(self, max_fps, ladder=None, adaptive=False):
+        self.max_fps = max_fps
+        self.ladder = ladder or []
+        self.adaptive = adaptive
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def connect(self, sid):
+        with self._lock:
+            state = self._clients.get(sid)
+            if state is None:
+                state = ClientState(sid, self.max_fps, self.ladder)
+                self._clients[sid] = state
+            return state
+
+    def disconnect(self, sid):
+        with self._lock:
+            state = self._clients.pop(sid, None)
+        if state is not None:
+            state.subscribed = False
+
+    def client(self, sid):
+        with self._lock:
+            return self._clients.get(sid)
+
+    def subscribe(self, sid, fps=None, quality=None, binary=False, camera_id=None, adaptive=None, acks=False):
+        """Switch `sid` to push mode; returns (state, started) where started is
+        False when a push task for this session is already running.
+        `adaptive` None follows the server default."""
+        state = self.connect(sid)
+        if fps is not None:
+            state.set_fps(fps)
+        state.set_adaptive(self.adaptive if adaptive is None else bool(adaptive))
+        state.acks = bool(acks)
+        state.set_quality(quality)
+        state.binary = bool(binary)
+        state.camera_id = camera_id or None
+        with self._lock:
+            state.subscribed = True
+            started = not state.pushing
+            state.pushing = True
+        return state, started
+
+    def stop_pushing(self, state, force=False):
+        """Called by the push task on its way out: clears `pushing` and returns
+        True, unless a subscribe came in meanwhile (then the task keeps going).
+        Checked under the same lock as subscribe, so one of the two always
+        ends up pushing. `force` clears it regardless (the task failed)."""
+        with self._lock:
+            if state.subscribed and not force:
+                return False
+            state.pushing = False
+            return True
+
+    def unsubscribe(self, sid):
+        state = self.client(sid)
+        if state is not None:
+            state.subscribed = False
+
+    def skip(self, sid, frame):
+        """Drop `frame` for `sid` without sending it (backpressure)."""
+        state = self.client(sid)
+        if state is None or frame is None:
+            return
+        state.skipped += 1
+        state.last_seq = max(state.last_seq, frame.seq)
+        if state.adapter is not None:
+            state.adapter.congested()
+
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def next_frame(self, sid, frame, now=None, fps=None):
+        """Return the Frame to send to `sid`, or None when it should be skipped."""
+        state = self.connect(sid)
+        if fps is not None:
+            state.set_fps(fps)
+        if now is None:
+            now = time.monotonic()
+        if frame is None or frame.seq <= state.last_seq:
+            state.skipped += 1
+            return None
+        if not state.take_slot(now):
+            state.skipped += 1
+            return None
+        state.last_seq = frame.seq
+        return frame
+
+    def mark_sent(self, sid, nbytes):
+        with self._lock:
+            state = self._clients.get(sid)
+        if state is None:
+            return
+        state.frames_sent += 1
+        state.bytes_sent += nbytes
+        state.count_bytes(nbytes, time.monotonic())
+        if state.adapter is not None:
+            state.adapter.clear()
+
+    def ack_callback(self, sid):
+        """Socket.IO ack callback for a frame sent now: feeds the delivery
+        time to the client's adapter. None when the client does not ack."""
+        state = self.client(sid)
+        if state is None or not state.acks or state.adapter is None:
+            return None
+        adapter, sent_at = state.adapter, time.monotonic()
+
+        def acked(*_args):
+            adapter.delivered(time.monotonic() - sent_at, state.interval)
+        return acked
+
+    def stats(self):
+        with self._lock:
+            clients = list(self._clients.values())
+        return [c.snapshot() for c in clients]
+
+    def camera_totals(self):
+        """Subscribed clients and bytes/frames sent, per camera id (None = default)."""
+        with self._lock:
+            clients = list(self._clients.values())
+        totals = {}
+        for c in clients:
+            if not c.subscribed:
+                continue
+            t = totals.setdefault(c.camera_id, {"clients": 0, "frames_sent": 0, "bytes_sent": 0, "bytes_per_s": 0})
+            t["clients"] += 1
+            t["frames_sent"] += c.frames_sent
+            t["bytes_sent"] += c.bytes_sent
+            t["bytes_per_s"] += round(c.bytes_per_s)
+        return totals
+
+
+MJPEG_BOUNDARY = "frame"
+
+
+def mjpeg_part(jpeg):
+    """One multipart/x-mixed-replace part carrying a JPEG as-is."""
+    header = (
+        f"--{MJPEG_BOUNDARY}\r\n"
+        "Content-Type: image/jpeg\r\n"
+        f"Content-Length: {len(jpeg)}\r\n\r\n"
+    ).encode("ascii")
+    return header + jpeg + b"\r\n"
@@ -0,0 +1,180 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from PIL import Image
+
+from config import THUMB_CACHE_DIR, THUMB_CACHE_MB, THUMB_QUALITY, THUMB_SIZE
+
+
+def render_thumbnail(src, dst, size=THUMB_SIZE, quality=THUMB_QUALITY):
+    """Write a JPEG thumbnail of `src` to `dst` without decoding it at full size.
+
+    draft() makes libjpeg decode straight to 1/2, 1/4 or 1/8 scale in the DCT
+    domain (the smallest that still covers `size`), so only that reduced
+    image is ever in memory; the last step to `size` is an ordinary resize.
+    """
+    with Image.open(src) as im:
+        im.draft("RGB", tuple(size))
+        im = im.convert("RGB")
+        im.thumbnail(tuple(size), Image.BILINEAR)
+        tmp = f"{dst}.tmp"
+        im.save(tmp, "JPEG", quality=quality)
+    os.replace(tmp, dst)
+
+
+class ThumbnailCache:
+    """Snapshot thumbnails rendered once in the background and kept on disk.
+
+    A thumbnail is keyed by snapshot id and thumbnail size; snapshots never
+    change, so a cached file stays valid until evicted. The cache is bounded
+    by THUMB_CACHE_MB and evicts the least recently served files first (file
+    mtimes carry the order across restarts).
+    """
+
+    def __init__(self, cache_dir=THUMB_CACHE_DIR, max_mb=THUMB_CACHE_MB, size=THUMB_SIZE, quality=THUMB_QUALITY):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.size = tuple(size)
+        self.quality = quality
+        self._lru = OrderedDict()  # file name -> bytes, least recently used first
+        self._bytes = 0
+        self._pending = {}  # file name -> Event, queued or rendering
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.rendered = 0
+        self.evicted = 0
+        self.failed = 0
+        self._render_time = 0.0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".jpg"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+        for _mtime, name, size in sorted(entries):
+            self._lru[name] = size
+            self._bytes += size
+        self._evict()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="thumbnails", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def key(self, record):
+        return f"{record['id']}_{self.size[0]}x{self.size[1]}.jpg"
+
+    def etag(self, record):
+        # Snapshot id and size pin the source; thumbnail size and quality pin the rendering
+        return f"{record['id']}-{record['size']}-{self.size[0]}x{self.size[1]}-q{self.quality}"
+
+    def submit(self, record):
+        """Queue a thumbnail for `record` unless it is cached; returns an Event or None."""
+        name = self.key(record)
+        with self._cond:
+            if name in self._lru:
+                return None
+            event = self._pending.get(name)
+            if event is None:
+                event = self._pending[name] = threading.Event()
+                self._queue.append((name, record["path"]))
+                self._cond.notify()
+            return event
+
+    def get(self, record, timeout=5.0):
+        """Path of the cached thumbnail, rendering it first if needed; None on failure."""
+        name = self.key(record)
+        path = os.path.join(self.cache_dir, name)
+        with self._cond:
+            cached = name in self._lru
+            if cached:
+                self._lru.move_to_end(name)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+        event = self.submit(record)
+        if event is not None and not event.wait(timeout):
+            return None
+        with self._cond:
+            return path if name in self._lru else None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                name, src = self._queue.popleft()
+            dst = os.path.join(self.cache_dir, name)
+            start = time.monotonic()
+            try:
+                render_thumbnail(src, dst, self.size, self.quality)
+                size = os.path.getsize(dst)
+            except Exception as e:
+                print(f"[WARN] thumbnail for {src} failed:", e)
+                size = None
+            with self._cond:
+                if size is None:
+                    self.failed += 1
+                else:
+                    self._render_time += time.monotonic() - start
+                    self.rendered += 1
+                    self._lru[name] = size
+                    self._bytes += size
+                    self._evict()
+                event = self._pending.pop(name, None)
+            if event is not None:
+                event.set()
+
+    def _evict(self):
+        # Caller holds _cond (or is __init__); the newest entry is always kept
+        while self._bytes > self.max_bytes and len(self._lru) > 1:
+            name, size = self._lru.popitem(last=False)
+            self._bytes -= size
+            self.evicted += 1
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._cond:
+            return {
+                "entries": len(self._lru),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "queued": len(self._queue),
+                "hits": self.hits,
+                "misses": self.misses,
+                "rendered": self.rendered,
+                "evicted": self.evicted,
+                "failed": self.failed,
+                "avg_render_ms": round(self._render_time / self.rendered * 1000.0, 2) if self.rendered else None,
+            }
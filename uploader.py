@@ -0,0 +1,703 @@
+import heapq
+import json
+import mimetypes
+import os
+import random
+import tarfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from config import (
+    SNAP_DIR, UPLOAD_URL, UPLOAD_API_KEY, UPLOAD_SPOOL_DIR, UPLOAD_WORKERS, UPLOAD_TIMEOUT,
+    UPLOAD_MAX_ATTEMPTS, UPLOAD_BACKOFF_BASE, UPLOAD_BACKOFF_MAX, UPLOAD_ACK_INDEX,
+    BULK_UPLOAD_URL, BULK_FORMAT, BULK_BATCH_FILES, BULK_BATCH_MB, BULK_RATE_KBPS,
+)
+from metrics import UPLOAD_SECONDS
+
+# Finished jobs remembered for GET /api/uploads/<id>
+RECENT_JOBS_KEPT = 200
+
+
+def _retryable(status):
+    # Server-side trouble and rate limiting get retried; other 4xx will fail the same way again
+    return status >= 500 or status in (408, 425, 429)
+
+
+def _retry_after(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempts, base, cap, retry_after=None):
+    # Exponential backoff with jitter; a server's Retry-After wins when it asks for longer
+    delay = min(cap, base * (2 ** (attempts - 1)))
+    delay = random.uniform(delay / 2.0, delay)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+def _make_session(api_key, pool_size):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    # One keep-alive pool: no new TCP/TLS handshake per upload
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if api_key:
+        session.headers["Authorization"] = f"Bearer {api_key}"  # 必要に応じて調整
+    return session
+
+
+class AckIndex:
+    """Snapshot names the server has acknowledged, one per line (append-only)."""
+
+    def __init__(self, path=UPLOAD_ACK_INDEX):
+        self.path = path
+        self._lock = threading.Lock()
+        self._names = set()
+        try:
+            with open(path) as f:
+                self._names = {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, names):
+        with self._lock:
+            new = [n for n in dict.fromkeys(names) if n not in self._names]
+            if not new:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write("".join(f"{n}\n" for n in new))
+                f.flush()
+                os.fsync(f.fileno())
+            self._names.update(new)
+
+
+class RateLimiter:
+    """Token bucket over bytes; consume() sleeps until `n` bytes fit the budget."""
+
+    def __init__(self, bytes_per_s, burst=None):
+        self.rate = max(0.0, float(bytes_per_s))
+        self.burst = burst or max(64 * 1024, self.rate / 4.0)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate) - n
+            self._last = now
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class UploadQueue:
+    """Background uploader with an on-disk spool.
+
+    enqueue() writes a small JSON job file into the spool and returns its id
+    at once; a fixed number of worker threads (the concurrency bound) post
+    the files through one keep-alive requests.Session. Failed attempts are
+    retried with exponential backoff and jitter (Retry-After is honoured),
+    and since every pending job lives in the spool until it is sent, jobs
+    survive restarts. Jobs that cannot succeed move to spool/failed/.
+    """
+
+    def __init__(
+        self,
+        url=UPLOAD_URL,
+        api_key=UPLOAD_API_KEY,
+        spool_dir=UPLOAD_SPOOL_DIR,
+        workers=UPLOAD_WORKERS,
+        timeout=UPLOAD_TIMEOUT,
+        max_attempts=UPLOAD_MAX_ATTEMPTS,
+        backoff_base=UPLOAD_BACKOFF_BASE,
+        backoff_max=UPLOAD_BACKOFF_MAX,
+        acked=None,
+        on_finish=None,
+    ):
+        self.url = url
+        self.api_key = api_key
+        self.spool_dir = spool_dir
+        self.failed_dir = os.path.join(spool_dir, "failed")
+        self.workers = max(1, int(workers))
+        self.timeout = timeout
+        self.max_attempts = max(0, int(max_attempts))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.acked = acked  # AckIndex shared with BulkSync, so sent files are not bulk-sent again
+        self.on_finish = on_finish  # on_finish(job) after a job is sent or given up
+        self._jobs = {}  # id -> job, queued or in flight
+        self._due = []  # heap of (next_at, id)
+        self._recent = OrderedDict()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._session = None
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.latencies = deque(maxlen=200)
+
+    def start(self, load_spool=True):
+        os.makedirs(self.failed_dir, exist_ok=True)
+        if load_spool:
+            self._load_spool()
+        if not self.url:
+            # Jobs stay in the spool until an UPLOAD_URL is configured
+            return
+        self._running = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"upload-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=2.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def enqueue(self, path, fields=None):
+        """Spool an upload of `path` (with extra form `fields`); returns the job id."""
+        if not self.url:
+            raise RuntimeError("UPLOAD_URL not set")
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex[:16],
+            "path": os.path.abspath(path),
+            "fields": dict(fields or {}),
+            "state": "queued",
+            "attempts": 0,
+            "created_at": now,
+            "next_at": now,
+            "last_error": None,
+            "status": None,
+        }
+        self._persist(job)
+        with self._cond:
+            self._jobs[job["id"]] = job
+            heapq.heappush(self._due, (job["next_at"], job["id"]))
+            self._cond.notify()
+        return job["id"]
+
+    def status(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id) or self._recent.get(job_id)
+            if job is not None:
+                return self._public(job)
+        failed = self._read_job(os.path.join(self.failed_dir, f"{job_id}.json"))
+        return self._public(failed) if failed else None
+
+    def pending(self):
+        with self._cond:
+            return len(self._jobs)
+
+    def pending_files(self):
+        """Basenames of files with a job still queued or in flight."""
+        with self._cond:
+            return {os.path.basename(job["path"]) for job in self._jobs.values()}
+
+    def drain(self, timeout=None):
+        """Wait until every queued job is finished; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._jobs:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._cond:
+            latencies = list(self.latencies)
+            queued = len(self._jobs) - self.in_flight
+            next_at = self._due[0][0] if self._due else None
+            return {
+                "enabled": bool(self.url),
+                "queued": queued,
+                "in_flight": self.in_flight,
+                "sent": self.sent,
+                "failed": self.failed,
+                "retries": self.retries,
+                "bytes_sent": self.bytes_sent,
+                "workers": self.workers,
+                "avg_latency_ms": round(sum(latencies) / len(latencies) * 1000.0, 1) if latencies else None,
+                "next_retry_in_s": round(max(0.0, next_at - time.time()), 1) if next_at else None,
+            }
+
+    # --- spool ---------------------------------------------------------------
+
+    def _job_path(self, job_id):
+        return os.path.join(self.spool_dir, f"{job_id}.json")
+
+    def _persist(self, job):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = self._job_path(job["id"])
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp, path)
+
+    def _read_job(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _load_spool(self):
+        loaded = 0
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith(".json"):
+                continue
+            job = self._read_job(os.path.join(self.spool_dir, name))
+            if not job or "id" not in job:
+                continue
+            job["state"] = "queued"
+            with self._cond:
+                if job["id"] in self._jobs:
+                    continue
+                self._jobs[job["id"]] = job
+                heapq.heappush(self._due, (job.get("next_at") or 0.0, job["id"]))
+            loaded += 1
+        if loaded:
+            print(f"[INFO] upload queue: {loaded} spooled job(s) resumed")
+
+    def _finish(self, job, state):
+        job["state"] = state
+        job["finished_at"] = time.time()
+        try:
+            if state == "failed":
+                self._persist(job)
+                os.replace(self._job_path(job["id"]), os.path.join(self.failed_dir, f"{job['id']}.json"))
+            else:
+                os.remove(self._job_path(job["id"]))
+        except OSError as e:
+            print(f"[WARN] upload spool cleanup failed for {job['id']}:", e)
+        with self._cond:
+            self._jobs.pop(job["id"], None)
+            self._recent[job["id"]] = job
+            while len(self._recent) > RECENT_JOBS_KEPT:
+                self._recent.popitem(last=False)
+            self._cond.notify_all()
+        if self.on_finish is not None:
+            try:
+                self.on_finish(self._public(job))
+            except Exception as e:
+                print(f"[WARN] upload {job['id']} finish hook failed:", e)
+
+    @staticmethod
+    def _public(job):
+        keys = ("id", "state", "attempts", "created_at", "next_at", "finished_at", "last_error", "status", "response")
+        info = {k: job.get(k) for k in keys}
+        info["file"] = os.path.basename(job.get("path") or "")
+        return info
+
+    # --- workers -------------------------------------------------------------
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = _make_session(self.api_key, self.workers)
+        return self._session
+
+    def _next_job(self):
+        with self._cond:
+            while self._running:
+                if self._due:
+                    next_at, job_id = self._due[0]
+                    wait = next_at - time.time()
+                    if wait <= 0:
+                        heapq.heappop(self._due)
+                        job = self._jobs.get(job_id)
+                        if job is None:
+                            continue
+                        job["state"] = "sending"
+                        self.in_flight += 1
+                        return job
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+        return None
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                self._attempt(job)
+            except Exception as e:
+                print(f"[ERROR] upload {job['id']}:", e)
+                self._schedule_retry(job, str(e), None)
+
+    def _attempt(self, job):
+        job["attempts"] += 1
+        path = job["path"]
+        if not os.path.exists(path):
+            job["last_error"] = "file missing"
+            self._done(job, "failed")
+            return
+        started = time.monotonic()
+        size = os.path.getsize(path)
+        try:
+            with open(path, "rb") as f:
+                mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                files = {"file": (os.path.basename(path), f, mimetype)}
+                r = self._get_session().post(self.url, files=files, data=job["fields"], timeout=self.timeout)
+        except Exception as e:  # connection refused, timeout, DNS...
+            self._schedule_retry(job, str(e), None)
+            return
+        job["status"] = r.status_code
+        job["response"] = r.text[:200]
+        if r.ok:
+            job["last_error"] = None
+            with self._cond:
+                self.sent += 1
+                self.bytes_sent += size
+                self.latencies.append(time.monotonic() - started)
+            UPLOAD_SECONDS.observe(time.monotonic() - started)
+            if self.acked is not None:
+                self.acked.add([os.path.basename(path)])
+            self._done(job, "sent")
+        elif _retryable(r.status_code):
+            self._schedule_retry(job, f"HTTP {r.status_code}", _retry_after(r.headers.get("Retry-After")))
+        else:
+            job["last_error"] = f"HTTP {r.status_code}"
+            self._done(job, "failed")
+
+    def _done(self, job, state):
+        with self._cond:
+            self.in_flight -= 1
+            if state == "failed":
+                self.failed += 1
+        self._finish(job, state)
+
+    def _schedule_retry(self, job, error, retry_after):
+        job["last_error"] = error
+        if self.max_attempts and job["attempts"] >= self.max_attempts:
+            self._done(job, "failed")
+            return
+        delay = _backoff(job["attempts"], self.backoff_base, self.backoff_max, retry_after)
+        job["next_at"] = time.time() + delay
+        job["state"] = "retrying"
+        self._persist(job)
+        with self._cond:
+            self.in_flight -= 1
+            self.retries += 1
+            heapq.heappush(self._due, (job["next_at"], job["id"]))
+            self._cond.notify()
+
+
+class _StreamBody:
+    """Request body of byte strings and (path, size) files, read in chunks through a RateLimiter.
+
+    It has a length, so requests sends a Content-Length instead of chunked
+    encoding, and files are never loaded into memory whole.
+    """
+
+    CHUNK = 16 * 1024
+
+    def __init__(self, parts, limiter):
+        self.parts = parts
+        self.limiter = limiter
+        self.length = sum(len(p) if isinstance(p, bytes) else p[1] for p in parts)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for part in self.parts:
+            if isinstance(part, bytes):
+                for i in range(0, len(part), self.CHUNK):
+                    chunk = part[i:i + self.CHUNK]
+                    self.limiter.consume(len(chunk))
+                    yield chunk
+                continue
+            path, size = part
+            with open(path, "rb") as f:
+                remaining = size
+                while remaining:
+                    chunk = f.read(min(self.CHUNK, remaining))
+                    if not chunk:
+                        raise OSError(f"{path} shrank while uploading")
+                    remaining -= len(chunk)
+                    self.limiter.consume(len(chunk))
+                    yield chunk
+
+
+def _multipart_parts(files, boundary):
+    # One form with a `count` field and a `files` part per snapshot
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="count"\r\n\r\n{len(files)}\r\n'.encode()
+    ]
+    for path, size in files:
+        name = os.path.basename(path)
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="files"; filename="{name}"\r\n'
+            "Content-Type: image/jpeg\r\n\r\n".encode()
+        )
+        parts.append((path, size))
+        parts.append(b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return parts
+
+
+def _tar_parts(files):
+    # ustar stream: 512-byte header, data padded to 512, two zero blocks at the end
+    parts = []
+    for path, size in files:
+        info = tarfile.TarInfo(os.path.basename(path))
+        info.size = size
+        info.mtime = int(os.path.getmtime(path))
+        info.mode = 0o644
+        parts.append(info.tobuf(format=tarfile.USTAR_FORMAT))
+        parts.append((path, size))
+        if size % tarfile.BLOCKSIZE:
+            parts.append(b"\0" * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE))
+    parts.append(b"\0" * (2 * tarfile.BLOCKSIZE))
+    return parts
+
+
+class BulkSync:
+    """Sends the snapshot backlog in SNAP_DIR in batches, oldest first.
+
+    Each request carries up to BULK_BATCH_FILES snapshots (and at most
+    BULK_BATCH_MB), either as one multipart form or as a streamed tar. Names
+    the server acknowledges go into the AckIndex, so a sync that is stopped,
+    fails or is started twice never sends a file again; files that still have
+    a job in the UploadQueue are left to it. With a SnapshotStore the backlog
+    comes from its index instead of a listing of SNAP_DIR. The body is
+    streamed through a token bucket (BULK_RATE_KBPS) so a long catch-up does
+    not starve the live preview of uplink bandwidth.
+
+    A 2xx answer acknowledges the whole batch unless the server returns JSON
+    with an "accepted" list of names. 413 halves the batch size; other errors
+    are retried with the same backoff as the upload queue.
+    """
+
+    # Files younger than this may still be being written
+    MIN_AGE = 2.0
+
+    def __init__(
+        self,
+        snap_dir=SNAP_DIR,
+        url=BULK_UPLOAD_URL,
+        api_key=UPLOAD_API_KEY,
+        acked=None,
+        exclude=None,
+        store=None,
+        fmt=BULK_FORMAT,
+        batch_files=BULK_BATCH_FILES,
+        batch_mb=BULK_BATCH_MB,
+        rate_kbps=BULK_RATE_KBPS,
+        timeout=UPLOAD_TIMEOUT,
+        max_attempts=UPLOAD_MAX_ATTEMPTS,
+        backoff_base=UPLOAD_BACKOFF_BASE,
+        backoff_max=UPLOAD_BACKOFF_MAX,
+    ):
+        self.snap_dir = snap_dir
+        self.url = url
+        self.api_key = api_key
+        self.acked = acked if acked is not None else AckIndex()
+        self._exclude = exclude or set  # exclude() -> names another uploader is handling
+        self.store = store
+        self.fmt = fmt
+        self.batch_files = max(1, int(batch_files))
+        self.batch_bytes = max(1, int(batch_mb * 1024 * 1024))
+        self.limiter = RateLimiter(rate_kbps * 1024.0)
+        self.timeout = timeout
+        self.max_attempts = max(0, int(max_attempts))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._session = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.state = "idle"
+        self.remaining = 0
+        self.batches = 0
+        self.files_sent = 0
+        self.bytes_sent = 0
+        self.retries = 0
+        self.rejected = 0
+        self.last_error = None
+        self.started_at = None
+        self.finished_at = None
+        self._send_time = 0.0
+
+    def backlog(self):
+        """Snapshot paths not acknowledged yet, oldest first."""
+        skip = set(self._exclude())
+        if self.store is not None:
+            # Indexed files are complete on disk; only the upload state matters
+            return [(path, size) for path, size in self.store.upload_backlog()
+                    if os.path.basename(path) not in skip]
+        now = time.time()
+        result = []
+        for name in sorted(os.listdir(self.snap_dir)):
+            if not name.endswith(".jpg") or name in self.acked or name in skip:
+                continue
+            path = os.path.join(self.snap_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if now - st.st_mtime >= self.MIN_AGE:
+                result.append((path, st.st_size))
+        return result
+
+    def start(self):
+        """Start a sync in the background; False if one is already running."""
+        if not self.url:
+            raise RuntimeError("UPLOAD_URL not set")
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._stop.clear()
+            self.state = "running"
+            self.started_at = time.time()
+            self.finished_at = None
+            self.last_error = None
+            self._thread = threading.Thread(target=self._run, name="bulk-sync", daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def running(self):
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "format": self.fmt,
+            "remaining": self.remaining,
+            "batches": self.batches,
+            "files_sent": self.files_sent,
+            "bytes_sent": self.bytes_sent,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "acknowledged": len(self.acked),
+            "batch_files": self.batch_files,
+            "rate_kbps": round(self.limiter.rate / 1024.0, 1),
+            "throughput_kbps": round(self.bytes_sent / self._send_time / 1024.0, 1) if self._send_time else None,
+            "last_error": self.last_error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def _run(self):
+        try:
+            self.state = self._sync()
+        except Exception as e:
+            self.last_error = str(e)
+            self.state = "failed"
+            print("[ERROR] bulk sync:", e)
+        self.finished_at = time.time()
+
+    def _take(self, pending, limit):
+        # Up to `limit` files and batch_bytes, but always at least one file
+        batch, size = [], 0
+        while pending and len(batch) < limit:
+            if batch and size + pending[0][1] > self.batch_bytes:
+                break
+            batch.append(pending.popleft())
+            size += batch[-1][1]
+        return batch
+
+    def _sync(self):
+        pending = deque(self.backlog())
+        self.remaining = len(pending)
+        attempts = 0
+        limit = self.batch_files
+        while pending:
+            if self._stop.is_set():
+                return "stopped"
+            # Snapshots deleted since the scan (retention, by hand) are dropped, not retried
+            batch = [(path, size) for path, size in self._take(pending, limit) if os.path.exists(path)]
+            if not batch:
+                continue
+            status, accepted, retry_after, error = self._send(batch)
+            if accepted is not None:
+                self.acked.add(accepted)
+                accepted = set(accepted)
+                self.batches += 1
+                self.files_sent += len(accepted)
+                self.bytes_sent += sum(size for path, size in batch if os.path.basename(path) in accepted)
+                self.rejected += len(batch) - len(accepted)
+                self.remaining = len(pending)
+                self.last_error = None
+                attempts = 0
+                continue
+            pending.extendleft(reversed(batch))
+            self.last_error = error
+            if status == 413 and limit > 1:
+                limit = max(1, limit // 2)
+                self.batch_files = limit
+                continue
+            if status is not None and not _retryable(status):
+                return "failed"
+            attempts += 1
+            self.retries += 1
+            if self.max_attempts and attempts >= self.max_attempts:
+                return "failed"
+            self._stop.wait(_backoff(attempts, self.backoff_base, self.backoff_max, retry_after))
+        return "done"
+
+    def _send(self, batch):
+        # Returns (status, accepted names or None on failure, retry_after, error)
+        if self._session is None:
+            self._session = _make_session(self.api_key, 1)
+        if self.fmt == "tar":
+            parts = _tar_parts(batch)
+            headers = {"Content-Type": "application/x-tar", "X-File-Count": str(len(batch))}
+        else:
+            boundary = uuid.uuid4().hex
+            parts = _multipart_parts(batch, boundary)
+            headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        body = _StreamBody(parts, self.limiter)
+        started = time.monotonic()
+        try:
+            r = self._session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+        except Exception as e:  # connection refused, timeout, file vanished...
+            return None, None, None, str(e)
+        finally:
+            self._send_time += time.monotonic() - started
+        if not r.ok:
+            return r.status_code, None, _retry_after(r.headers.get("Retry-After")), f"HTTP {r.status_code}"
+        names = [os.path.basename(path) for path, _ in batch]
+        try:
+            reply = r.json()
+        except ValueError:
+            reply = None
+        if isinstance(reply, dict) and isinstance(reply.get("accepted"), list):
+            names = [n for n in names if n in set(reply["accepted"])]
+        return r.status_code, names, None, None